@@ -14,6 +14,7 @@ public:
     void begin();
     bool connect();
     bool publish(const char* topic, const char* payload);
+    bool publish(const char* topic, const uint8_t* payload, size_t length);
     bool isConnected();
     void loop();
 
@@ -1,5 +1,7 @@
 -- PostgreSQL aggregation function for time-series PM2.5 data
 -- This function should be executed in your Supabase SQL editor
+-- Superseded by aggregate_readings (web/backend/sql/aggregate_readings.sql), which takes any
+-- bucket width, a device list and several metrics; the backend no longer calls these.
 
 -- First, ensure TimescaleDB extension is available (if needed for time_bucket)
 -- If time_bucket is not available, we'll use a custom grouping approach
@@ -81,6 +81,23 @@ bool MQTTManager::publish(const char* topic, const char* payload) {
     return success;
 }
 
+bool MQTTManager::publish(const char* topic, const uint8_t* payload, size_t length) {
+    if (!mqttClient.connected()) {
+        Serial.println("Failed to publish - not connected");
+        return false;
+    }
+    
+    Serial.printf("Publishing %d binary bytes to topic: %s\n", (int)length, topic);
+    
+    bool success = mqttClient.publish(topic, payload, length);
+    if (success) {
+        Serial.println("Message published successfully");
+    } else {
+        Serial.println("Failed to publish message");
+    }
+    return success;
+}
+
 bool MQTTManager::isConnected() {
     return mqttClient.connected();
 }
@@ -21,6 +21,12 @@ MQTTManager mqtt;
 // JSON document for MQTT messages - increased size to accommodate all data
 StaticJsonDocument<512> jsonDoc;
 
+// Compact binary telemetry (build with -D SMARTPM_BINARY_PAYLOAD to publish it instead of JSON).
+// The backend detects the format per message, so JSON and binary devices can share a broker.
+const uint8_t BINARY_PAYLOAD_MAGIC = 0xB5;
+const uint8_t BINARY_PAYLOAD_VERSION = 1;
+const size_t BINARY_PAYLOAD_HEADER_SIZE = 24;
+
 // System State Enums
 enum WiFiState {
     WIFI_DISCONNECTED,
@@ -82,6 +88,7 @@ void manageWiFiConnection();
 void readSensorData();
 void updateDisplay();
 void publishMQTTData();
+size_t encodeBinaryPayload(uint8_t* buffer, size_t capacity, int aqiValue);
 void handleSerialOutput();
 void updateDisplayPartial();
 void showStatusTemporary(const String& status);
@@ -418,6 +425,21 @@ void publishMQTTData() {
     if (wifiState != WIFI_CONNECTED || !currentPMData.isValid) {
         return;
     }
+
+#ifdef SMARTPM_BINARY_PAYLOAD
+    // Binary record: ~40 bytes instead of ~250, no JSON serialization on the device
+    currentAQI = AQICalculator::calculateAQI(currentPMData.pm2_5);
+    uint8_t binaryBuffer[BINARY_PAYLOAD_HEADER_SIZE + 255];
+    size_t binarySize = encodeBinaryPayload(binaryBuffer, sizeof(binaryBuffer), currentAQI.value);
+    if (binarySize > 0 && mqtt.publish(MQTTConfig::TOPIC_TELEMETRY, binaryBuffer, binarySize)) {
+        Serial.println("MQTT: Data published successfully");
+        showStatusTemporary("Data Sent!");
+    } else {
+        Serial.println("MQTT: Failed to publish data");
+        showStatusTemporary("MQTT Failed!");
+    }
+    return;
+#endif
     
     // Create JSON document
     jsonDoc.clear();
@@ -492,6 +514,43 @@ void publishMQTTData() {
     }
 }
 
+// Layout (little-endian), decoded by web/backend/payload.py:
+//   magic u8 | version u8 | pm1 u16 | pm25 u16 | pm10 u16 | aqi u16 |
+//   timestamp u64 (ms) | wifi_rssi i8 | ipv4[4] | device_id length u8 | device_id
+// Returns the encoded size, or 0 if the buffer is too small.
+size_t encodeBinaryPayload(uint8_t* buffer, size_t capacity, int aqiValue) {
+    size_t idLength = strlen(MQTTConfig::DEVICE_ID);
+    if (idLength > 255) idLength = 255;
+    if (capacity < BINARY_PAYLOAD_HEADER_SIZE + idLength) return 0;
+
+    size_t pos = 0;
+    auto putU16 = [&](unsigned int value) {
+        uint16_t v = value > 0xFFFF ? 0xFFFF : value;
+        buffer[pos++] = v & 0xFF;
+        buffer[pos++] = v >> 8;
+    };
+
+    buffer[pos++] = BINARY_PAYLOAD_MAGIC;
+    buffer[pos++] = BINARY_PAYLOAD_VERSION;
+    putU16(currentPMData.pm1);
+    putU16(currentPMData.pm2_5);
+    putU16(currentPMData.pm10);
+    putU16(aqiValue < 0 ? 0 : aqiValue);
+    uint64_t timestamp = millis();
+    for (int i = 0; i < 8; i++) {
+        buffer[pos++] = (timestamp >> (8 * i)) & 0xFF;
+    }
+    int rssi = WiFi.RSSI();
+    buffer[pos++] = (uint8_t)(int8_t)constrain(rssi, -128, 127);
+    IPAddress ip = WiFi.localIP();
+    for (int i = 0; i < 4; i++) {
+        buffer[pos++] = ip[i];
+    }
+    buffer[pos++] = (uint8_t)idLength;
+    memcpy(buffer + pos, MQTTConfig::DEVICE_ID, idLength);
+    return pos + idLength;
+}
+
 // ========================================================================================
 // UTILITY AND INITIALIZATION FUNCTIONS
 // ========================================================================================
@@ -0,0 +1,153 @@
+# Columnar bucket aggregation for SmartPM2.5 Backend
+# Shared by /api/readings/history and the aggregated-readings fallback.
+
+from datetime import datetime, timezone
+
+import numpy as np
+
+METRICS = ("pm1", "pm25", "pm10")
+
+
+def _days_from_civil(y, m, d):
+    # Howard Hinnant's days-from-civil, vectorized; returns days since 1970-01-01
+    y = y - (m <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    mp = (m + 9) % 12
+    doy = (153 * mp + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def parse_timestamps(values) -> tuple:
+    """Parse ISO-8601 timestamps to epoch microseconds in bulk.
+
+    Handles the `YYYY-MM-DDTHH:MM:SS[.ffffff][Z|+HH:MM]` strings Supabase
+    returns with integer arithmetic over the raw bytes. Rows in any other
+    layout go through `datetime.fromisoformat`. Returns `(micros, valid)`
+    where `valid` masks out rows that could not be parsed.
+    """
+    n = len(values)
+    if n == 0:
+        return np.zeros(0, np.int64), np.zeros(0, bool)
+    try:
+        raw = np.array([v or "" for v in values], dtype="S32")
+    except (UnicodeEncodeError, TypeError):
+        raw = np.zeros(n, dtype="S32")
+    b = raw.view(np.uint8).reshape(n, 32)
+
+    def num(i, width):
+        v = b[:, i].astype(np.int64) - 48
+        for k in range(1, width):
+            v = v * 10 + (b[:, i + k].astype(np.int64) - 48)
+        return v
+
+    fast = (b[:, 4] == 45) & (b[:, 7] == 45) & (b[:, 13] == 58) & (b[:, 16] == 58)
+    secs = num(11, 2) * 3600 + num(14, 2) * 60 + num(17, 2)
+    micros = np.zeros(n, np.int64)
+    # pos tracks where the UTC offset starts: after seconds and any fraction
+    pos = np.full(n, 19, np.int64)
+    run = b[:, 19] == 46
+    pos += run
+    for k in range(6):
+        dk = b[:, 20 + k]
+        run &= (dk >= 48) & (dk <= 57)
+        micros += run * ((dk.astype(np.int64) - 48) * 10 ** (5 - k))
+        pos += run
+    sign_c = np.take_along_axis(b, pos[:, None], 1)[:, 0]
+    sign = (sign_c == 43).astype(np.int64) - (sign_c == 45)
+    if sign.any():
+        def at(offset):
+            return np.take_along_axis(b, (pos + offset)[:, None], 1)[:, 0].astype(np.int64) - 48
+        secs -= sign * ((at(1) * 10 + at(2)) * 3600 + (at(4) * 10 + at(5)) * 60)
+    out = (_days_from_civil(num(0, 4), num(5, 2), num(8, 2)) * 86400 + secs) * 1_000_000 + micros
+    valid = fast.copy()
+
+    for i in np.flatnonzero(~fast):
+        try:
+            dt = datetime.fromisoformat(str(values[i]).replace("Z", "+00:00"))
+        except Exception:
+            continue
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        out[i] = int(dt.timestamp() * 1_000_000)
+        valid[i] = True
+    return out, valid
+
+
+def to_micros(dt: datetime) -> int:
+    """Epoch microseconds for a datetime; naive values are taken as UTC."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1_000_000)
+
+
+def column(rows: list, name: str) -> np.ndarray:
+    """Pull one numeric column out of row dicts; missing values become NaN."""
+    return np.array([r.get(name) for r in rows], dtype=float)
+
+
+def _percentile_sorted(sorted_vals, starts, counts, q):
+    # Linear interpolation (numpy's default method) within each bucket's slice
+    pos = starts + (counts - 1) * (q / 100.0)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, starts + counts - 1)
+    frac = pos - lo
+    return sorted_vals[lo] * (1 - frac) + sorted_vals[hi] * frac
+
+
+def aggregate(ts_us: np.ndarray, columns: dict, start_us: int, end_us: int,
+              width_us: int, n_buckets: int, percentiles=()) -> dict:
+    """Bucket rows by time and compute per-bucket statistics.
+
+    Rows are assigned to `(ts - start) // width`, and rows at exactly
+    `end_us` fall into the last bucket. For every metric in `columns` the
+    result holds avg, min, max, median, `p<q>` for each requested
+    percentile, and `last` (value of the newest row in the bucket). Buckets
+    without data hold NaN. `count` is the number of rows per bucket.
+    """
+    keep = (ts_us >= start_us) & (ts_us <= end_us)
+    idx = np.minimum((ts_us[keep] - start_us) // width_us, n_buckets - 1)
+    result = {"count": np.bincount(idx, minlength=n_buckets)}
+    for name, values in columns.items():
+        vals = values[keep]
+        ok = ~np.isnan(vals)
+        b_idx = idx[ok]
+        vals = vals[ok]
+        counts = np.bincount(b_idx, minlength=n_buckets)
+        sums = np.bincount(b_idx, weights=vals, minlength=n_buckets)
+        nonempty = counts > 0
+        stats = {}
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats["avg"] = np.where(nonempty, sums / counts, np.nan)
+
+        # One sort by (bucket, value) serves min, max, median and percentiles
+        order = np.lexsort((vals, b_idx))
+        sorted_vals = vals[order]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        ne_starts = starts[nonempty]
+        ne_counts = counts[nonempty]
+
+        def per_bucket(filled):
+            out = np.full(n_buckets, np.nan)
+            out[nonempty] = filled
+            return out
+
+        stats["min"] = per_bucket(sorted_vals[ne_starts])
+        stats["max"] = per_bucket(sorted_vals[ne_starts + ne_counts - 1])
+        stats["median"] = per_bucket(_percentile_sorted(sorted_vals, ne_starts, ne_counts, 50))
+        for q in percentiles:
+            stats[f"p{q:g}"] = per_bucket(_percentile_sorted(sorted_vals, ne_starts, ne_counts, q))
+
+        # Newest row per bucket: end of each bucket's slice when ordered by time
+        by_time = np.lexsort((ts_us[keep][ok], b_idx))
+        stats["last"] = per_bucket(vals[by_time][ne_starts + ne_counts - 1])
+        result[name] = stats
+    return result
+
+
+def value_or_none(v, digits: int = 2):
+    """Round a float for JSON output, mapping NaN to None."""
+    if v is None or np.isnan(v):
+        return None
+    return round(float(v), digits)
@@ -0,0 +1,110 @@
+# Air Quality Index for SmartPM2.5 Backend
+# Vectorized port of the firmware's AQICalculator (src/AQICalculator.cpp)
+# plus the EPA NowCast, so bucketed PM2.5 values get an AQI that matches
+# them instead of the device-reported AQI of one reading.
+
+import numpy as np
+
+from aggregation import column, parse_timestamps
+
+# AQICalculator::BREAKPOINTS and AQI_LEVELS: segment i maps PM2.5 in
+# [C_LO[i], C_HI[i]] (µg/m³) linearly onto AQI [I_LO[i], I_HI[i]]
+C_LO = np.array([0, 12, 35, 55, 150, 250], dtype=float)
+C_HI = np.array([12, 35, 55, 150, 250, 500], dtype=float)
+I_LO = np.array([0, 51, 101, 151, 201, 301], dtype=float)
+I_HI = np.array([50, 100, 150, 200, 300, 500], dtype=float)
+
+NOWCAST_HOURS = 12
+NOWCAST_MIN_WEIGHT = 0.5
+
+
+def pm25_to_aqi(pm25) -> np.ndarray:
+    """AQI for every PM2.5 value in `pm25`; NaN stays NaN.
+
+    Same segments as AQICalculator::calculateAQI, with two differences: the
+    slope is computed in floating point (the firmware divides integers, so
+    its values step coarsely), and concentrations above 500 cap at AQI 500
+    instead of wrapping to the first segment. Values are not truncated; the
+    firmware's `(int)` cast is left to the caller.
+    """
+    c = np.asarray(pm25, dtype=float)
+    # First segment whose upper bound is >= c (boundaries belong to the lower segment)
+    seg = np.minimum(np.searchsorted(C_HI, c, side="left"), len(C_HI) - 1)
+    aqi = (I_HI[seg] - I_LO[seg]) / (C_HI[seg] - C_LO[seg]) * (c - C_LO[seg]) + I_LO[seg]
+    return np.clip(aqi, 0, 500)
+
+
+def nowcast(hourly, at=None) -> np.ndarray:
+    """EPA NowCast PM2.5 from hourly averages.
+
+    `hourly` has hours on the last axis, oldest first, NaN where an hour has
+    no data; leading axes (e.g. devices) are computed in the same pass. The
+    result at hour h weights hours h, h-1, ... h-11 by w**0, w**1, ... where
+    w = min/max over those hours, floored at 0.5. It is NaN unless at least
+    two of the three most recent hours have data. `at` selects the hours to
+    evaluate (default every hour); the result has `len(at)` on the last axis.
+    """
+    h = np.asarray(hourly, dtype=float)
+    pad = np.full(h.shape[:-1] + (NOWCAST_HOURS - 1,), np.nan)
+    windows = np.lib.stride_tricks.sliding_window_view(np.concatenate([pad, h], axis=-1), NOWCAST_HOURS, axis=-1)
+    if at is not None:
+        windows = windows[..., np.asarray(at, dtype=np.int64), :]
+    windows = windows[..., ::-1]  # newest hour first
+    present = ~np.isnan(windows)
+
+    # fmin/fmax skip NaN and give NaN (no warning) when a window is empty
+    lo = np.fmin.reduce(windows, axis=-1)
+    hi = np.fmax.reduce(windows, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weight = np.where(hi > 0, lo / hi, 1.0)
+    weight = np.maximum(weight, NOWCAST_MIN_WEIGHT)
+    factors = weight[..., None] ** np.arange(NOWCAST_HOURS)
+    factors = np.where(present, factors, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        value = (factors * np.where(present, windows, 0.0)).sum(axis=-1) / factors.sum(axis=-1)
+    enough = present[..., :3].sum(axis=-1) >= 2
+    return np.where(enough, value, np.nan)
+
+
+def hourly_means(rows: list, start_s: int, n_hours: int, metric: str = "pm25") -> np.ndarray:
+    """(devices, n_hours) matrix of hourly `metric` averages from 1h readings_rollup rows.
+
+    Hour 0 starts at `start_s`; hours without data are NaN. Rows of the same
+    device and hour (stored plus pending deltas) are merged. Devices are in
+    sorted id order.
+    """
+    if not rows:
+        return np.full((0, n_hours), np.nan)
+    ts_us, valid = parse_timestamps([r["bucket_start"] for r in rows])
+    hour = ts_us // 3_600_000_000 - start_s // 3600
+    devices, device_idx = np.unique([r["device_id"] for r in rows], return_inverse=True)
+    keep = valid & (hour >= 0) & (hour < n_hours)
+    flat = device_idx[keep] * n_hours + hour[keep]
+    size = len(devices) * n_hours
+    counts = np.bincount(flat, weights=column(rows, "count")[keep], minlength=size)
+    sums = np.bincount(flat, weights=column(rows, f"{metric}_sum")[keep], minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return means.reshape(len(devices), n_hours)
+
+
+def fleet_nowcast(rows: list, at_s) -> np.ndarray:
+    """NowCast PM2.5 averaged over devices at each time in `at_s` (epoch seconds).
+
+    `rows` are 1h readings_rollup rows covering the 11 hours before the
+    earliest time onwards. Each time is evaluated at the hour it falls in
+    (a time on an hour boundary belongs to the hour before), with the
+    current partial hour counting as the most recent one. NaN where no device
+    has enough data.
+    """
+    at_s = np.asarray(at_s, dtype=float)
+    if not rows or not len(at_s):
+        return np.full(len(at_s), np.nan)
+    at_hour = (np.ceil(at_s).astype(np.int64) - 1) // 3600
+    first = int(at_hour.min()) - (NOWCAST_HOURS - 1)
+    hourly = hourly_means(rows, first * 3600, int(at_hour.max()) - first + 1)
+    per_device = nowcast(hourly, at=at_hour - first)
+    present = ~np.isnan(per_device)
+    counts = present.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, np.where(present, per_device, 0.0).sum(axis=0) / counts, np.nan)
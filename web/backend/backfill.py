@@ -0,0 +1,419 @@
+# Historical backfill for SmartPM2.5 Backend
+# Loads readings that devices kept while offline, or that are migrated from
+# other sensor networks, straight into storage instead of one MQTT message
+# at a time. Input is JSONL (the document the firmware publishes, or flat
+# rows as /api/v1/readings/export writes them) or CSV with the readings
+# columns. Lines are normalized like on_message, inserted in chunks from a
+# pool of threads, and the byte offset up to which every chunk is stored is
+# checkpointed, so an interrupted import resumes where it stopped. Rows
+# already stored are skipped by the readings unique key, so re-running a
+# file is safe. Rollups of the days touched are rebuilt at the end.
+#
+# Usage:
+#   python backfill.py offline-device.jsonl other-network.csv
+#   python backfill.py --workers 8 --chunk-size 2000 dump.jsonl
+#   python backfill.py --restart dump.jsonl          # ignore the checkpoint
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from dedup import DuplicateFilter
+from ingest import build_row, normalize_timestamp
+from rollups import RESOLUTIONS
+from storage import READING_COLUMNS, TEST_DEVICE_ID, canonical_iso, open_store
+
+logger = logging.getLogger("smartpm")
+
+# Device timestamps below this are uptime (millis() since boot), not wall-clock time
+MIN_EPOCH_MS = 1_420_070_400_000  # 2015-01-01
+
+INT_COLUMNS = ("pm1", "pm25", "pm10", "aqi", "timestamp", "wifi_rssi")
+ROW_COLUMNS = READING_COLUMNS[1:]  # everything but the generated id
+
+
+class RecordError(ValueError):
+    """Raised for an input line that cannot become a readings row."""
+
+
+def _int(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip()
+    try:
+        return int(text)
+    except ValueError:
+        return int(float(text))
+
+
+def parse_record(data: dict) -> dict:
+    """A firmware JSON document or a flat readings row -> a row ready to insert.
+
+    The timestamp is normalized as on_message does. created_at is taken from
+    the record, or else from the timestamp when that is wall-clock time; a
+    reading with only an uptime timestamp cannot be placed and is rejected.
+    """
+    try:
+        if "readings" in data:
+            row = build_row(data, (data.get("metadata") or {}).get("timestamp"))
+        else:
+            row = {c: data.get(c) for c in ROW_COLUMNS if c != "created_at"}
+        for c in INT_COLUMNS:
+            row[c] = _int(row.get(c))
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise RecordError(f"malformed record: {e!r}")
+    if not row.get("device_id"):
+        raise RecordError("no device_id")
+    row["device_id"] = str(row["device_id"])
+    row["ip_address"] = row.get("ip_address") or None
+
+    created = data.get("created_at")
+    if created:
+        try:
+            created = canonical_iso(created)
+        except ValueError:
+            raise RecordError(f"invalid created_at: {created!r}")
+    if row["timestamp"] is not None:
+        row["timestamp"] = normalize_timestamp(row["timestamp"])
+    elif created:
+        row["timestamp"] = int(datetime.fromisoformat(created).timestamp() * 1000)
+    if not created:
+        if row["timestamp"] is None or row["timestamp"] < MIN_EPOCH_MS:
+            raise RecordError("no created_at, and the timestamp is not wall-clock time")
+        created = canonical_iso(datetime.fromtimestamp(row["timestamp"] / 1000, timezone.utc))
+    row["created_at"] = created
+    return row
+
+
+def detect_format(path: str) -> str:
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def read_records(path: str, fmt: str, offset: int = 0):
+    """(offset after the line, record dict or RecordError) for every line from byte `offset` on.
+
+    Works on bytes so offsets are exact; CSV records therefore cannot span
+    lines. The CSV header is always read from the start of the file.
+    """
+    with open(path, "rb") as f:
+        header = None
+        if fmt == "csv":
+            first = f.readline()
+            header = next(csv.reader([first.decode("utf-8-sig")]))
+            header = [h.strip() for h in header]
+            offset = max(offset, len(first))
+        f.seek(offset)
+        for line in f:
+            offset += len(line)
+            text = line.decode("utf-8", errors="replace").strip()
+            if not text:
+                continue
+            try:
+                if fmt == "csv":
+                    values = next(csv.reader([text]))
+                    yield offset, dict(zip(header, values))
+                else:
+                    data = json.loads(text)
+                    if not isinstance(data, dict):
+                        raise ValueError("not a JSON object")
+                    yield offset, data
+            except (ValueError, csv.Error, StopIteration) as e:
+                yield offset, RecordError(f"unreadable line: {e}")
+
+
+def _day(created_iso: str) -> int:
+    return int(datetime.fromisoformat(created_iso).timestamp()) // 86400 * 86400
+
+
+class Checkpoint:
+    """Progress of one input file, kept next to it (or in `directory`) as JSON.
+
+    `offset` is the byte offset up to which every line is stored; `days`
+    are the UTC days holding stored rows whose rollups are not rebuilt yet.
+    """
+
+    def __init__(self, path: str, directory: str = None):
+        name = os.path.basename(path) + ".checkpoint"
+        self.path = os.path.join(directory, name) if directory else path + ".checkpoint"
+        self.offset = 0
+        self.rows = 0
+        self.days = set()
+        self.done = False
+
+    def load(self, size: int) -> bool:
+        """Read a saved checkpoint; False (starting over) when there is none or the file shrank."""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        if state.get("offset", 0) > size:
+            logger.warning(f"{self.path} is past the end of the file; starting over")
+            return False
+        self.offset = state.get("offset", 0)
+        self.rows = state.get("rows", 0)
+        self.days = set(state.get("days", []))
+        self.done = state.get("done", False) and self.offset == size
+        return True
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"offset": self.offset, "rows": self.rows, "days": sorted(self.days), "done": self.done,
+                       "updated_at": datetime.now(timezone.utc).isoformat()}, f)
+        os.replace(tmp, self.path)
+
+
+class Backfill:
+    """Streams input files into `store.insert` in chunks on `workers` threads.
+
+    At most 2 x `workers` chunks are in flight, so memory is bounded by the
+    chunk size whatever the file size. A chunk is retried `max_attempts`
+    times with doubling backoff; when it still fails, nothing more is
+    submitted and the checkpoint keeps the offset before it.
+    """
+
+    def __init__(self, store, workers: int = 4, chunk_size: int = 1000, max_attempts: int = 3,
+                 base_delay: float = 0.5, dedup_capacity: int = 1_000_000, checkpoint_dir: str = None,
+                 checkpoint_interval: float = 2.0, report_interval: float = 5.0, rollup_retention: dict = None,
+                 out=sys.stderr):
+        self.store = store
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.report_interval = report_interval
+        self.rollup_retention = rollup_retention or {}
+        self.out = out
+        # Repeats within the input; rows stored earlier are skipped by the unique key instead
+        self.duplicates = DuplicateFilter(capacity=dedup_capacity, window=float("inf"),
+                                          key=lambda r: (r["device_id"], r["timestamp"], r["created_at"]))
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def stop(self):
+        self._stop.set()
+
+    def _insert(self, rows: list, stats: dict):
+        if not rows:
+            return
+        delay = self.base_delay
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.store.insert(rows)
+                return
+            except Exception as e:
+                if attempt == self.max_attempts or self._stop.is_set():
+                    raise
+                with self._lock:
+                    stats["retries"] += 1
+                logger.warning(f"Inserting {len(rows)} rows failed (attempt {attempt}), retrying in {delay:g}s: {e}")
+                self._stop.wait(delay)
+                delay *= 2
+
+    def run_file(self, path: str, fmt: str = None, restart: bool = False, rollups: bool = True) -> dict:
+        """Import one file, then rebuild rollups of its days; returns its counters.
+
+        Raises RuntimeError when a chunk cannot be stored. After stop() (or
+        Ctrl-C) the checkpoint is saved and the counters say "interrupted".
+        """
+        fmt = fmt or detect_format(path)
+        size = os.path.getsize(path)
+        checkpoint = Checkpoint(path, self.checkpoint_dir)
+        if not restart and checkpoint.load(size):
+            if checkpoint.done:
+                self._print(f"{path}: already imported ({checkpoint.rows:,} rows); use --restart to load it again")
+                return {"path": path, "stored": 0, "skipped": True}
+            if checkpoint.offset:
+                self._print(f"{path}: resuming at byte {checkpoint.offset:,} ({checkpoint.rows:,} rows stored before)")
+
+        stats = {"path": path, "read": 0, "stored": 0, "duplicates": 0, "invalid": 0, "ignored": 0,
+                 "chunks": 0, "retries": 0, "seconds": 0.0}
+        start_offset = checkpoint.offset
+        started = time.perf_counter()
+        # Chunk sequence number -> end offset, and the ones stored but not yet contiguous
+        ends = {}
+        stored_seqs = set()
+        next_commit = [0]
+        failure = []
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        last_save = [time.monotonic()]
+
+        def finished(seq, rows, days, future):
+            slots.release()
+            error = future.exception()
+            with self._lock:
+                if error is not None:
+                    failure.append(error)
+                    self._stop.set()
+                    return
+                stats["stored"] += len(rows)
+                checkpoint.rows += len(rows)
+                checkpoint.days |= days
+                stored_seqs.add(seq)
+                while next_commit[0] in stored_seqs:
+                    stored_seqs.discard(next_commit[0])
+                    checkpoint.offset = ends.pop(next_commit[0])
+                    next_commit[0] += 1
+                if time.monotonic() - last_save[0] >= self.checkpoint_interval:
+                    checkpoint.save()
+                    last_save[0] = time.monotonic()
+
+        def submit(pool, rows, end):
+            slots.acquire()
+            seq = stats["chunks"]
+            stats["chunks"] += 1
+            with self._lock:
+                ends[seq] = end
+            days = {_day(r["created_at"]) for r in rows}
+            future = pool.submit(self._insert, rows, stats)
+            future.add_done_callback(lambda f: finished(seq, rows, days, f))
+
+        last_report = time.monotonic()
+        chunk = []
+        offset = start_offset
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="backfill") as pool:
+            try:
+                for offset, record in read_records(path, fmt, start_offset):
+                    if self._stop.is_set():
+                        break
+                    stats["read"] += 1
+                    try:
+                        if isinstance(record, RecordError):
+                            raise record
+                        row = parse_record(record)
+                    except RecordError as e:
+                        stats["invalid"] += 1
+                        if stats["invalid"] <= 10:
+                            self._print(f"{path}: skipping line ending at byte {offset:,}: {e}")
+                        continue
+                    if row["device_id"] == TEST_DEVICE_ID:
+                        stats["ignored"] += 1
+                    elif self.duplicates.seen(row, now=0.0):
+                        stats["duplicates"] += 1
+                    else:
+                        chunk.append(row)
+                    if len(chunk) >= self.chunk_size:
+                        submit(pool, chunk, offset)
+                        chunk = []
+                    if time.monotonic() - last_report >= self.report_interval:
+                        self._report(stats, offset - start_offset, size - start_offset, started)
+                        last_report = time.monotonic()
+                if not self._stop.is_set():
+                    # Also submitted when empty: trailing skipped lines count as done once
+                    # every chunk before them is stored
+                    submit(pool, chunk, offset)
+            except KeyboardInterrupt:
+                # In-flight chunks still finish, so the checkpoint covers them
+                self.stop()
+        stats["seconds"] = time.perf_counter() - started
+
+        if failure:
+            checkpoint.save()
+            raise RuntimeError(f"{path}: insert failed after {self.max_attempts} attempts: {failure[0]} "
+                               f"(checkpoint at byte {checkpoint.offset:,}; re-run to resume)")
+        if self._stop.is_set():
+            checkpoint.save()
+            stats["interrupted"] = True
+            return stats
+        self._report(stats, size - start_offset, size - start_offset, started)
+        if rollups:
+            stats["rollup_buckets"] = self.rebuild_rollups(checkpoint)
+            self._print(f"{path}: rebuilt {stats['rollup_buckets']:,} rollup buckets")
+        checkpoint.done = True
+        checkpoint.save()
+        return stats
+
+    def rebuild_rollups(self, checkpoint: Checkpoint, now_s: float = None) -> int:
+        """Recompute every rollup resolution for the checkpoint's days; returns buckets written.
+
+        Today is left alone, since live readings may still be on their way
+        into it (rebuild it later with /api/internal/rollups/rebuild).
+        Resolutions whose retention has already passed a day are skipped, as
+        compaction would delete them again.
+        """
+        now_s = time.time() if now_s is None else now_s
+        today = int(now_s) // 86400 * 86400
+        buckets = 0
+        for day in sorted(checkpoint.days):
+            if day >= today:
+                continue
+            start = datetime.fromtimestamp(day, timezone.utc)
+            for resolution_s in RESOLUTIONS.values():
+                retention = self.rollup_retention.get(resolution_s, 0)
+                if retention and day + 86400 < now_s - retention:
+                    continue
+                buckets += self.store.rebuild_rollups(resolution_s, start.isoformat(),
+                                                      (start + timedelta(days=1)).isoformat())
+            checkpoint.days.discard(day)
+            checkpoint.save()
+        return buckets
+
+    def _report(self, stats: dict, done_bytes: int, total_bytes: int, started: float):
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        rate = stats["stored"] / elapsed
+        pct = 100.0 * done_bytes / total_bytes if total_bytes else 100.0
+        eta = (total_bytes - done_bytes) / (done_bytes / elapsed) if done_bytes else 0
+        self._print(f"{stats['path']}: {pct:5.1f}%  {stats['stored']:,} rows stored  {rate:,.0f} rows/s  "
+                    f"{done_bytes / elapsed / 1e6:.1f} MB/s  duplicates {stats['duplicates']:,}  "
+                    f"invalid {stats['invalid']:,}  eta {eta:.0f}s")
+
+    def _print(self, line: str):
+        print(line, file=self.out, flush=True)
+
+
+def main_cli(argv=None) -> int:
+    # Read here rather than at import so Backfill works without the backend's environment.
+    # The importer never talks to MQTT, and the api role does not require its settings.
+    os.environ.setdefault("BACKEND_ROLE", "api")
+    import config
+
+    parser = argparse.ArgumentParser(description="Import historical readings from JSONL or CSV files")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="default: from the file extension")
+    parser.add_argument("--workers", type=int, default=config.INGEST_WORKERS, help="parallel insert threads")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="rows per insert")
+    parser.add_argument("--checkpoint-dir", help="where checkpoints go (default: next to each file)")
+    parser.add_argument("--restart", action="store_true", help="ignore existing checkpoints")
+    parser.add_argument("--no-rollups", action="store_true", help="do not rebuild rollups of the days imported")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="seconds between progress lines")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    store = open_store(config.STORAGE_BACKEND, config.SUPABASE_URL, config.SUPABASE_KEY, config.STORAGE_PATH)
+    backfill = Backfill(store, workers=max(1, args.workers), chunk_size=max(1, args.chunk_size),
+                        checkpoint_dir=args.checkpoint_dir, report_interval=args.report_interval,
+                        rollup_retention=config.ROLLUP_RETENTION)
+    totals = {"stored": 0, "duplicates": 0, "invalid": 0, "seconds": 0.0}
+    try:
+        for path in args.files:
+            stats = backfill.run_file(path, args.format, args.restart, rollups=not args.no_rollups)
+            for k in totals:
+                totals[k] += stats.get(k, 0)
+            if stats.get("interrupted"):
+                print("Interrupted; re-run the same command to resume", file=sys.stderr)
+                return 130
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+    rate = totals["stored"] / totals["seconds"] if totals["seconds"] else 0
+    print(f"Done: {totals['stored']:,} rows stored in {totals['seconds']:.1f}s ({rate:,.0f} rows/s), "
+          f"{totals['duplicates']:,} duplicates and {totals['invalid']:,} invalid lines skipped", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,266 @@
+# Offline end-to-end benchmark for SmartPM2.5 Backend
+# Replays synthetic multi-device telemetry into on_message, backed by the
+# in-memory FakeStore instead of Supabase, then drives the HTTP endpoints
+# concurrently through the ASGI app. No broker, database or network needed.
+#
+# Usage:
+#   python bench/bench_e2e.py                      # run and compare with bench/baselines.json
+#   python bench/bench_e2e.py --update-baselines   # run and store the results as the new baseline
+#
+# Exits with status 1 when a metric regresses beyond --tolerance.
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BENCH_DIR))
+
+# Settings main.py reads at import time; nothing here connects anywhere
+_tmp = tempfile.mkdtemp(prefix="smartpm-bench-")
+for key, value in {
+    "MQTT_BROKER": "bench.invalid",
+    "MQTT_USERNAME": "bench",
+    "MQTT_PASSWORD": "bench",
+    "STORAGE_BACKEND": "sqlite",
+    "STORAGE_PATH": os.path.join(_tmp, "unused.sqlite3"),
+    "SPOOL_PATH": os.path.join(_tmp, "spool.db"),
+    "BACKEND_LOG_PATH": os.path.join(_tmp, "backend.log"),
+    # Replays a fleet's messages as fast as possible; per-device budgets would throttle it
+    "RATE_LIMIT_PER_DEVICE": "0",
+}.items():
+    os.environ.setdefault(key, value)
+
+import httpx
+import numpy as np
+
+import main
+from fakes import FakeMessage, FakeStore
+from payload import encode_binary
+
+DEFAULT_BASELINES = os.path.join(BENCH_DIR, "baselines.json")
+
+ENDPOINTS = {
+    "latest": "/api/readings/latest",
+    "latest_batch": "/api/readings/latest-batch?limit=50",
+    "history_1h": "/api/readings/history?period=1h",
+    "history_1h_minmax": "/api/readings/history?period=1h&points=500&downsample=minmax",
+    "history_device": "/api/readings/history?period=5min&device_id=ESP32_PM25_000",
+    "aggregated_1h": "/api/v1/readings/aggregated?timeframe=1h",
+    "fleet_summary": "/api/v1/fleet/summary?window=1h",
+}
+
+
+def make_messages(count: int, devices: int, binary_ratio: float, seed: int = 7) -> list:
+    """Synthetic telemetry: one topic per device, a mix of JSON and binary payloads."""
+    rng = random.Random(seed)
+    base_ms = int(time.time() * 1000)
+    messages = []
+    for i in range(count):
+        device_id = f"ESP32_PM25_{i % devices:03d}"
+        pm25 = max(0, int(rng.gauss(25, 10)))
+        row = {"device_id": device_id, "pm1": max(0, pm25 - 5), "pm25": pm25, "pm10": pm25 + 8,
+               "aqi": pm25 * 2, "timestamp": base_ms + i, "wifi_rssi": -rng.randint(40, 90),
+               "ip_address": f"10.0.{i % devices // 256}.{i % 256}"}
+        if rng.random() < binary_ratio:
+            payload = encode_binary(row)
+        else:
+            payload = json.dumps({
+                "device_id": device_id,
+                "readings": {"pm1": row["pm1"], "pm25": pm25, "pm10": row["pm10"]},
+                "aqi": {"value": row["aqi"], "category": "Moderate"},
+                "metadata": {"timestamp": row["timestamp"], "wifi_rssi": row["wifi_rssi"], "ip": row["ip_address"]},
+            }).encode()
+        messages.append(((device_id, row["timestamp"]), FakeMessage(f"smartpm25/{device_id}/data", payload)))
+    return messages
+
+
+def percentiles(samples_ms) -> dict:
+    if not len(samples_ms):
+        return {"p50_ms": None, "p99_ms": None}
+    arr = np.asarray(samples_ms, dtype=float)
+    return {"p50_ms": round(float(np.percentile(arr, 50)), 3), "p99_ms": round(float(np.percentile(arr, 99)), 3)}
+
+
+def run_ingest(args, store: FakeStore) -> dict:
+    """Push every message through on_message; time the calls and the wait until rows are stored."""
+    messages = make_messages(args.messages, args.devices, args.binary_ratio)
+    submitted = {}
+    visible_ms = []
+    lock = threading.Lock()
+
+    def on_insert(rows, when):
+        with lock:
+            for row in rows:
+                started = submitted.pop((row["device_id"], row["timestamp"]), None)
+                if started is not None:
+                    visible_ms.append((when - started) * 1000)
+
+    store.on_insert = on_insert
+    started = time.perf_counter()
+    for key, msg in messages:
+        submitted[key] = time.perf_counter()
+        main.on_message(None, None, msg)
+    elapsed = time.perf_counter() - started
+
+    deadline = time.monotonic() + 60
+    while len(visible_ms) < len(messages) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    drained = time.perf_counter() - started
+    store.on_insert = None
+    return {
+        "messages": len(messages),
+        "msgs_per_sec": round(len(messages) / elapsed, 1),
+        "stored_per_sec": round(len(visible_ms) / drained, 1),
+        "lost": len(messages) - len(visible_ms),
+        "visible": percentiles(visible_ms),
+    }
+
+
+async def run_endpoints(args) -> dict:
+    """Hit every endpoint from `concurrency` clients while readings keep arriving."""
+    names = list(ENDPOINTS)
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    stop = threading.Event()
+
+    # Background ingest keeps invalidating cached responses, as in production
+    trickle = make_messages(10**6, args.devices, args.binary_ratio, seed=11)
+
+    def ingest_in_background():
+        interval = 1.0 / args.ingest_rate if args.ingest_rate else None
+        for _, msg in trickle:
+            if stop.is_set() or interval is None:
+                return
+            main.on_message(None, None, msg)
+            time.sleep(interval)
+
+    feeder = threading.Thread(target=ingest_in_background, daemon=True)
+    feeder.start()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker(worker_id: int):
+            for i in range(args.requests // args.concurrency):
+                name = names[(worker_id + i) % len(names)]
+                started = time.perf_counter()
+                response = await client.get(ENDPOINTS[name])
+                latencies[name].append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200 or "error" in response.json():
+                    errors[name] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(w) for w in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+
+    stop.set()
+    feeder.join()
+    total = sum(len(v) for v in latencies.values())
+    return {
+        "requests_per_sec": round(total / elapsed, 1),
+        "endpoints": {name: {**percentiles(latencies[name]), "errors": errors[name]} for name in names},
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, slack_ms: float) -> list:
+    """Metrics that got worse than the baseline by more than the tolerance."""
+    failures = []
+
+    def check_higher(label, value, base):
+        if base and value < base * (1 - tolerance):
+            failures.append(f"{label}: {value} < baseline {base} (-{tolerance:.0%})")
+
+    def check_lower(label, value, base):
+        if base is not None and value is not None and value > base * (1 + tolerance) + slack_ms:
+            failures.append(f"{label}: {value} ms > baseline {base} ms (+{tolerance:.0%} +{slack_ms} ms)")
+
+    check_higher("ingest msgs_per_sec", results["ingest"]["msgs_per_sec"], baseline["ingest"]["msgs_per_sec"])
+    for q in ("p50_ms", "p99_ms"):
+        check_lower(f"ingest visible {q}", results["ingest"]["visible"][q], baseline["ingest"]["visible"][q])
+    check_higher("requests_per_sec", results["load"]["requests_per_sec"], baseline["load"]["requests_per_sec"])
+    for name, stats in results["load"]["endpoints"].items():
+        base = baseline["load"]["endpoints"].get(name)
+        if base is None:
+            continue
+        for q in ("p50_ms", "p99_ms"):
+            check_lower(f"{name} {q}", stats[q], base[q])
+        if stats["errors"]:
+            failures.append(f"{name}: {stats['errors']} failed requests")
+    if results["ingest"]["lost"]:
+        failures.append(f"ingest lost {results['ingest']['lost']} readings")
+    return failures
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--binary-ratio", type=float, default=0.5)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1400)
+    parser.add_argument("--ingest-rate", type=float, default=200.0, help="messages/sec during the load phase")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="seconds added to every store call")
+    parser.add_argument("--baselines", default=DEFAULT_BASELINES)
+    parser.add_argument("--update-baselines", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative slowdown before failing")
+    parser.add_argument("--slack-ms", type=float, default=2.0, help="absolute latency slack for tiny values")
+    args = parser.parse_args()
+
+    # Per-message INFO logs would dominate the measurement and flood the terminal
+    logging.getLogger("smartpm").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    store = FakeStore(latency=args.db_latency)
+    main.store = store
+    main.recent_readings.load([])
+    main.ingest_writer.start()
+    main.rollup_flusher.start()
+    try:
+        ingest = run_ingest(args, store)
+        load = asyncio.run(run_endpoints(args))
+    finally:
+        main.ingest_writer.stop()
+        main.rollup_flusher.stop()
+        main.db.shutdown()
+
+    scenario = {k: getattr(args, k) for k in ("devices", "messages", "binary_ratio", "concurrency", "requests", "ingest_rate", "db_latency")}
+    results = {"scenario": scenario, "ingest": ingest, "load": load}
+
+    print(f"ingest: {ingest['msgs_per_sec']:.0f} msg/s into on_message, {ingest['stored_per_sec']:.0f} rows/s stored, "
+          f"visible p50 {ingest['visible']['p50_ms']} ms p99 {ingest['visible']['p99_ms']} ms, lost {ingest['lost']}")
+    print(f"load:   {load['requests_per_sec']:.0f} req/s at concurrency {args.concurrency}")
+    for name, stats in load["endpoints"].items():
+        print(f"  {name:<20} p50 {stats['p50_ms']:>9} ms   p99 {stats['p99_ms']:>9} ms   errors {stats['errors']}")
+
+    if args.update_baselines:
+        with open(args.baselines, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Baselines written to {args.baselines}")
+        return 0
+
+    if not os.path.exists(args.baselines):
+        print("No baselines yet; run with --update-baselines to record them")
+        return 0
+    with open(args.baselines) as f:
+        baseline = json.load(f)
+    if baseline.get("scenario") != scenario:
+        print(f"Scenario differs from the baseline's {baseline.get('scenario')}; not comparing")
+        return 0
+    failures = compare(results, baseline, args.tolerance, args.slack_ms)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    if not failures:
+        print("No regressions against baseline")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,39 @@
+# Decode cost per message: JSON (current firmware) vs the binary record
+# Usage: python bench/bench_payload.py [messages]
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payload import decode_payload, encode_binary
+
+
+def sample_messages():
+    row = {"device_id": "ESP32_PM25_001", "pm1": 8, "pm25": 12, "pm10": 20, "aqi": 50,
+           "timestamp": 1_700_000_000_123, "wifi_rssi": -67, "ip_address": "192.168.1.40"}
+    # Same document publishMQTTData() builds with ArduinoJson
+    as_json = json.dumps({
+        "device_id": row["device_id"],
+        "readings": {"pm1": row["pm1"], "pm25": row["pm25"], "pm10": row["pm10"]},
+        "metadata": {"timestamp": row["timestamp"], "wifi_rssi": row["wifi_rssi"], "ip": row["ip_address"], "wifi_attempts": 0},
+        "aqi": {"value": row["aqi"], "category": "Moderate", "health_message": "Acceptable air quality"},
+    }, separators=(",", ":")).encode()
+    return {"json": as_json, "binary": encode_binary(row)}
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    topic = "smartpm25/ESP32_PM25_001/data"
+    results = {}
+    for name, message in sample_messages().items():
+        best = min(timeit.repeat(lambda: decode_payload(message, topic), number=number, repeat=5))
+        results[name] = best / number * 1e9
+        print(f"{name:>6}: {len(message):4d} bytes  {results[name]:8.0f} ns/message")
+    print(f"binary decode is {results['json'] / results['binary']:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
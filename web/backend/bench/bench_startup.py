@@ -0,0 +1,150 @@
+# Cold-start benchmark for SmartPM2.5 Backend
+# Starts the app under uvicorn as a fresh process, the way a scale-to-zero
+# host wakes it, and measures how long until /health returns its first byte
+# and until /ready reports ready. A local stand-in broker accepts the MQTT
+# connection but stays silent for --broker-delay seconds, like a slow TLS
+# handshake to a remote broker. Uses the SQLite store; no network needed.
+#
+# Usage:
+#   python bench/bench_startup.py                 # fast start (default)
+#   python bench/bench_startup.py --compare       # fast start and FAST_START=0 side by side
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SilentBroker:
+    """Accepts TCP connections and closes each one after `delay` seconds without a byte."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._sock = socket.socket()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen()
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Timer(self.delay, conn.close).start()
+
+    def close(self):
+        self._sock.close()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get(url: str):
+    """Status code once the first byte arrives, or None while nothing listens yet."""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as resp:
+            resp.read(1)
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return None
+
+
+def run_once(fast: bool, broker_port: int, timeout: float) -> dict:
+    tmp = tempfile.mkdtemp(prefix="smartpm-startup-")
+    port = free_port()
+    env = {
+        **os.environ,
+        "FAST_START": "true" if fast else "false",
+        "MQTT_BROKER": "127.0.0.1",
+        "MQTT_PORT": str(broker_port),
+        "MQTT_USERNAME": "bench",
+        "MQTT_PASSWORD": "bench",
+        "STORAGE_BACKEND": "sqlite",
+        "STORAGE_PATH": os.path.join(tmp, "readings.sqlite3"),
+        "SPOOL_PATH": os.path.join(tmp, "spool.db"),
+        "BACKEND_LOG_PATH": os.path.join(tmp, "backend.log"),
+        "LOG_LEVEL": "WARNING",
+    }
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    result = {"health_ms": None, "ready_ms": None, "exit_code": None, "exit_ms": None}
+    base = f"http://127.0.0.1:{port}"
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                result["exit_code"] = proc.returncode
+                result["exit_ms"] = (time.perf_counter() - started) * 1000
+                break
+            if result["health_ms"] is None and get(base + "/health") == 200:
+                result["health_ms"] = (time.perf_counter() - started) * 1000
+            if result["health_ms"] is not None and get(base + "/ready") == 200:
+                result["ready_ms"] = (time.perf_counter() - started) * 1000
+                break
+            time.sleep(0.005)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return result
+
+
+def import_ms(runs: int) -> float:
+    env = {**os.environ, "MQTT_BROKER": "127.0.0.1", "MQTT_USERNAME": "bench", "MQTT_PASSWORD": "bench",
+           "STORAGE_BACKEND": "sqlite", "BACKEND_LOG_PATH": os.path.join(tempfile.mkdtemp(), "backend.log")}
+    code = "import time; t = time.perf_counter(); import main; print((time.perf_counter() - t) * 1000)"
+    times = [float(subprocess.check_output([sys.executable, "-c", code], cwd=BACKEND_DIR, env=env,
+                                           stderr=subprocess.DEVNULL).split()[-1]) for _ in range(runs)]
+    return statistics.median(times)
+
+
+def fmt(values) -> str:
+    values = [v for v in values if v is not None]
+    return f"{statistics.median(values):8.0f} ms" if values else "       never"
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Measure time from process start to first byte and to readiness")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--broker-delay", type=float, default=3.0, help="seconds the stand-in broker stays silent")
+    parser.add_argument("--timeout", type=float, default=20.0)
+    parser.add_argument("--compare", action="store_true", help="also run with FAST_START=0")
+    args = parser.parse_args()
+
+    broker = SilentBroker(args.broker_delay)
+    try:
+        print(f"import main: {import_ms(args.runs):.0f} ms (median of {args.runs})")
+        for fast in ([True, False] if args.compare else [True]):
+            runs = [run_once(fast, broker.port, args.timeout) for _ in range(args.runs)]
+            exits = [r["exit_code"] for r in runs if r["exit_code"] is not None]
+            note = (f"  (exited with code {exits[0]} in {len(exits)}/{len(runs)} runs, "
+                    f"after {fmt(r['exit_ms'] for r in runs).strip()})") if exits else ""
+            print(f"{'fast start' if fast else 'blocking':>10}: first byte {fmt(r['health_ms'] for r in runs)}, "
+                  f"ready {fmt(r['ready_ms'] for r in runs)}{note}")
+    finally:
+        broker.close()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,214 @@
+# In-memory stand-ins for the benchmark harness
+# FakeStore replaces Supabase (readings table, readings_rollup and the
+# aggregate_readings / rollup RPCs); FakeMessage replaces a paho MQTTMessage.
+
+import bisect
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from storage import TEST_DEVICE_ID, ReadingStore, _column_list, aggregate_spec, canonical_iso
+
+
+class FakeMessage:
+    """The two attributes on_message reads from a paho MQTTMessage."""
+
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+
+
+def _epoch(iso: str) -> float:
+    return datetime.fromisoformat(iso).timestamp()
+
+
+class FakeStore(ReadingStore):
+    """Readings kept in a sorted in-memory list, with optional per-call latency.
+
+    `latency` (seconds) is slept on every call to mimic a WAN round trip.
+    `on_insert(rows, when)` is called after rows become visible, so the
+    harness can measure ingest-to-visible latency.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = 0.0, on_insert=None):
+        self.latency = latency
+        self.on_insert = on_insert
+        self._lock = threading.Lock()
+        self._keys = []  # (canonical created_at, id), sorted
+        self._rows = []
+        self._unique = set()  # (device_id, timestamp, canonical created_at)
+        self._rollups = {}
+        self._next_id = 1
+        self.calls = {}
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _matches(self, row, include_test, device_ids):
+        if device_ids:
+            return row["device_id"] in device_ids
+        return include_test or row["device_id"] != TEST_DEVICE_ID
+
+    def insert(self, rows: list):
+        self._call("insert")
+        now_iso = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            for row in rows:
+                stored = {**row, "id": self._next_id, "created_at": row.get("created_at") or now_iso}
+                unique = (stored.get("device_id"), stored.get("timestamp"), canonical_iso(stored["created_at"]))
+                if unique in self._unique:
+                    continue
+                self._unique.add(unique)
+                self._next_id += 1
+                key = (canonical_iso(stored["created_at"]), stored["id"])
+                i = bisect.bisect(self._keys, key)
+                self._keys.insert(i, key)
+                self._rows.insert(i, stored)
+        if self.on_insert:
+            self.on_insert(rows, time.perf_counter())
+
+    def latest(self, limit: int, columns: str = "*", include_test: bool = False, device_ids=None) -> list:
+        self._call("latest")
+        names = _column_list(columns)
+        out = []
+        with self._lock:
+            for row in reversed(self._rows):
+                if self._matches(row, include_test, device_ids):
+                    out.append({k: row.get(k) for k in names})
+                    if len(out) >= limit:
+                        break
+        return out
+
+    def range(self, columns: str, start_iso: str, end_iso: str, limit: int,
+              newest_first: bool = False, after: dict = None, device_ids=None) -> list:
+        self._call("range")
+        names = _column_list(columns)
+        lo_key = (canonical_iso(start_iso), 0)
+        if after is not None:
+            lo_key = max(lo_key, (canonical_iso(after["created_at"]), after["id"] + 1))
+        hi_key = (canonical_iso(end_iso), float("inf"))
+        with self._lock:
+            lo = bisect.bisect_left(self._keys, lo_key)
+            hi = bisect.bisect_right(self._keys, hi_key)
+            rows = self._rows[lo:hi]
+        if newest_first:
+            rows = rows[::-1]
+        out = []
+        for row in rows:
+            if self._matches(row, False, device_ids):
+                out.append({k: row.get(k) for k in names})
+                if len(out) >= limit:
+                    break
+        return out
+
+    def aggregate(self, start_iso: str, end_iso: str, bucket_seconds: int, device_ids=None,
+                  metrics=("pm25",), stats=("avg",), percentiles=()) -> list:
+        # Same result as the aggregate_readings RPC
+        self._call("aggregate")
+        metrics, stats, percentiles = aggregate_spec(bucket_seconds, metrics, stats, percentiles)
+        width = int(bucket_seconds)
+        start, end = canonical_iso(start_iso), canonical_iso(end_iso)
+        with self._lock:
+            lo = bisect.bisect_left(self._keys, (start, 0))
+            hi = bisect.bisect_left(self._keys, (end, 0))
+            rows = self._rows[lo:hi]
+        buckets = {}
+        for row in rows:
+            if self._matches(row, False, device_ids):
+                bucket = int(_epoch(canonical_iso(row["created_at"])) // width * width)
+                buckets.setdefault(bucket, []).append(row)
+        result = []
+        for bucket, members in sorted(buckets.items()):
+            out = {"bucket_time": datetime.fromtimestamp(bucket, timezone.utc).isoformat(), "count": len(members)}
+            for metric in metrics:
+                values = [r[metric] for r in members if r.get(metric) is not None]
+                computed = {
+                    "avg": round(sum(values) / len(values), 2) if values else None,
+                    "min": min(values, default=None),
+                    "max": max(values, default=None),
+                    "count": len(values),
+                }
+                out[metric] = {s: computed[s] for s in stats}
+                for q in percentiles:
+                    out[metric][f"p{q:g}"] = round(float(np.percentile(values, q)), 2) if values else None
+            result.append(out)
+        return result
+
+    def rollup_range(self, resolution_s: int, start_iso: str, end_iso: str, limit: int = 10000, device_ids=None) -> list:
+        self._call("rollup_range")
+        start, end = canonical_iso(start_iso), canonical_iso(end_iso)
+        with self._lock:
+            rows = [
+                dict(r) for (res, dev, bucket), r in self._rollups.items()
+                if res == resolution_s and start <= bucket <= end and (not device_ids or dev in device_ids)
+            ]
+        rows.sort(key=lambda r: r["bucket_start"])
+        return rows[:limit]
+
+    def rollup_start(self, resolution_s: int):
+        self._call("rollup_start")
+        with self._lock:
+            return min((bucket for res, _, bucket in self._rollups if res == resolution_s), default=None)
+
+    def merge_rollups(self, rows: list):
+        self._call("merge_rollups")
+        with self._lock:
+            for row in rows:
+                bucket = canonical_iso(row["bucket_start"])
+                key = (row["resolution_s"], row["device_id"], bucket)
+                current = self._rollups.get(key)
+                if current is None:
+                    self._rollups[key] = {**row, "bucket_start": bucket}
+                    continue
+                current["count"] += row["count"]
+                for m in ("pm1", "pm25", "pm10"):
+                    current[f"{m}_sum"] += row[f"{m}_sum"]
+                    current[f"{m}_min"] = min(current[f"{m}_min"], row[f"{m}_min"])
+                    current[f"{m}_max"] = max(current[f"{m}_max"], row[f"{m}_max"])
+
+    def rebuild_rollups(self, resolution_s: int, start_iso: str, end_iso: str) -> int:
+        raise NotImplementedError("rebuild is not benchmarked")
+
+    def count(self, start_iso: str, end_iso: str) -> int:
+        self._call("count")
+        start, end = canonical_iso(start_iso), canonical_iso(end_iso)
+        with self._lock:
+            lo = bisect.bisect_left(self._keys, (start, 0))
+            hi = bisect.bisect_left(self._keys, (end, 0))
+            return sum(1 for row in self._rows[lo:hi] if row["device_id"] != TEST_DEVICE_ID)
+
+    def delete_range(self, start_iso: str, end_iso: str) -> int:
+        self._call("delete_range")
+        start, end = canonical_iso(start_iso), canonical_iso(end_iso)
+        with self._lock:
+            lo = bisect.bisect_left(self._keys, (start, 0))
+            hi = bisect.bisect_left(self._keys, (end, 0))
+            for row in self._rows[lo:hi]:
+                self._unique.discard((row.get("device_id"), row.get("timestamp"), canonical_iso(row["created_at"])))
+            del self._keys[lo:hi]
+            del self._rows[lo:hi]
+        return hi - lo
+
+    def delete_rollups(self, resolution_s: int, start_iso: str, end_iso: str) -> int:
+        self._call("delete_rollups")
+        start, end = canonical_iso(start_iso), canonical_iso(end_iso)
+        with self._lock:
+            doomed = [k for k in self._rollups if k[0] == resolution_s and start <= k[2] < end]
+            for key in doomed:
+                del self._rollups[key]
+        return len(doomed)
+
+    def __len__(self):
+        return len(self._rows)
@@ -0,0 +1,186 @@
+# Response cache for SmartPM2.5 Backend
+# TTL + LRU cache with single-flight deduplication for the history and
+# aggregated endpoints, plus the conditional GET validators (ETag and
+# Last-Modified) that let an unchanged poll answer 304 without a query.
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+
+def _cacheable(value) -> bool:
+    # Endpoints report failures as {"error": ...}; never keep those around
+    if isinstance(value, Rendered):
+        return not value.error
+    return not (isinstance(value, dict) and "error" in value)
+
+
+def _json_default(value):
+    # NumPy scalars and datetimes that slipped into a payload
+    if hasattr(value, "item"):
+        return value.item()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class Rendered:
+    """A JSON body serialized once, so cache hits are sent without encoding it again.
+
+    `newest` is the newest ingested reading's created_at when the payload was
+    computed; the response's validators are derived from it.
+    """
+
+    __slots__ = ("body", "error", "newest", "serialize_s")
+
+    def __init__(self, payload, newest: str = None):
+        started = time.perf_counter()
+        # Same output as Starlette's JSONResponse
+        self.body = json.dumps(payload, ensure_ascii=False, allow_nan=False, indent=None,
+                               separators=(",", ":"), default=_json_default).encode("utf-8")
+        self.serialize_s = time.perf_counter() - started
+        self.error = isinstance(payload, dict) and "error" in payload
+        self.newest = newest
+
+
+def validators(key: str, newest: str) -> dict:
+    """ETag and Last-Modified headers for a response to `key` (e.g. path + query) as of `newest`.
+
+    The ETag is weak because compressed and plain bodies share it. Returns
+    {} when nothing has been ingested yet, so the response carries none.
+    """
+    if not newest:
+        return {}
+    digest = hashlib.blake2b(f"{key}|{newest}".encode(), digest_size=12).hexdigest()
+    headers = {"ETag": f'W/"{digest}"', "Cache-Control": "no-cache"}
+    try:
+        modified = datetime.fromisoformat(newest.replace("Z", "+00:00"))
+    except ValueError:
+        return headers
+    if modified.tzinfo is None:
+        modified = modified.replace(tzinfo=timezone.utc)
+    headers["Last-Modified"] = format_datetime(modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def not_modified(request_headers, headers: dict) -> bool:
+    """True when the request's If-None-Match / If-Modified-Since match `headers` (from validators()).
+
+    If-None-Match takes precedence; tags compare weakly, as RFC 9110 asks for GET.
+    """
+    etag = headers.get("ETag")
+    if not etag:
+        return False
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since = request_headers.get("if-modified-since")
+    last_modified = headers.get("Last-Modified")
+    if not if_modified_since or not last_modified:
+        return False
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+
+class ResponseCache:
+    """Cache keyed on endpoint + normalized parameters.
+
+    An ingest invalidates every entry computed before it, once the entry is
+    older than `min_ttl` (or its own TTL, if shorter): that floor lets a
+    burst of polls share one computation while the fleet reports every few
+    seconds. An entry no reading has arrived since stays fresh for its TTL,
+    and up to `idle_factor` times that while ingest is idle, since the
+    answer can only drift as the window slides. Concurrent misses for one
+    key share a single computation.
+    """
+
+    def __init__(self, max_entries: int = 256, idle_factor: float = 5.0, min_ttl: float = 2.0):
+        self.max_entries = max_entries
+        self.idle_factor = idle_factor
+        self.min_ttl = min_ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._last_ingest = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def note_ingest(self):
+        """Record that new data arrived, making older entries stale; safe to call from any thread."""
+        self._last_ingest = time.monotonic()
+
+    def _fresh(self, entry) -> bool:
+        value, created, ttl = entry
+        age = time.monotonic() - created
+        if age < min(ttl, self.min_ttl):
+            return True
+        if created < self._last_ingest:
+            return False
+        return age < ttl * self.idle_factor
+
+    async def get_or_compute(self, key, ttl: float, compute):
+        """Return the cached value for `key`, or await `compute()` once for all callers."""
+        entry = self._entries.get(key)
+        if entry is not None and self._fresh(entry):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        flight = self._inflight.get(key)
+        if flight is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # The computation runs as its own task so one caller going away
+            # (e.g. a disconnected client) does not fail the others
+            flight = self._inflight[key] = [asyncio.ensure_future(self._compute(key, ttl, compute)), 0]
+        task = flight[0]
+        flight[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Abandon the shared computation only once nobody is waiting for it
+            if flight[1] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            flight[1] -= 1
+
+    async def _compute(self, key, ttl, compute):
+        created = time.monotonic()
+        try:
+            value = await compute()
+            if _cacheable(value):
+                self._store(key, (value, created, ttl))
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else None,
+        }
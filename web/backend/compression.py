@@ -0,0 +1,142 @@
+# Response compression for SmartPM2.5 Backend
+# History and aggregated responses are mostly repeated JSON keys and numbers
+# and shrink several times over. Brotli is used when the optional brotli
+# package is installed and the client accepts it, gzip otherwise. Streaming
+# bodies (CSV/NDJSON exports) are compressed chunk by chunk and flushed, so
+# they still stream; already-compressed formats and the SSE stream pass
+# through untouched.
+
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional; gzip covers every client
+    brotli = None
+
+# Content types never compressed: event streams must not be buffered, Parquet is compressed already
+SKIP_TYPES = ("text/event-stream", "application/vnd.apache.parquet", "application/vnd.apache.arrow.stream")
+
+
+def accepted_encodings(header: str) -> dict:
+    """Accept-Encoding -> {coding: q}, lower-cased; codings with q=0 are refused."""
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(header: str, brotli_available: bool = None) -> str:
+    """"br", "gzip" or None for a request's Accept-Encoding."""
+    brotli_available = brotli is not None if brotli_available is None else brotli_available
+    accepted = accepted_encodings(header or "")
+    wildcard = accepted.get("*", 0.0)
+    if brotli_available and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+class _Gzip:
+    def __init__(self, level: int):
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        return self._z.compress(data) + self._z.flush(zlib.Z_SYNC_FLUSH if flush else zlib.Z_NO_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._z.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self, quality: int):
+        self._c = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._c.process(data)
+        return out + self._c.flush() if flush else out
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing response bodies of at least `minimum_size` bytes.
+
+    A complete body is compressed in one go and gets an exact Content-Length;
+    a streamed one is compressed and flushed per chunk. Responses that carry
+    a Content-Encoding already, have no body (204/304) or a type in
+    `skip_types` are sent as they are.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4,
+                 skip_types=SKIP_TYPES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.skip_types = tuple(skip_types)
+
+    def _compressor(self, encoding: str):
+        return _Brotli(self.brotli_quality) if encoding == "br" else _Gzip(self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"accept-encoding"), "")
+        encoding = choose_encoding(accept)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+
+            if compressor is None:
+                headers = [(k.lower(), v) for k, v in start["headers"]]
+                content_type = next((v.decode("latin-1") for k, v in headers if k == b"content-type"), "")
+                if (start["status"] in (204, 304) or any(k == b"content-encoding" for k, _ in headers)
+                        or content_type.startswith(self.skip_types)
+                        or (not more and len(body) < self.minimum_size)):
+                    passthrough = True
+                    await send(start)
+                    return await send(message)
+                compressor = self._compressor(encoding)
+                headers = [(k, v) for k, v in headers if k != b"content-length"]
+                headers.append((b"content-encoding", encoding.encode()))
+                vary = [v for k, v in headers if k == b"vary"]
+                if not any(b"accept-encoding" in v.lower() or v.strip() == b"*" for v in vary):
+                    headers.append((b"vary", b"Accept-Encoding"))
+                if not more:
+                    data = compressor.compress(body, False) + compressor.finish()
+                    headers.append((b"content-length", str(len(data)).encode()))
+                    await send({**start, "headers": headers})
+                    return await send({"type": "http.response.body", "body": data})
+                await send({**start, "headers": headers})
+
+            data = compressor.compress(body, True) if more else compressor.compress(body, False) + compressor.finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, send_compressed)
@@ -10,19 +10,135 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+# Readings storage: "supabase" (default) or "sqlite" for a local file
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").lower()
+STORAGE_PATH = os.getenv("STORAGE_PATH", "./readings.sqlite3")
+
 # MQTT
 MQTT_BROKER = os.getenv("MQTT_BROKER")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "8883"))  # TLS
 MQTT_USERNAME = os.getenv("MQTT_USERNAME")
 MQTT_PASSWORD = os.getenv("MQTT_PASSWORD")
+# Legacy shared topic plus one topic per device (smartpm25/<device_id>/data)
+MQTT_TOPICS = [t.strip() for t in os.getenv("MQTT_TOPICS", "smartpm25.sensor.data,smartpm25/+/data").split(",") if t.strip()]
 
-# Validate required env vars and show which ones are missing
-required = {
-    "SUPABASE_URL": SUPABASE_URL,
-    "SUPABASE_KEY": SUPABASE_KEY,
-    "MQTT_BROKER": MQTT_BROKER,
-    "MQTT_USERNAME": MQTT_USERNAME,
-    "MQTT_PASSWORD": MQTT_PASSWORD,
+# Ingest writer (batched inserts)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "100"))
+INGEST_MAX_AGE = float(os.getenv("INGEST_MAX_AGE", "1.0"))  # seconds
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))  # writer shards, partitioned by device_id
+
+# Duplicate suppression: readings seen in the last DEDUP_WINDOW seconds, at most DEDUP_CAPACITY keys
+DEDUP_CAPACITY = int(os.getenv("DEDUP_CAPACITY", "50000"))
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", "600"))  # seconds
+
+# Per-device ingest budget: RATE_LIMIT_PER_DEVICE readings per second with bursts of RATE_LIMIT_BURST
+# (0 = unlimited; the firmware publishes every 10 s). Readings over budget are held, coalesced per
+# RATE_LIMIT_MODE ("latest" keeps the newest, "minmax" the lowest and highest pm25) and written when the
+# device has budget again. An ingest queue shard that is INGEST_HIGH_WATER full sends new readings to
+# the spool (replayed later) until it drains below INGEST_LOW_WATER.
+RATE_LIMIT_PER_DEVICE = float(os.getenv("RATE_LIMIT_PER_DEVICE", "1.0"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+RATE_LIMIT_MODE = os.getenv("RATE_LIMIT_MODE", "latest").lower()
+if RATE_LIMIT_MODE not in ("latest", "minmax"):
+    raise ValueError(f"RATE_LIMIT_MODE must be latest or minmax, not {RATE_LIMIT_MODE!r}")
+RATE_LIMIT_RELEASE_INTERVAL = float(os.getenv("RATE_LIMIT_RELEASE_INTERVAL", "1.0"))  # seconds
+INGEST_HIGH_WATER = float(os.getenv("INGEST_HIGH_WATER", "0.8"))
+INGEST_LOW_WATER = float(os.getenv("INGEST_LOW_WATER", "0.5"))
+
+# Local spool for readings that fail to insert (replayed when Supabase recovers)
+SPOOL_PATH = os.getenv("SPOOL_PATH", "./ingest_spool.db")
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", str(50_000_000)))
+
+# In-memory recent readings (ring buffer per device, warmed from the DB at startup)
+RECENT_READINGS_PER_DEVICE = int(os.getenv("RECENT_READINGS_PER_DEVICE", "256"))
+RECENT_READINGS_WARM_ROWS = int(os.getenv("RECENT_READINGS_WARM_ROWS", "1000"))
+
+# Request-path DB access: concurrent queries and per-query timeout (seconds)
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "8"))
+DB_QUERY_TIMEOUT = float(os.getenv("DB_QUERY_TIMEOUT", "10"))
+DB_REBUILD_TIMEOUT = float(os.getenv("DB_REBUILD_TIMEOUT", "120"))
+
+# Upper bound on rows pulled into memory for one history/aggregation request
+HISTORY_MAX_ROWS = int(os.getenv("HISTORY_MAX_ROWS", "500000"))
+
+# Rollups: seconds between flushes of ingest-time deltas to readings_rollup
+ROLLUP_FLUSH_INTERVAL = float(os.getenv("ROLLUP_FLUSH_INTERVAL", "10"))
+
+# Retention, in days (0 = keep forever). Raw readings older than RETENTION_RAW_DAYS are
+# compacted away once the 1m/10m/1h/1d rollups hold them; each rollup tier has its own limit.
+# History and aggregated views up to 24h (and their percentiles) read raw readings only, so raw
+# retention may not be shorter than RAW_SERVED_DAYS.
+RAW_SERVED_DAYS = 1
+RETENTION_RAW_DAYS = float(os.getenv("RETENTION_RAW_DAYS", "0"))
+if 0 < RETENTION_RAW_DAYS < RAW_SERVED_DAYS:
+    raise ValueError(f"RETENTION_RAW_DAYS must be 0 or at least {RAW_SERVED_DAYS} (the 24h views read raw "
+                     f"readings), not {RETENTION_RAW_DAYS:g}")
+ROLLUP_RETENTION = {  # resolution seconds -> retention seconds
+    10: float(os.getenv("RETENTION_10S_DAYS", "7")) * 86400,
+    60: float(os.getenv("RETENTION_1M_DAYS", "90")) * 86400,
+    600: float(os.getenv("RETENTION_10M_DAYS", "730")) * 86400,
+    3600: float(os.getenv("RETENTION_1H_DAYS", "0")) * 86400,
+    86400: float(os.getenv("RETENTION_1D_DAYS", "0")) * 86400,
 }
+COMPACTION_INTERVAL = float(os.getenv("COMPACTION_INTERVAL", "600"))  # seconds between passes
+COMPACTION_MAX_CHUNKS = int(os.getenv("COMPACTION_MAX_CHUNKS", "24"))  # hour/day chunks per pass
+
+# Max cached history/aggregated responses (LRU)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+# Seconds a cached response is served after new readings arrive, before it is recomputed
+RESPONSE_CACHE_MIN_TTL = float(os.getenv("RESPONSE_CACHE_MIN_TTL", "2"))
+
+# Response compression (br when the brotli package is installed, else gzip) for bodies of at
+# least COMPRESSION_MIN_BYTES; set RESPONSE_COMPRESSION=false when a proxy already compresses
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "true").lower() in ("1", "true", "yes")
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+# Live stream (/api/readings/stream)
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "100"))  # per client
+STREAM_KEEPALIVE = float(os.getenv("STREAM_KEEPALIVE", "15"))  # seconds
+
+# Logging: json or text lines, level, queue size, and sampling of per-message events
+# (at most LOG_SAMPLE_BURST records per event every LOG_SAMPLE_INTERVAL seconds, then a summary)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_INTERVAL = float(os.getenv("LOG_SAMPLE_INTERVAL", "10"))
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "5"))
+
+# /metrics: optional bearer token, and how recently a device must have reported to count as active
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_ACTIVE_WINDOW = float(os.getenv("METRICS_ACTIVE_WINDOW", "300"))  # seconds
+
+# /api/v1/readings/export: rows per keyset page, and an optional bearer token
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "5000"))
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN")
+
+# Fast start: serve HTTP at once and open the store, warm buffer and MQTT in the background
+# (/ready reports progress). 0 restores the blocking startup.
+FAST_START = os.getenv("FAST_START", "true").lower() in ("1", "true", "yes")
+
+# Process role: "all" ingests and serves in one process; "ingest" owns the MQTT subscription
+# and every write; "api" only serves HTTP (run it with several uvicorn workers) and reads the
+# ingest process's hot state from HOT_STATE_PATH, a local file only the backend may write
+BACKEND_ROLE = os.getenv("BACKEND_ROLE", "all").lower()
+if BACKEND_ROLE not in ("all", "ingest", "api"):
+    raise ValueError(f"BACKEND_ROLE must be all, ingest or api, not {BACKEND_ROLE!r}")
+HOT_STATE_PATH = os.getenv("HOT_STATE_PATH", "./hot_state.json")
+HOT_STATE_INTERVAL = float(os.getenv("HOT_STATE_INTERVAL", "1.0"))  # ingest: seconds between snapshots
+HOT_STATE_POLL = float(os.getenv("HOT_STATE_POLL", "0.25"))  # api: seconds between checks for a new one
+# Newest readings per device in each snapshot: API workers serve at most 200 (latest-batch limit,
+# stream backfill) and ask the DB for more, so the rest of the ring is not worth rewriting each time
+HOT_STATE_ROWS_PER_DEVICE = int(os.getenv("HOT_STATE_ROWS_PER_DEVICE", "200"))
+
+# Validate required env vars and show which ones are missing
+required = {}
+if BACKEND_ROLE != "api":
+    required.update({"MQTT_BROKER": MQTT_BROKER, "MQTT_USERNAME": MQTT_USERNAME, "MQTT_PASSWORD": MQTT_PASSWORD})
+if STORAGE_BACKEND == "supabase":
+    required.update({"SUPABASE_URL": SUPABASE_URL, "SUPABASE_KEY": SUPABASE_KEY})
 missing = [name for name, val in required.items() if not val]
 if missing:
     raise ValueError(f"Missing required environment variables: {', '.join(missing)}. Check web/backend/.env or environment.")
\ No newline at end of file
@@ -0,0 +1,126 @@
+# Async data access for SmartPM2.5 Backend
+# The pinned supabase client is synchronous; queries run on a bounded thread
+# pool so a slow query never blocks the event loop.
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from metrics import db_query_seconds
+
+logger = logging.getLogger("smartpm")
+
+
+class QueryRunner:
+    """Offload blocking `.execute()` calls with a concurrency cap and timeouts.
+
+    A query that times out or whose caller is cancelled keeps its concurrency
+    slot until the worker thread actually finishes, so the cap always bounds
+    real in-flight I/O.
+    """
+
+    def __init__(self, max_concurrency: int = 8, timeout: float = 10.0):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="db")
+        # Created on first use so it binds to the running event loop
+        self._slots = None
+        self.in_flight = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.errors = 0
+        self.not_ready = 0
+        self._by_kind = {}
+        # Future resolved once the store exists; see hold_until()
+        self._gate = None
+
+    def hold_until(self, ready: asyncio.Future):
+        """Make queries wait (up to their timeout) for `ready`, e.g. while the store is still opening."""
+        self._gate = ready
+
+    async def _wait_ready(self, kind: str, timeout: float):
+        try:
+            await asyncio.wait_for(asyncio.shield(self._gate), timeout)
+        except asyncio.TimeoutError:
+            self.not_ready += 1
+            raise HTTPException(status_code=503, detail=f"Storage is still starting ({kind})")
+
+    async def run(self, fn, kind: str = "query", timeout: float = None):
+        """Run `fn()` on the pool and await its result."""
+        if self._gate is not None and not self._gate.done():
+            await self._wait_ready(kind, timeout or self.timeout)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        await self._slots.acquire()
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, fn)
+        except BaseException:
+            self._release(kind, started, None)
+            raise
+        # Done callbacks run on the event loop thread, so no extra locking is needed
+        future.add_done_callback(lambda f: self._release(kind, started, f))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.error(f"Query '{kind}' timed out after {timeout or self.timeout}s")
+            raise HTTPException(status_code=504, detail=f"Database query timed out ({kind})")
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+    async def execute(self, query, kind: str = "query", timeout: float = None):
+        """Await a supabase/postgrest builder's `.execute()`."""
+        return await self.run(query.execute, kind, timeout)
+
+    def _release(self, kind, started, future):
+        elapsed = time.perf_counter() - started
+        elapsed_ms = elapsed * 1000
+        db_query_seconds.observe(elapsed, kind)
+        self.in_flight -= 1
+        count, total_ms = self._by_kind.get(kind, (0, 0.0))
+        self._by_kind[kind] = (count + 1, total_ms + elapsed_ms)
+        if future is not None and not future.cancelled() and future.exception() is not None:
+            self.errors += 1
+        self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "errors": self.errors,
+            "not_ready": self.not_ready,
+            "by_kind": {
+                kind: {"count": count, "avg_ms": round(total_ms / count, 2)}
+                for kind, (count, total_ms) in self._by_kind.items()
+            },
+        }
+
+
+async def cancel_on_disconnect(request, coro, poll_interval: float = 0.25):
+    """Await `coro`, cancelling it if the HTTP client goes away first."""
+    if request is None:
+        return await coro
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                # 499: client closed request (nginx convention); nobody reads this response
+                raise HTTPException(status_code=499, detail="client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,71 @@
+# Duplicate suppression for SmartPM2.5 Backend
+# Broker redeliveries and firmware republishes after a reconnect deliver the
+# same reading again; on_message drops them here before they reach the
+# buffers, rollups or the ingest writers.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+def _fingerprint(row: dict) -> tuple:
+    return (row.get("pm1"), row.get("pm25"), row.get("pm10"), row.get("aqi"), row.get("wifi_rssi"))
+
+
+def reading_key(row: dict) -> tuple:
+    return (row.get("device_id"), row.get("timestamp"))
+
+
+class DuplicateFilter:
+    """Recently seen readings keyed on (device_id, timestamp), bounded in size and age.
+
+    A reading is a duplicate when the same key was seen less than `window`
+    seconds ago with the same measured values. The values are compared
+    because the firmware's timestamp is uptime in milliseconds: after a
+    reboot a device repeats old timestamps with new readings, and those must
+    not be dropped. Keys are kept in insertion order, so expiring by age and
+    evicting beyond `capacity` both pop from the front. `key` maps a row to
+    its key, e.g. to include created_at when it is known up front.
+    """
+
+    def __init__(self, capacity: int = 50_000, window: float = 600.0, key=reading_key):
+        self.capacity = capacity
+        self.window = window
+        self.key = key
+        self._keys = OrderedDict()  # key -> (first seen, fingerprint)
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+        self.evicted = 0
+
+    def seen(self, row: dict, now: float = None) -> bool:
+        """True if `row` duplicates a recent reading; otherwise remember it and return False."""
+        now = time.monotonic() if now is None else now
+        key = self.key(row)
+        fingerprint = _fingerprint(row)
+        with self._lock:
+            self.checked += 1
+            entry = self._keys.get(key)
+            if entry is not None and now - entry[0] < self.window and entry[1] == fingerprint:
+                self.duplicates += 1
+                return True
+            if entry is not None:
+                del self._keys[key]
+            self._keys[key] = (now, fingerprint)
+            keys = self._keys
+            while keys and (len(keys) > self.capacity or now - next(iter(keys.values()))[0] >= self.window):
+                keys.popitem(last=False)
+                self.evicted += 1
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "keys": len(self._keys),
+                "capacity": self.capacity,
+                "window_s": self.window,
+                "checked": self.checked,
+                "duplicates": self.duplicates,
+                "hit_rate": round(self.duplicates / self.checked, 4) if self.checked else 0.0,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,95 @@
+# Peak-preserving downsampling for SmartPM2.5 Backend
+# Reduce a long series to a target number of points for charting without
+# averaging away short PM2.5 spikes.
+
+import numpy as np
+
+METHODS = ("lttb", "minmax")
+
+
+def _bucket_edges(n: int, n_buckets: int) -> np.ndarray:
+    # Equal-count buckets over positions [0, n)
+    return np.linspace(0, n, n_buckets + 1).astype(np.int64)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of `n_out` points that keep the shape.
+
+    `x` must be sorted. The first and last points are always kept; each
+    bucket in between contributes the point forming the largest triangle
+    with the previously kept point and the next bucket's centroid. Each step
+    is vectorized over its bucket, so the cost is O(len(x)) numpy work plus
+    `n_out` Python iterations.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = x.astype(float)
+    y = y.astype(float)
+    # Middle points go into n_out - 2 buckets; first and last are fixed
+    edges = _bucket_edges(n - 2, n_out - 2) + 1
+    # Centroid of every bucket, computed up front with cumulative sums
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    sizes = edges[1:] - edges[:-1]
+    mean_x = (cx[edges[1:]] - cx[edges[:-1]]) / sizes
+    mean_y = (cy[edges[1:]] - cy[edges[:-1]]) / sizes
+    # The bucket after the last one is the final point itself
+    mean_x = np.append(mean_x, x[-1])
+    mean_y = np.append(mean_y, y[-1])
+
+    out = np.empty(n_out, np.int64)
+    out[0] = 0
+    out[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        bx = x[lo:hi]
+        by = y[lo:hi]
+        # Twice the triangle area; the constant factor does not change the argmax
+        area = np.abs((x[a] - mean_x[i + 1]) * (by - y[a]) - (x[a] - bx) * (mean_y[i + 1] - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def minmax(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices of the minimum and maximum of each of `n_out // 2` equal-count buckets.
+
+    Every local extreme survives, so peaks are never flattened. Returned
+    indices are sorted and unique; the first and last points are included.
+    Fully vectorized: one lexsort over (bucket, value).
+    """
+    n = len(y)
+    n_buckets = max(1, n_out // 2)
+    if n <= n_out or n_buckets >= n:
+        return np.arange(n)
+    edges = _bucket_edges(n, n_buckets)
+    bucket = np.repeat(np.arange(n_buckets), np.diff(edges))
+    values = np.where(np.isnan(y), -np.inf, y)
+    order = np.lexsort((values, bucket))
+    # Rows of each bucket are contiguous in `order`, lowest value first
+    lows = order[edges[:-1]]
+    highs = order[edges[1:] - 1]
+    return np.unique(np.concatenate(([0, n - 1], lows, highs)))
+
+
+def envelope(y: np.ndarray, n_buckets: int) -> tuple:
+    """Per-bucket (first index, min, max) over equal-count buckets, for min/max band charts."""
+    n = len(y)
+    n_buckets = max(1, min(n_buckets, n))
+    edges = _bucket_edges(n, n_buckets)
+    starts = edges[:-1]
+    return starts, np.fmin.reduceat(y, starts), np.fmax.reduceat(y, starts)
+
+
+def select(x: np.ndarray, y: np.ndarray, n_out: int, method: str = "lttb") -> np.ndarray:
+    """Indices to keep for `method` ('lttb' or 'minmax')."""
+    if method == "minmax":
+        return minmax(y, n_out)
+    ok = ~np.isnan(y)
+    if ok.all():
+        return lttb(x, y, n_out)
+    # LTTB needs real values; pick among rows that have one
+    kept = np.flatnonzero(ok)
+    return kept[lttb(x[ok], y[ok], n_out)]
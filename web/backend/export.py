@@ -0,0 +1,210 @@
+# Bulk export encoders for SmartPM2.5 Backend
+# Readings arrive one keyset page at a time and each page is encoded to bytes
+# as soon as it is read, so an export holds at most a page (a row group for
+# Parquet) in memory however long the range is. Parquet and Arrow need the
+# optional pyarrow package.
+
+import csv
+import io
+import json
+
+from storage import READING_COLUMNS
+
+# pyarrow is imported on the first Parquet/Arrow export, not at startup
+pa = None
+pq = None
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# Parquet rows buffered per row group; larger groups compress and scan better
+PARQUET_ROW_GROUP_ROWS = 65536
+
+
+def parse_columns(columns: str) -> list:
+    """Comma-separated column names -> validated list in the order given; empty means every column."""
+    if not columns or columns.strip() == "*":
+        return list(READING_COLUMNS)
+    names = [c.strip() for c in columns.split(",") if c.strip()]
+    unknown = [c for c in names if c not in READING_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    return list(dict.fromkeys(names))
+
+
+def fetch_columns(columns: list) -> str:
+    """Columns to read: the projection plus the (created_at, id) keyset."""
+    return ", ".join(dict.fromkeys([*columns, "created_at", "id"]))
+
+
+def _load_pyarrow() -> bool:
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:  # optional; csv and ndjson work without it
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+
+def _arrow_type(column: str):
+    if column == "created_at":
+        return pa.timestamp("us", tz="UTC")
+    if column in ("id", "timestamp"):
+        return pa.int64()
+    if column in ("device_id", "ip_address"):
+        return pa.string()
+    return pa.int32()
+
+
+class CsvEncoder:
+    def __init__(self, columns: list):
+        self.columns = columns
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf, lineterminator="\n")
+
+    def _take(self) -> bytes:
+        out = self._buf.getvalue().encode()
+        self._buf.seek(0)
+        self._buf.truncate()
+        return out
+
+    def begin(self) -> bytes:
+        self._writer.writerow(self.columns)
+        return self._take()
+
+    def encode(self, rows: list) -> bytes:
+        columns = self.columns
+        self._writer.writerows([row.get(c) for c in columns] for row in rows)
+        return self._take()
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class NdjsonEncoder:
+    def __init__(self, columns: list):
+        self.columns = columns
+
+    def begin(self) -> bytes:
+        return b""
+
+    def encode(self, rows: list) -> bytes:
+        columns = self.columns
+        lines = [json.dumps({c: row.get(c) for c in columns}, separators=(",", ":"), default=str) for row in rows]
+        return ("\n".join(lines) + "\n").encode() if lines else b""
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands back what was written since the last take()."""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def take(self) -> bytes:
+        out = b"".join(self._chunks)
+        self._chunks.clear()
+        return out
+
+
+class _ArrowEncoder:
+    def __init__(self, columns: list):
+        if not _load_pyarrow():
+            raise RuntimeError("pyarrow is not installed")
+        self.columns = columns
+        self.schema = pa.schema([(c, _arrow_type(c)) for c in columns])
+        self._sink = _Sink()
+
+    def _batch(self, rows: list):
+        arrays = []
+        for field in self.schema:
+            values = [row.get(field.name) for row in rows]
+            if field.name == "created_at":
+                # ISO strings with an offset cast straight to UTC timestamps
+                arrays.append(pa.array(values, pa.string()).cast(field.type))
+            else:
+                arrays.append(pa.array(values, field.type))
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+
+class ArrowEncoder(_ArrowEncoder):
+    """Arrow IPC stream: one record batch per page."""
+
+    def begin(self) -> bytes:
+        self._writer = pa.ipc.new_stream(self._sink, self.schema)
+        return self._sink.take()
+
+    def encode(self, rows: list) -> bytes:
+        if rows:
+            self._writer.write_batch(self._batch(rows))
+        return self._sink.take()
+
+    def finish(self) -> bytes:
+        self._writer.close()
+        return self._sink.take()
+
+
+class ParquetEncoder(_ArrowEncoder):
+    """Parquet file written row group by row group; the footer goes out in finish()."""
+
+    def __init__(self, columns: list, row_group_rows: int = PARQUET_ROW_GROUP_ROWS):
+        super().__init__(columns)
+        self.row_group_rows = row_group_rows
+        self._pending = []
+        self._pending_rows = 0
+
+    def begin(self) -> bytes:
+        self._writer = pq.ParquetWriter(self._sink, self.schema, compression="zstd")
+        return self._sink.take()
+
+    def _flush(self):
+        if self._pending:
+            self._writer.write_table(pa.Table.from_batches(self._pending), row_group_size=self._pending_rows)
+            self._pending = []
+            self._pending_rows = 0
+
+    def encode(self, rows: list) -> bytes:
+        if rows:
+            self._pending.append(self._batch(rows))
+            self._pending_rows += len(rows)
+            if self._pending_rows >= self.row_group_rows:
+                self._flush()
+        return self._sink.take()
+
+    def finish(self) -> bytes:
+        self._flush()
+        self._writer.close()
+        return self._sink.take()
+
+
+ENCODERS = {"csv": CsvEncoder, "ndjson": NdjsonEncoder, "parquet": ParquetEncoder, "arrow": ArrowEncoder}
+
+
+def make_encoder(fmt: str, columns: list):
+    """Encoder for `fmt`; ValueError for an unknown format, RuntimeError when pyarrow is missing."""
+    encoder = ENCODERS.get(fmt)
+    if encoder is None:
+        raise ValueError(f"Unknown format: {fmt}")
+    return encoder(columns)
@@ -0,0 +1,176 @@
+# Shared hot state for SmartPM2.5 Backend
+# With BACKEND_ROLE=ingest one process owns the MQTT subscription and every
+# write; BACKEND_ROLE=api workers only serve HTTP. What the API answers from
+# memory (newest readings per device, rollup deltas not yet flushed, MQTT
+# status) is published by the ingest process as a JSON snapshot file,
+# replaced by atomic rename so a reader never sees a partial write, and
+# reloaded by the API workers whenever it changes. JSON rather than pickle,
+# so whoever can write the file cannot run code in the workers.
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger("smartpm")
+
+
+def write_snapshot(path: str, state: dict):
+    """Write `state` (plain dicts, lists, strings and numbers) next to `path` as JSON, then rename it over `path`."""
+    fd, tmp = tempfile.mkstemp(prefix=".hot_state-", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class SnapshotPublisher:
+    """Background thread writing `collect()` to `path` whenever `version()` has moved.
+
+    Checks every `interval` seconds; notify() publishes at once, e.g. right
+    after rollup deltas reach the DB so readers stop adding them on top.
+    """
+
+    def __init__(self, path: str, collect, version, interval: float = 1.0):
+        self.path = path
+        self.collect = collect
+        self.version = version
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._published = None
+        self.written = 0
+        self.failures = 0
+        self.last_write_ms = None
+        self.last_written_at = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="hot-state-publisher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.publish()
+
+    def notify(self):
+        self._wake.set()
+
+    def publish(self):
+        version = self.version()
+        if version == self._published:
+            return
+        started = time.perf_counter()
+        try:
+            write_snapshot(self.path, {**self.collect(), "written_at": time.time(), "pid": os.getpid()})
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Writing hot state to {self.path} failed: {e}")
+            return
+        self._published = version
+        self.written += 1
+        self.last_write_ms = round((time.perf_counter() - started) * 1000, 2)
+        self.last_written_at = time.time()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.publish()
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "written": self.written,
+            "failures": self.failures,
+            "last_write_ms": self.last_write_ms,
+            "age_s": round(time.time() - self.last_written_at, 3) if self.last_written_at else None,
+        }
+
+
+class SnapshotReader:
+    """Background thread handing each new snapshot at `path` to `apply(state)`.
+
+    A new snapshot is noticed from the open file's inode and mtime alone:
+    every rename gives the file a new inode, so an unchanged file is never
+    re-read, and the snapshot checked is the one that gets loaded.
+    """
+
+    def __init__(self, path: str, apply, interval: float = 0.25):
+        self.path = path
+        self.apply = apply
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._seen = None
+        self.loaded = 0
+        self.failures = 0
+        self.last_load_ms = None
+        self.written_at = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="hot-state-reader", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def poll(self) -> bool:
+        """Load the snapshot if it changed since the last call; True when one was applied."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        started = time.perf_counter()
+        try:
+            with f:
+                st = os.fstat(f.fileno())
+                key = (st.st_ino, st.st_mtime_ns, st.st_size)
+                if key == self._seen:
+                    return False
+                # A snapshot that fails to load is not retried; the next one replaces it
+                self._seen = key
+                state = json.load(f)
+            self.apply(state)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Loading hot state from {self.path} failed: {e}")
+            return False
+        self.loaded += 1
+        self.last_load_ms = round((time.perf_counter() - started) * 1000, 2)
+        self.written_at = state.get("written_at")
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "loaded": self.loaded,
+            "failures": self.failures,
+            "last_load_ms": self.last_load_ms,
+            "age_s": round(time.time() - self.written_at, 3) if self.written_at else None,
+        }
@@ -0,0 +1,308 @@
+# Ingest pipeline for SmartPM2.5 Backend
+# The MQTT thread only decodes and enqueues readings; background writers
+# (one per device shard) flush them to storage as multi-row inserts.
+
+import logging
+import queue
+import threading
+import time
+import zlib
+
+from logs import LogSampler
+from metrics import ingest_retries, ingest_rows, ingest_stage_seconds
+
+logger = logging.getLogger("smartpm")
+# One line per batch adds up at high rates; sample it
+batch_log = LogSampler(logger)
+
+
+def normalize_timestamp(raw_ts, now_ms: int = None) -> int:
+    """Normalize a device timestamp to epoch milliseconds.
+
+    Some devices publish seconds instead of milliseconds, and some publish
+    nothing at all; both cases are handled here.
+    """
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    if raw_ts is None:
+        return now_ms
+    try:
+        # Accept either int or string numeric
+        ts_val = int(raw_ts)
+    except Exception:
+        return now_ms
+    # If the value looks like seconds (10 digits or less), convert to ms
+    if ts_val < 1_000_000_000_000:
+        return ts_val * 1000
+    return ts_val
+
+
+def device_id_from_topic(topic: str):
+    """Device id from a per-device topic (`smartpm25/<device_id>/data`), else None."""
+    parts = (topic or "").split("/")
+    if len(parts) == 3 and parts[0] == "smartpm25" and parts[2] == "data" and parts[1]:
+        return parts[1]
+    return None
+
+
+def shard_for(device_id, shards: int) -> int:
+    """Stable shard index for a device (crc32, so it does not vary between processes)."""
+    return zlib.crc32(str(device_id).encode()) % shards
+
+
+def build_row(data: dict, ts: int) -> dict:
+    """Map a decoded device message onto a `readings` table row."""
+    return {
+        "device_id": data["device_id"],
+        "pm1": data["readings"]["pm1"],
+        "pm25": data["readings"]["pm25"],
+        "pm10": data["readings"]["pm10"],
+        "aqi": data["aqi"]["value"],
+        "timestamp": ts,
+        "wifi_rssi": data["metadata"]["wifi_rssi"],
+        "ip_address": data["metadata"]["ip"]
+    }
+
+
+class IngestWriter:
+    """Bounded queue plus a background thread doing batched inserts.
+
+    A batch is flushed when it reaches `max_batch` rows or when its oldest row
+    has waited `max_age` seconds, whichever comes first. Retries back off per
+    batch on the writer thread, never on the caller's thread. With a `spool`,
+    batches that exhaust their retries (and rows arriving while the queue is
+    full) are persisted there instead of being dropped. From the moment the
+    queue is `high_water` full until it drains below `low_water`, new rows
+    go straight to the spool too, so a slow database delays readings rather
+    than losing them.
+    """
+
+    def __init__(self, insert_fn, max_batch: int = 100, max_age: float = 1.0,
+                 max_queue: int = 10_000, max_attempts: int = 3, base_delay: float = 0.5,
+                 spool=None, on_success=None, high_water: float = 1.0, low_water: float = 1.0,
+                 name: str = "ingest-writer"):
+        self.insert_fn = insert_fn
+        self.name = name
+        self.spool = spool
+        self.on_success = on_success
+        self.high_water = high_water
+        self.low_water = min(low_water, high_water)
+        self.shedding = False
+        self.shed_episodes = 0
+        self.max_batch = max_batch
+        self.max_age = max_age
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "spooled": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "retries": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_ms": None,
+            "max_flush_ms": None,
+            "total_flush_ms": 0.0,
+        }
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def request_stop(self):
+        self._stop.set()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the writer, flushing whatever is still queued."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, row: dict) -> bool:
+        """Enqueue a row without blocking. Returns False if it was dropped."""
+        if self.spool is not None and self._check_load() and self._spill([row]):
+            return True
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            if self._spill([row]):
+                return True
+            with self._lock:
+                self._stats["dropped"] += 1
+            ingest_rows.inc("dropped")
+            return False
+        with self._lock:
+            self._stats["enqueued"] += 1
+        return True
+
+    def load(self) -> float:
+        """Fraction of the queue in use."""
+        return self._queue.qsize() / self.max_queue if self.max_queue > 0 else 0.0
+
+    def _check_load(self) -> bool:
+        load = self.load()
+        with self._lock:
+            if self.shedding and load < self.low_water:
+                self.shedding = False
+                logger.info(f"{self.name} queue {load:.0%} full, below the low-water mark; queueing again")
+            elif not self.shedding and load >= self.high_water:
+                self.shedding = True
+                self.shed_episodes += 1
+                logger.warning(f"{self.name} queue {load:.0%} full, at the high-water mark; spooling new readings")
+            return self.shedding
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        total_ms = s.pop("total_flush_ms")
+        s["queue_depth"] = self._queue.qsize()
+        s["shedding"] = self.shedding
+        s["shed_episodes"] = self.shed_episodes
+        s["avg_batch_size"] = round(s["written"] / s["batches"], 2) if s["batches"] else 0
+        s["avg_flush_ms"] = round(total_ms / s["batches"], 2) if s["batches"] else None
+        return s
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            stopping = self._stop.is_set()
+            timeout = 0.1 if deadline is None else max(0.0, min(0.1, deadline - time.monotonic()))
+            try:
+                row = self._queue.get(timeout=timeout) if not stopping else self._queue.get_nowait()
+                if not batch:
+                    deadline = time.monotonic() + self.max_age
+                batch.append(row)
+            except queue.Empty:
+                if stopping:
+                    break
+            if batch and (len(batch) >= self.max_batch or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+        if batch:
+            self._flush(batch)
+
+    def _flush(self, batch: list):
+        delay = self.base_delay
+        started = time.monotonic()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                attempt_started = time.perf_counter()
+                self.insert_fn(batch)
+                ingest_stage_seconds.observe(time.perf_counter() - attempt_started, "write")
+                break
+            except Exception as e:
+                logger.error(f"Batch insert attempt {attempt} of {len(batch)} rows failed: {e}")
+                if attempt == self.max_attempts:
+                    with self._lock:
+                        self._stats["failed_batches"] += 1
+                    if self._spill(batch):
+                        logger.error(f"Max insert attempts reached; spooled batch of {len(batch)} rows")
+                        return
+                    logger.error(f"Max insert attempts reached; dropping batch of {len(batch)} rows")
+                    with self._lock:
+                        self._stats["dropped"] += len(batch)
+                    ingest_rows.inc("dropped", amount=len(batch))
+                    return
+                with self._lock:
+                    self._stats["retries"] += 1
+                ingest_retries.inc()
+                # Interruptible sleep so shutdown is not held up by backoff
+                self._stop.wait(delay)
+                delay *= 2
+
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            s = self._stats
+            s["written"] += len(batch)
+            s["batches"] += 1
+            s["last_batch_size"] = len(batch)
+            s["max_batch_size"] = max(s["max_batch_size"], len(batch))
+            s["last_flush_ms"] = round(elapsed_ms, 2)
+            s["max_flush_ms"] = round(max(s["max_flush_ms"] or 0, elapsed_ms), 2)
+            s["total_flush_ms"] += elapsed_ms
+        ingest_rows.inc("written", amount=len(batch))
+        batch_log.info("batch_inserted", "Inserted batch of %d readings in %.1f ms", len(batch), elapsed_ms,
+                       rows=len(batch), flush_ms=round(elapsed_ms, 2), writer=self.name)
+        if self.on_success:
+            self.on_success()
+
+    def _spill(self, rows: list) -> bool:
+        """Write rows to the spool if one is configured. Returns True on success."""
+        if self.spool is None:
+            return False
+        try:
+            self.spool.append(rows)
+        except Exception as e:
+            logger.error(f"Failed to spool {len(rows)} readings: {e}")
+            return False
+        with self._lock:
+            self._stats["spooled"] += len(rows)
+        ingest_rows.inc("spooled", amount=len(rows))
+        return True
+
+
+class ShardedIngestWriter:
+    """Several IngestWriters, each owning the devices that hash to it.
+
+    Readings of one device always go to the same shard, so their insert order
+    is preserved while different devices are written in parallel. Accepts
+    the same keyword arguments as IngestWriter; `max_queue` is per shard.
+    """
+
+    def __init__(self, insert_fn, shards: int = 4, **kwargs):
+        self.shards = [
+            IngestWriter(insert_fn, name=f"ingest-writer-{i}", **kwargs) for i in range(max(1, shards))
+        ]
+
+    def start(self):
+        for shard in self.shards:
+            shard.start()
+
+    def stop(self, timeout: float = 5.0):
+        # Signal every shard first so they drain concurrently
+        for shard in self.shards:
+            shard.request_stop()
+        for shard in self.shards:
+            shard.stop(timeout)
+
+    def submit(self, row: dict) -> bool:
+        return self.shards[shard_for(row.get("device_id"), len(self.shards))].submit(row)
+
+    def load(self) -> float:
+        """Fraction in use of the fullest shard's queue (a flood fills one shard first)."""
+        return max(shard.load() for shard in self.shards)
+
+    def shedding(self) -> int:
+        """Number of shards currently spooling new readings."""
+        return sum(shard.shedding for shard in self.shards)
+
+    def stats(self) -> dict:
+        per_shard = [shard.stats() for shard in self.shards]
+        totals = {}
+        for key in ("enqueued", "written", "dropped", "spooled", "batches", "failed_batches", "retries", "queue_depth"):
+            totals[key] = sum(s[key] for s in per_shard)
+        totals["max_batch_size"] = max(s["max_batch_size"] for s in per_shard)
+        totals["shedding_shards"] = sum(s["shedding"] for s in per_shard)
+        totals["shed_episodes"] = sum(s["shed_episodes"] for s in per_shard)
+        flush_ms = [s["max_flush_ms"] for s in per_shard if s["max_flush_ms"] is not None]
+        totals["max_flush_ms"] = max(flush_ms) if flush_ms else None
+        totals["avg_batch_size"] = round(totals["written"] / totals["batches"], 2) if totals["batches"] else 0
+        totals["shards"] = [
+            {"queue_depth": s["queue_depth"], "written": s["written"], "avg_flush_ms": s["avg_flush_ms"]}
+            for s in per_shard
+        ]
+        return totals
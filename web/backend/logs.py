@@ -0,0 +1,231 @@
+# Logging setup for SmartPM2.5 Backend
+# Callers only enqueue records; a listener thread formats them (JSON or text)
+# and writes the file and stdout handlers. Per-message events go through a
+# LogSampler, which lets a few records per interval through and then emits a
+# summary line with how many were suppressed; the listener's timer writes
+# summaries for windows that have ended even when no further record arrives.
+
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Defaults for samplers created without explicit settings; setup_logging() overrides them
+SAMPLE_INTERVAL = 10.0
+SAMPLE_BURST = 5
+
+_samplers = []
+_samplers_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, any `fields`, and exc when present."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler for a bounded queue that never blocks the logging thread.
+
+    Below ERROR, a record that does not fit is counted in `dropped` and
+    discarded. Errors wait for room (up to `error_timeout` seconds) so they are
+    never lost to a burst of routine records.
+    """
+
+    def __init__(self, log_queue: queue.Queue, error_timeout: float = 1.0):
+        super().__init__(log_queue)
+        self.error_timeout = error_timeout
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args now (they may be mutated later) but leave formatting to the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno < logging.ERROR:
+                self.dropped += 1
+                return
+            self.queue.put(record, timeout=self.error_timeout)
+
+
+class LogSampler:
+    """Rate-limits a logger's routine per-message events, keyed by event name.
+
+    Within each `interval` seconds, the first `burst` records of an event are
+    logged and the rest are only counted. Once the interval is over, a summary
+    line reports how many occurred and how many were suppressed: from the next
+    record, or from the log listener's timer if none arrives. Records at WARNING or above are always logged. Message
+    arguments are only formatted for records that are actually emitted.
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float = None, burst: int = None):
+        self.logger = logger
+        self.interval = interval
+        self.burst = burst
+        self._events = {}
+        self._lock = threading.Lock()
+        with _samplers_lock:
+            _samplers.append(self)
+
+    def info(self, event: str, msg: str, *args, **fields):
+        self.log(logging.INFO, event, msg, *args, **fields)
+
+    def debug(self, event: str, msg: str, *args, **fields):
+        self.log(logging.DEBUG, event, msg, *args, **fields)
+
+    def log(self, level: int, event: str, msg: str, *args, **fields):
+        if level >= logging.WARNING:
+            self.logger.log(level, msg, *args, extra={"fields": {"event": event, **fields}})
+            return
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        interval = self.interval or SAMPLE_INTERVAL
+        summary = None
+        with self._lock:
+            state = self._events.get(event)
+            if state is None:
+                state = self._events[event] = [now, 0, 0]  # window start, seen, suppressed
+            elif now - state[0] >= interval:
+                if state[2]:
+                    summary = (state[1], state[2], now - state[0])
+                state[0], state[1], state[2] = now, 0, 0
+            state[1] += 1
+            emit = state[1] <= (self.burst or SAMPLE_BURST)
+            if not emit:
+                state[2] += 1
+        if summary:
+            self._summarize(event, *summary)
+        if emit:
+            self.logger.log(level, msg, *args, extra={"fields": {"event": event, **fields}})
+
+    def flush(self, due_only: bool = False):
+        """Log summaries for windows that still have suppressed records (e.g. at shutdown).
+
+        With `due_only`, only windows whose interval is over are summarized and restarted.
+        """
+        now = time.monotonic()
+        interval = self.interval or SAMPLE_INTERVAL
+        pending = []
+        with self._lock:
+            for event, state in self._events.items():
+                if due_only and now - state[0] < interval:
+                    continue
+                if state[2]:
+                    pending.append((event, state[1], state[2], now - state[0]))
+                state[0], state[1], state[2] = now, 0, 0
+        for event, seen, suppressed, elapsed in pending:
+            self._summarize(event, seen, suppressed, elapsed)
+
+    def _summarize(self, event, seen, suppressed, elapsed):
+        self.logger.info(
+            "%s: %d events in the last %.0fs (%d not logged)", event, seen, elapsed, suppressed,
+            extra={"fields": {"event": f"{event}.summary", "count": seen, "suppressed": suppressed,
+                              "window_s": round(elapsed, 1)}},
+        )
+
+
+class SamplingQueueListener(QueueListener):
+    """QueueListener that also writes LogSampler summaries every SAMPLE_INTERVAL seconds.
+
+    A quiet event's suppressed count would otherwise only show up when its
+    next record arrives. stop() writes every pending summary before the queue
+    is drained.
+    """
+
+    def __init__(self, log_queue, *handlers, respect_handler_level=False):
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self._summaries_stop = threading.Event()
+        self._summaries_thread = None
+
+    def start(self):
+        super().start()
+        self._summaries_stop.clear()
+        self._summaries_thread = threading.Thread(target=self._summaries, name="log-summaries", daemon=True)
+        self._summaries_thread.start()
+
+    def stop(self):
+        if self._summaries_thread is not None:
+            self._summaries_stop.set()
+            self._summaries_thread.join()
+            self._summaries_thread = None
+            flush_samplers()
+        super().stop()
+
+    def _summaries(self):
+        while not self._summaries_stop.wait(SAMPLE_INTERVAL):
+            try:
+                flush_samplers(due_only=True)
+            except Exception:
+                pass  # the logging path must not take the process down
+
+
+def setup_logging(logger: logging.Logger, log_path: str, json_format: bool = True, level: int = logging.INFO,
+                  queue_size: int = 10_000, sample_interval: float = 10.0, sample_burst: int = 5) -> tuple:
+    """Route `logger` through a bounded queue to file and stdout handlers on a listener thread.
+
+    Returns (listener, queue handler). The listener is already started and
+    writes sampler summaries on its own timer; stop it at shutdown to flush
+    pending summaries and what is queued. The handler's `dropped` counts
+    records discarded while the queue was full.
+    The logger stops propagating to the root logger so no handler runs on the
+    caller's thread.
+    """
+    global SAMPLE_INTERVAL, SAMPLE_BURST
+    SAMPLE_INTERVAL = sample_interval
+    SAMPLE_BURST = sample_burst
+
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    file_handler = RotatingFileHandler(log_path, maxBytes=1_000_000, backupCount=3)
+    # stdout too, so PaaS (Render) captures logs reliably
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+    listener = SamplingQueueListener(queue_handler.queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener, queue_handler
+
+
+def flush_samplers(due_only: bool = False):
+    with _samplers_lock:
+        samplers = list(_samplers)
+    for sampler in samplers:
+        sampler.flush(due_only)
@@ -4,18 +4,36 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import paho.mqtt.client as mqtt
-from supabase import create_client, Client
-from datetime import datetime
+from datetime import datetime, timezone
 import json
 import config
 import logging
 import os
 import time
-from logging.handlers import RotatingFileHandler
 from fastapi import Request, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+import asyncio
+from storage import BUCKET_INTERVALS, ReadingStore, aggregate_spec, open_store
+import export
+import metrics
+from metrics import RequestMetricsMiddleware
+from compression import CompressionMiddleware
+from logs import LogSampler, setup_logging
+from retention import Compactor
+from readiness import Readiness
+from hotstate import SnapshotPublisher, SnapshotReader
 
 app = FastAPI(title="SmartPM2.5 Backend", version="1.0.0")
 
+# gzip/br response bodies; added first so the metrics below see the bytes actually sent
+if config.RESPONSE_COMPRESSION:
+    app.add_middleware(CompressionMiddleware, minimum_size=config.COMPRESSION_MIN_BYTES,
+                       gzip_level=config.COMPRESSION_GZIP_LEVEL, brotli_quality=config.COMPRESSION_BROTLI_QUALITY)
+
+# Per-route request latency and body size; the SSE stream is skipped because its duration is the session length
+app.add_middleware(RequestMetricsMiddleware, histogram=metrics.http_request_seconds,
+                   size_histogram=metrics.http_response_bytes, skip=("/metrics", "/api/readings/stream"))
+
 # CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -26,7 +44,17 @@ app.add_middleware(
 )
 
 # Global variables
-supabase: Client = None
+store: ReadingStore = None
+compactor: Compactor = None
+mqtt_client: mqtt.Client = None
+# Background startup tasks (fast start), cancelled at shutdown if still running
+startup_tasks = []
+# Whether this process subscribes to MQTT and writes (roles "all" and "ingest"); "api" workers only serve
+INGESTS = config.BACKEND_ROLE != "api"
+# /ready waits for the store and the warm buffer; MQTT (or, for api workers, the ingest
+# process's hot state) is reported but the API serves without it
+readiness = Readiness(("store", "recent_readings", "mqtt" if INGESTS else "hot_state"),
+                      required=("store", "recent_readings"))
 # Diagnostics
 mqtt_connected = False
 last_sub_result = None
@@ -34,132 +62,438 @@ last_received = None
 
 # Logger
 logger = logging.getLogger("smartpm")
-logger.setLevel(logging.INFO)
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s %(levelname)s %(name)s: %(message)s",
 )
-# Add a rotating file handler
+# Records are queued here and written to the rotating file and stdout by a listener thread
 log_path = os.getenv("BACKEND_LOG_PATH", "./backend.log")
-handler = RotatingFileHandler(log_path, maxBytes=1_000_000, backupCount=3)
-handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
-logger.addHandler(handler)
-# Also log to stdout so PaaS (Render) captures logs reliably
-stream_handler = logging.StreamHandler()
-stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
-logger.addHandler(stream_handler)
+log_listener, log_queue_handler = setup_logging(
+    logger, log_path,
+    json_format=config.LOG_FORMAT == "json",
+    level=getattr(logging, config.LOG_LEVEL, logging.INFO),
+    queue_size=config.LOG_QUEUE_SIZE,
+    sample_interval=config.LOG_SAMPLE_INTERVAL,
+    sample_burst=config.LOG_SAMPLE_BURST,
+)
+# Per-message events are sampled; warnings and errors always go through
+ingest_log = LogSampler(logger)
 import uuid
-
-# Use an explicit client id to avoid collisions and make debugging easier
-mqtt_client = mqtt.Client(client_id=f"smartpm-backend-{uuid.uuid4()}")
+from ingest import ShardedIngestWriter, normalize_timestamp
+from dedup import DuplicateFilter
+from ratelimit import DeviceRateLimiter, HeldReadingReleaser
+from payload import decode_payload
+from spool import Spool, SpoolReplayer
+from ringbuffer import LatestReadings
+from stream import ReadingBroadcaster
+from rollups import RESOLUTIONS, ROLLUP_METRICS, RollupFlusher, RollupStore, combine, coverage_split, pick_resolution, summarize
+from cache import Rendered, ResponseCache, not_modified, validators
+from db import QueryRunner, cancel_on_disconnect
+from downsample import METHODS as DOWNSAMPLE_METHODS, envelope, select as downsample_select
+from aggregation import METRICS, aggregate, column, parse_timestamps, to_micros, value_or_none
+from aqi import NOWCAST_HOURS, fleet_nowcast, pm25_to_aqi
+import numpy as np
 
 def on_connect(client, userdata, flags, rc):
     global mqtt_connected, last_sub_result
     mqtt_connected = (rc == 0)
+    metrics.mqtt_connects.inc(str(rc))
+    if rc == 0:
+        readiness.ready("mqtt")
+    else:
+        readiness.failed("mqtt", f"connect refused (rc={rc})")
     logger.info(f"Connected to MQTT with result code {rc}")
-    # Subscribe and log the result tuple (result, mid)
-    sub_result = client.subscribe("smartpm25.sensor.data")
+    # Subscribe to the legacy shared topic and per-device wildcards; log the result tuple (result, mid)
+    sub_result = client.subscribe([(topic, 0) for topic in config.MQTT_TOPICS])
     last_sub_result = sub_result
     logger.info(f"Subscribe result: {sub_result}")
 
+def on_disconnect(client, userdata, rc):
+    global mqtt_connected
+    mqtt_connected = False
+    metrics.mqtt_disconnects.inc()
+    # paho's network loop reconnects on its own after an unexpected disconnect (rc != 0)
+    logger.warning(f"Disconnected from MQTT with result code {rc}")
+
 def on_message(client, userdata, msg):
     try:
-        data = json.loads(msg.payload.decode())
+        # JSON from older firmware or the compact binary record; detected per message
+        started = time.perf_counter()
+        payload = decode_payload(msg.payload, msg.topic)
+        metrics.ingest_stage_seconds.observe(time.perf_counter() - started, "decode")
         global last_received
-        last_received = data
-        logger.info(f"Received: {data}")
+        last_received = payload
         # Ignore integration test messages that may be published during CI or local tests.
         # This prevents test data (INTEGRATION_TEST_001) from showing up in the production API.
-        device_id = data.get("device_id")
+        device_id = payload["device_id"]
         if device_id == "INTEGRATION_TEST_001":
-            logger.info("Ignoring integration test message from INTEGRATION_TEST_001")
+            ingest_log.info("ignored_test", "Ignoring integration test message from INTEGRATION_TEST_001")
+            metrics.ingest_messages.inc("ignored")
             return
         # Normalize timestamp: some devices publish seconds instead of milliseconds
-        raw_ts = None
-        try:
-            raw_ts = data.get("metadata", {}).get("timestamp")
-        except Exception:
-            raw_ts = None
+        raw_ts = payload["timestamp"]
+        started = time.perf_counter()
+        ts = normalize_timestamp(raw_ts)
+        metrics.ingest_stage_seconds.observe(time.perf_counter() - started, "normalize")
+        payload["timestamp"] = ts
+        # Redeliveries and republished readings stop here: no buffer, rollup or DB write
+        if duplicates.seen(payload):
+            ingest_log.debug("duplicate", "Dropping duplicate reading from %s (timestamp %s)", device_id, ts,
+                             device_id=device_id, timestamp=ts)
+            metrics.ingest_messages.inc("duplicate")
+            return
 
-        now_ms = int(time.time() * 1000)
-        ts = None
-        try:
-            if raw_ts is None:
-                ts = now_ms
+        ingest_log.info("received", "Received reading from %s (timestamp %s, raw %s)", device_id, ts, raw_ts,
+                        device_id=device_id, pm25=payload["pm25"], timestamp=ts)
+
+        # created_at is pinned at receipt so the in-memory copy matches the stored row,
+        # even for a reading held back by the device's budget and written later
+        payload["created_at"] = datetime.fromtimestamp(time.time(), timezone.utc).isoformat()
+        readings = limiter.offer(payload)
+        if not readings:
+            ingest_log.debug("limited", "Holding reading from %s over its budget", device_id, device_id=device_id)
+            metrics.ingest_messages.inc("limited")
+        for reading in readings:
+            if ingest_reading(reading):
+                metrics.ingest_messages.inc("accepted")
             else:
-                # Accept either int or string numeric
-                ts_val = int(raw_ts)
-                # If the value looks like seconds (10 digits or less), convert to ms
-                if ts_val < 1_000_000_000_000:
-                    ts = ts_val * 1000
-                else:
-                    ts = ts_val
-        except Exception:
-            ts = now_ms
-
-        logger.info(f"Normalized timestamp for insert: {ts} (raw: {raw_ts})")
-
-        # Insert into Supabase with retries
-        payload = {
-            "device_id": data["device_id"],
-            "pm1": data["readings"]["pm1"],
-            "pm25": data["readings"]["pm25"],
-            "pm10": data["readings"]["pm10"],
-            "aqi": data["aqi"]["value"],
-            "timestamp": ts,
-            "wifi_rssi": data["metadata"]["wifi_rssi"],
-            "ip_address": data["metadata"]["ip"]
-        }
+                metrics.ingest_messages.inc("dropped")
+
+    except Exception as e:
+        metrics.ingest_messages.inc("invalid")
+        logger.error("Error processing message on %s: %s", msg.topic, e)
+
+
+def ingest_reading(payload: dict) -> bool:
+    """Buffer, roll up, broadcast and queue a reading for insert; never blocks on the DB.
+
+    Returns False when the reading was dropped because the ingest queue is full.
+    Readings released after being held were counted as limited on arrival, so
+    only on_message counts message outcomes.
+    """
+    recent_readings.append(payload)
+    rollups.add(payload, datetime.fromisoformat(payload["created_at"]).timestamp())
+    response_cache.note_ingest()
+    broadcaster.publish(payload)
+    if not ingest_writer.submit(payload):
+        logger.error("Ingest queue full; dropping reading from %s", payload["device_id"])
+        return False
+    return True
+
+
+def create_mqtt_client() -> mqtt.Client:
+    # Use an explicit client id to avoid collisions and make debugging easier
+    client = mqtt.Client(client_id=f"smartpm-backend-{uuid.uuid4()}")
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.on_disconnect = on_disconnect
+    return client
+
+
+def insert_readings(rows):
+    return store.insert(rows)
+
+
+def probe_store():
+    # Cheapest read there is; raises while the database cannot be reached
+    store.latest(1, columns="id")
+
+
+# Recently seen (device_id, timestamp) keys, checked before anything else is done with a reading
+duplicates = DuplicateFilter(capacity=config.DEDUP_CAPACITY, window=config.DEDUP_WINDOW)
+
+# Per-device token buckets; readings over budget are held, coalesced and released later
+limiter = DeviceRateLimiter(rate=config.RATE_LIMIT_PER_DEVICE, burst=config.RATE_LIMIT_BURST,
+                            mode=config.RATE_LIMIT_MODE)
+held_releaser = HeldReadingReleaser(limiter, ingest_reading, interval=config.RATE_LIMIT_RELEASE_INTERVAL)
+
+# Newest readings per device, served by the latest/latest-batch endpoints
+recent_readings = LatestReadings(capacity=config.RECENT_READINGS_PER_DEVICE)
+
+# Live push to /api/readings/stream clients
+broadcaster = ReadingBroadcaster(queue_size=config.STREAM_QUEUE_SIZE)
+
+# Rollups at 10s/1m/10m/1h, updated per reading and flushed to readings_rollup
+rollups = RollupStore()
+
+
+def merge_rollups(rows):
+    store.merge_rollups(rows)
+    # API workers must stop adding these deltas on top of the DB as soon as possible
+    hot_state_publisher.notify()
+
+
+rollup_flusher = RollupFlusher(rollups, merge_rollups, interval=config.ROLLUP_FLUSH_INTERVAL)
+
+# Only processes that ingest write or replay the spool, so api workers never create its file
+spool = Spool(config.SPOOL_PATH, max_bytes=config.SPOOL_MAX_BYTES) if INGESTS else None
+spool_replayer = SpoolReplayer(spool, insert_readings, probe_fn=probe_store) if INGESTS else None
+
+# One writer per shard; each device always maps to the same shard
+ingest_writer = ShardedIngestWriter(
+    insert_readings,
+    shards=config.INGEST_WORKERS,
+    max_batch=config.INGEST_BATCH_SIZE,
+    max_age=config.INGEST_MAX_AGE,
+    max_queue=max(1, config.INGEST_QUEUE_SIZE // max(1, config.INGEST_WORKERS)),
+    spool=spool,
+    on_success=spool_replayer.notify_healthy if spool_replayer else None,
+    high_water=config.INGEST_HIGH_WATER,
+    low_water=config.INGEST_LOW_WATER,
+)
+
+# All request-path queries go through this bounded pool so the event loop never blocks on the store
+db = QueryRunner(max_concurrency=config.DB_MAX_CONCURRENCY, timeout=config.DB_QUERY_TIMEOUT)
+
+# Cached history/aggregated responses. TTLs track each timeframe's bucket width so
+# a cached answer is never more than about half a bucket behind.
+response_cache = ResponseCache(max_entries=config.RESPONSE_CACHE_SIZE, min_ttl=config.RESPONSE_CACHE_MIN_TTL)
+
+
+
+def hot_state_version():
+    return recent_readings.version, rollups.generation, mqtt_connected
+
+
+def collect_hot_state() -> dict:
+    return {
+        "readings": recent_readings.rows(per_device=config.HOT_STATE_ROWS_PER_DEVICE),
+        "warm": recent_readings.warm,
+        "rollups": rollups.dirty_state(),
+        "mqtt_connected": mqtt_connected,
+        "last_received": last_received,
+    }
+
+
+def apply_hot_state(state: dict):
+    """API role: serve the ingest process's buffer, rollup deltas and MQTT status from now on."""
+    global mqtt_connected, last_received
+    previous = recent_readings.last_by_device() if hot_state_reader.loaded else None
+    recent_readings.replace(state["readings"], state["warm"])
+    rollups.replace_dirty(state["rollups"])
+    mqtt_connected = state["mqtt_connected"]
+    last_received = state["last_received"]
+    if not readiness.is_ready("hot_state"):
+        readiness.ready("hot_state")
+    if previous is None:
+        return
+    # Readings that arrived since the last snapshot go out to this worker's stream clients
+    def newer(row):
+        last = previous.get(row.get("device_id"))
+        return last is None or (row.get("created_at") or "") > (last.get("created_at") or "")
+    fresh = sorted(filter(newer, state["readings"]), key=lambda r: r.get("created_at") or "")
+    if fresh:
+        response_cache.note_ingest()
+        for row in fresh:
+            broadcaster.publish(row)
+
+
+# Ingest role: publishes hot state for the api workers; api role: reloads it when it changes
+hot_state_publisher = SnapshotPublisher(config.HOT_STATE_PATH, collect_hot_state, hot_state_version,
+                                        interval=config.HOT_STATE_INTERVAL)
+hot_state_reader = SnapshotReader(config.HOT_STATE_PATH, apply_hot_state, interval=config.HOT_STATE_POLL)
+
+HISTORY_CACHE_TTL = {"5min": 2, "30min": 10, "1h": 15, "4h": 30, "24h": 60, "7d": 300, "30d": 900, "1y": 3600}
+AGGREGATED_CACHE_TTL = {"5m": 5, "30m": 15, "1h": 30, "4h": 60, "24h": 120, "7d": 300, "30d": 900, "1y": 3600}
+
+def parse_device_ids(device_id: str):
+    """Comma-separated `device_id` query param -> set of ids, or None for every device."""
+    if not device_id:
+        return None
+    return set(d.strip() for d in device_id.split(",") if d.strip()) or None
+
+
+def device_key(device_ids):
+    """Hashable, order-independent form of a device filter for cache keys."""
+    return tuple(sorted(device_ids)) if device_ids else None
 
-        max_attempts = 3
-        delay = 0.5
-        for attempt in range(1, max_attempts + 1):
-            try:
-                resp = supabase.table("readings").insert(payload).execute()
-                # Supabase client may include error info in resp.error or resp.get('error')
-                # Log and break on success
-                logger.info(f"Supabase insert response: {getattr(resp, 'data', resp)}")
-                break
-            except Exception as e:
-                logger.error(f"Supabase insert attempt {attempt} failed: {e}")
-                if attempt == max_attempts:
-                    logger.error("Max Supabase insert attempts reached; dropping message")
-                else:
-                    time.sleep(delay)
-                    delay *= 2
 
+def parse_fields(fields: str):
+    """`fields` query param -> tuple of validated reading columns, or None for every column."""
+    if not fields or fields.strip() == "*":
+        return None
+    try:
+        return tuple(export.parse_columns(fields))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def newest_ingested(device_ids=None):
+    """created_at of the newest buffered reading (optionally of `device_ids` only), or None while empty."""
+    rows = recent_readings.last_by_device(device_ids)
+    return max((r.get("created_at") or "" for r in rows.values()), default="") or None
+
+
+async def render(route: str, payload, newest: str = None) -> Rendered:
+    """Await the `payload` coroutine and serialize the result once, timing the encoding per route."""
+    rendered = Rendered(await payload, newest)
+    metrics.http_serialize_seconds.observe(rendered.serialize_s, route)
+    return rendered
+
+
+def rendered_response(rendered: Rendered, key: str) -> Response:
+    """The pre-serialized body, with validators unless it reports an error."""
+    headers = None if rendered.error else validators(key, rendered.newest)
+    return Response(rendered.body, media_type="application/json", headers=headers)
+
+
+# Largest point count a client may request from the downsampling mode
+MAX_DOWNSAMPLE_POINTS = 5000
+
+
+def normalize_downsample(points: int, downsample: str):
+    """Validate the points/downsample query params; points=None disables downsampling."""
+    if not points or points <= 0:
+        return None, None
+    method = (downsample or "lttb").lower()
+    if method not in DOWNSAMPLE_METHODS:
+        raise HTTPException(status_code=400, detail=f"Invalid downsample method: {downsample}")
+    return min(max(points, 3), MAX_DOWNSAMPLE_POINTS), method
+
+async def fetch_readings_range(columns: str, start_iso: str, end_iso: str, device_ids=None, page_size: int = 1000):
+    """All non-test readings in [start, end] (optionally only `device_ids`), oldest first.
+
+    Pages with a (created_at, id) keyset instead of OFFSET so each page is an
+    index range scan; `columns` must include created_at and id. Stops at
+    config.HISTORY_MAX_ROWS to bound memory.
+    """
+    rows = []
+    last = None
+    while len(rows) < config.HISTORY_MAX_ROWS:
+        page = await db.run(lambda: store.range(columns, start_iso, end_iso, page_size, after=last, device_ids=device_ids), "range_scan")
+        rows.extend(page)
+        if len(page) < page_size:
+            break
+        last = page[-1]
+    return rows
+
+
+async def warm_recent_readings():
+    """Load the newest readings from the DB so the in-memory buffer starts warm."""
+    try:
+        rows = await db.run(lambda: store.latest(config.RECENT_READINGS_WARM_ROWS), "warm")
+        # Fewer rows than asked for means the DB holds nothing older
+        recent_readings.load(rows, complete=len(rows) < config.RECENT_READINGS_WARM_ROWS)
+        logger.info(f"Warmed recent readings buffer with {len(rows)} rows")
     except Exception as e:
-        print(f"Error processing message: {e}")
+        # Stay cold; the endpoints fall back to the DB until enough readings arrive
+        logger.error(f"Failed to warm recent readings buffer: {e}")
 
-mqtt_client.on_connect = on_connect
-mqtt_client.on_message = on_message
+async def init_store(store_ready: asyncio.Future):
+    """Open the store (retrying with backoff), start the threads that write to it, then warm the buffer.
 
-@app.on_event("startup")
-async def startup_event():
-    global supabase
-    # Initialize Supabase client
-    supabase = create_client(config.SUPABASE_URL, config.SUPABASE_KEY)
-    print(f"Connected to Supabase: {config.SUPABASE_URL}")
-    
-    # Connect to MQTT
-    # Use TLS when connecting to HiveMQ Cloud (port 8883)
+    API workers start no writers; their buffer comes from the ingest process's
+    hot state, or from the DB until that process has published one.
+    """
+    global store, compactor
+    delay = 1.0
+    while True:
+        try:
+            # Off the event loop: creating the Supabase client imports supabase and may hit the network
+            store = await asyncio.to_thread(open_store, config.STORAGE_BACKEND, config.SUPABASE_URL,
+                                            config.SUPABASE_KEY, config.STORAGE_PATH)
+            break
+        except Exception as e:
+            readiness.failed("store", e)
+            logger.error(f"Failed to open {config.STORAGE_BACKEND} storage, retrying in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+    logger.info(f"Using {store.name} storage: {config.SUPABASE_URL if store.name == 'supabase' else config.STORAGE_PATH}")
+    readiness.ready("store")
+    store_ready.set_result(True)
+    if not INGESTS:
+        if not await asyncio.to_thread(hot_state_reader.poll):
+            await warm_recent_readings()
+        hot_state_reader.start()
+        readiness.ready("recent_readings")
+        return
+    # Readings received before this point waited in the ingest queues
+    ingest_writer.start()
+    held_releaser.start()
+    spool_replayer.start()
+    rollup_flusher.start()
+    # Retention runs in its own thread, one short chunk at a time
+    compactor = Compactor(store, config.RETENTION_RAW_DAYS * 86400, config.ROLLUP_RETENTION,
+                          interval=config.COMPACTION_INTERVAL, max_chunks=config.COMPACTION_MAX_CHUNKS)
+    compactor.start()
+    await warm_recent_readings()
+    readiness.ready("recent_readings")
+    if config.BACKEND_ROLE == "ingest":
+        hot_state_publisher.start()
+
+
+def start_mqtt():
+    """Create the MQTT client and connect over TLS (HiveMQ Cloud, MQTT_PORT 8883).
+
+    With fast start the connection is made by paho's network thread, which
+    keeps retrying on its own; otherwise connect() blocks until the broker
+    answers.
+    """
+    global mqtt_client
+    client = create_mqtt_client()
     try:
-        mqtt_client.tls_set()  # use system CA certs
+        client.tls_set()  # use system CA certs
     except Exception:
         # If tls_set fails for any reason, continue and let the connection attempt run
         pass
+    client.username_pw_set(config.MQTT_USERNAME, config.MQTT_PASSWORD)
+    mqtt_client = client
+    if config.FAST_START:
+        client.connect_async(config.MQTT_BROKER, config.MQTT_PORT, 60)
+    else:
+        client.connect(config.MQTT_BROKER, config.MQTT_PORT, 60)
+    client.loop_start()
+    logger.info(f"Connecting to MQTT broker: {config.MQTT_BROKER}")
 
-    mqtt_client.username_pw_set(
-        config.MQTT_USERNAME,
-        config.MQTT_PASSWORD
-    )
-    mqtt_client.connect(config.MQTT_BROKER, 8883, 60)
-    mqtt_client.loop_start()
-    print(f"Connected to MQTT broker: {config.MQTT_BROKER}")
+
+def log_startup_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background startup failed: {task.exception()}")
+
+
+@app.on_event("startup")
+async def startup_event():
+    broadcaster.bind_loop(asyncio.get_running_loop())
+    # Queries wait for the store instead of failing while it opens
+    store_ready = asyncio.get_running_loop().create_future()
+    db.hold_until(store_ready)
+    if not config.FAST_START:
+        await init_store(store_ready)
+        if INGESTS:
+            start_mqtt()
+        return
+    # Serve HTTP now (/health, /api/internal/wake); the rest reports to /ready
+    tasks = [asyncio.create_task(init_store(store_ready))]
+    if INGESTS:
+        tasks.append(asyncio.create_task(asyncio.to_thread(start_mqtt)))
+    for task in tasks:
+        task.add_done_callback(log_startup_failure)
+        startup_tasks.append(task)
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    mqtt_client.loop_stop()
+    for task in startup_tasks:
+        task.cancel()
+    if INGESTS:
+        if mqtt_client:
+            mqtt_client.loop_stop()
+        # Flush anything still held or queued once no more messages can arrive
+        held_releaser.stop()
+        ingest_writer.stop()
+        spool_replayer.stop()
+        rollup_flusher.stop()
+        if compactor:
+            compactor.stop()
+        if config.BACKEND_ROLE == "ingest":
+            hot_state_publisher.stop()
+    else:
+        # The rollup deltas held here are the ingest process's to flush, never this worker's
+        hot_state_reader.stop()
+    db.shutdown()
+    if store:
+        store.close()
+    # Last: summaries of sampled events, then drain the log queue
+    log_listener.stop()
 
 
 @app.get("/debug/mqtt")
@@ -182,59 +516,236 @@ async def debug_mqtt(request: Request):
             "connected": mqtt_connected,
             "last_sub_result": last_sub_result,
             "last_received": last_received,
+            "ingest": ingest_writer.stats(),
+            "dedup": duplicates.stats(),
+            "rate_limit": limiter.stats(),
+            "spool": {**spool.stats(), **spool_replayer.stats()} if spool else None,
+            "recent_readings": recent_readings.stats(),
+            "stream": broadcaster.stats(),
+            "rollups": {**rollups.stats(), "flush_failures": rollup_flusher.failures},
+            "response_cache": response_cache.stats(),
+            "db": db.stats(),
+            "retention": compactor.stats() if compactor else None,
+            "log": {"queued": log_queue_handler.queue.qsize(), "dropped": log_queue_handler.dropped},
+            "startup": readiness.snapshot(),
+            "role": config.BACKEND_ROLE,
+            "hot_state": (hot_state_publisher if INGESTS else hot_state_reader).stats(),
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def active_device_count() -> int:
+    """Devices whose newest reading is younger than METRICS_ACTIVE_WINDOW seconds."""
+    cutoff = datetime.fromtimestamp(time.time() - config.METRICS_ACTIVE_WINDOW, timezone.utc).isoformat()
+    return sum(1 for row in recent_readings.last_by_device().values() if (row.get("created_at") or "") >= cutoff)
+
+
+# Scrape-time gauges; nothing is recorded for them on the hot path
+metrics.registry.gauge("smartpm_active_devices", "Devices that reported within METRICS_ACTIVE_WINDOW seconds",
+                       active_device_count)
+metrics.registry.gauge("smartpm_mqtt_connected", "1 while the MQTT client is connected", lambda: int(mqtt_connected))
+metrics.registry.gauge("smartpm_ingest_queue_depth", "Readings waiting in each ingest writer shard",
+                       lambda: {(str(i),): s["queue_depth"] for i, s in enumerate(ingest_writer.stats()["shards"])},
+                       ("shard",))
+metrics.registry.gauge("smartpm_ingest_held_readings", "Readings held back by per-device budgets",
+                       limiter.held)
+metrics.registry.gauge("smartpm_ingest_shedding", "Writer shards spooling new readings above the high-water mark",
+                       ingest_writer.shedding)
+metrics.registry.gauge("smartpm_dedup_hit_ratio", "Share of checked readings dropped as duplicates since startup",
+                       lambda: duplicates.stats()["hit_rate"])
+metrics.registry.gauge("smartpm_dedup_keys", "Keys held by the duplicate filter", lambda: duplicates.stats()["keys"])
+metrics.registry.gauge("smartpm_spool_rows", "Readings waiting in the on-disk spool",
+                       lambda: len(spool) if spool else 0)
+metrics.registry.gauge("smartpm_db_in_flight", "Storage queries currently running", lambda: db.in_flight)
+metrics.registry.gauge("smartpm_component_ready", "1 once a startup component (store, recent_readings, mqtt) is ready",
+                       lambda: {(name,): int(c["state"] == "ready") for name, c in readiness.snapshot()["components"].items()},
+                       ("component",))
+metrics.registry.gauge("smartpm_hot_state_age_seconds",
+                       "Seconds since the hot state snapshot was written (ingest) or since the loaded one was (api)",
+                       lambda: (hot_state_publisher if INGESTS else hot_state_reader).stats()["age_s"])
+metrics.registry.gauge("smartpm_log_records_dropped", "Log records below ERROR discarded because the log queue was full",
+                       lambda: log_queue_handler.dropped)
+
+@app.get("/metrics")
+async def prometheus_metrics(request: Request):
+    # Optional bearer token; scrapers send it via `authorization` in their scrape config
+    if config.METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {config.METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="invalid metrics token")
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/health")
 async def health_check():
+    # Liveness only: answers as soon as the process serves HTTP, even while starting
     return {"status": "healthy", "timestamp": datetime.now(), "version": "2.1"}
 
+@app.get("/ready")
+async def readiness_check():
+    """200 once the store is open and the recent-readings buffer is warm, else 503; both list each component."""
+    snapshot = readiness.snapshot()
+    return JSONResponse(snapshot, status_code=200 if snapshot["ready"] else 503)
+
 @app.get("/api/readings/latest")
-async def get_latest_reading():
+async def get_latest_reading(device_id: str = None, request: Request = None):
+    # Served from the in-memory buffer; the DB is only consulted while it is empty
+    device_ids = parse_device_ids(device_id)
+    cached = recent_readings.latest(device_ids)
+    if cached is not None:
+        headers = validators(f"latest|{device_key(device_ids)}", cached.get("created_at"))
+        if request is not None and not_modified(request.headers, headers):
+            return Response(status_code=304, headers=headers)
+        return JSONResponse(cached, headers=headers)
     try:
         # Prefer real device data over known integration test rows.
         # First try to fetch the most recent row that is NOT the integration test.
         try:
-            filtered = supabase.table("readings")
-            # Exclude the known integration test device id. If you have more test ids,
-            # expand this check or add a dedicated 'is_test' column.
-            filtered_resp = filtered.select("*").neq("device_id", "INTEGRATION_TEST_001").order("created_at", desc=True).limit(1).execute()
-            if getattr(filtered_resp, 'data', None):
-                return filtered_resp.data[0]
+            # The store excludes the known integration test device id by default.
+            filtered = await db.run(lambda: store.latest(1, device_ids=device_ids), "latest")
+            if filtered or device_ids:
+                return filtered[0] if filtered else {"message": "No readings available yet"}
         except Exception:
             # If the filtered query fails for any reason, fall back to the unfiltered query below.
             pass
 
         # Fallback: return the most recent row regardless (covers cases where only test data exists).
-        response = supabase.table("readings").select("*").order("created_at", desc=True).limit(1).execute()
-        if response.data:
-            return response.data[0]
+        rows = await db.run(lambda: store.latest(1, include_test=True), "latest")
+        if rows:
+            return rows[0]
         else:
             return {"message": "No readings available yet"}
     except Exception as e:
         return {"error": f"Database query failed: {str(e)}"}
 
 @app.get("/api/readings/latest-batch")
-async def get_latest_batch(limit: int = 50):
+async def get_latest_batch(limit: int = 50, device_id: str = None, request: Request = None):
     """Get the latest N readings for real-time rolling display"""
     try:
         # Limit to reasonable range
         limit = min(max(limit, 1), 200)
+
+        device_ids = parse_device_ids(device_id)
+        cached = recent_readings.latest_batch(limit, device_ids)
+        if cached is not None:
+            headers = validators(f"latest-batch|{limit}|{device_key(device_ids)}",
+                                 cached[-1].get("created_at") if cached else None)
+            if request is not None and not_modified(request.headers, headers):
+                return Response(status_code=304, headers=headers)
+            return JSONResponse({"data": cached, "count": len(cached)}, headers=headers)
         
-        response = supabase.table("readings").select("*").neq("device_id", "INTEGRATION_TEST_001").order("created_at", desc=True).limit(limit).execute()
-        if response.data:
+        rows = await db.run(lambda: store.latest(limit, device_ids=device_ids), "latest_batch")
+        if device_ids:
+            # The next request for these devices is answered from memory
+            recent_readings.load(rows, complete=len(rows) < limit, device_ids=device_ids)
+        if rows:
             # Reverse to get chronological order (oldest first)
-            data = list(reversed(response.data))
+            data = list(reversed(rows))
             return {"data": data, "count": len(data)}
         else:
             return {"data": [], "count": 0}
     except Exception as e:
         return {"error": f"Database query failed: {str(e)}"}
 
+@app.get("/api/readings/stream")
+async def stream_readings(request: Request, device_id: str = None, backfill: int = 60):
+    """Server-sent events: a backfill snapshot, then every new reading as it arrives.
+
+    `device_id` accepts a comma-separated list to filter devices.
+    """
+    device_ids = parse_device_ids(device_id)
+    backfill = min(max(backfill, 0), 200)
+    sub = broadcaster.subscribe(device_ids)
+
+    async def event_source():
+        try:
+            snapshot = recent_readings.latest_batch(backfill, device_ids) if backfill else []
+            yield f"event: snapshot\ndata: {json.dumps({'data': snapshot or []})}\n\n"
+            while True:
+                try:
+                    row = await asyncio.wait_for(sub.queue.get(), timeout=config.STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: reading\ndata: {json.dumps(row)}\n\n"
+        finally:
+            broadcaster.unsubscribe(sub)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/api/v1/readings/aggregated")
-async def get_aggregated_readings(timeframe: str = "1h"):
+async def get_aggregated_readings(timeframe: str = "1h", points: int = None, downsample: str = "lttb",
+                                  device_id: str = None, metrics: str = None, percentiles: str = None,
+                                  request: Request = None):
+    """Get aggregated PM2.5 readings, cached per timeframe and device filter.
+
+    With `points`, the full range is reduced to about that many points instead
+    of fixed buckets: `downsample=lttb` picks representative raw readings,
+    `downsample=minmax` returns min/avg/max per bucket so spikes stay visible.
+    With `metrics` (comma-separated pm1, pm25, pm10) and/or `percentiles`
+    (comma-separated, 0-100), each bucket also carries `stats` with avg, min,
+    max, count and p<q> per metric, computed by the database in one query.
+    """
+    points, method = normalize_downsample(points, downsample)
+    device_ids = parse_device_ids(device_id)
+    spec = None
+    if metrics or percentiles:
+        try:
+            spec = aggregate_spec(1, [m.strip() for m in (metrics or "pm25").split(",") if m.strip()], AGGREGATE_BUCKET_STATS,
+                                  [float(q) for q in (percentiles or "").split(",") if q.strip()])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return await cancel_on_disconnect(request, response_cache.get_or_compute(
+        ("aggregated", timeframe, points, method, device_key(device_ids), spec),
+        AGGREGATED_CACHE_TTL.get(timeframe, 30),
+        lambda: compute_aggregated_with_aqi(timeframe, points, method, device_ids, spec),
+    ))
+
+async def compute_aggregated_with_aqi(timeframe: str, points: int = None, method: str = None, device_ids=None, spec=None):
+    return add_bucket_aqi(await compute_aggregated_readings(timeframe, points, method, device_ids, spec))
+
+# Stats of every aggregated bucket; the rollup tables hold the same ones
+AGGREGATE_BUCKET_STATS = ("avg", "min", "max", "count")
+
+
+async def fetch_bucket_stats(start_time: datetime, end_time: datetime, bucket_seconds: int, device_ids=None, spec=None):
+    """Aggregated rows for [start, end) from store.aggregate (the aggregate_readings RPC on Supabase).
+
+    pm25 avg/min/max/count are always there, shaped like the rollup rows;
+    with `spec` (metrics, stats, percentiles) every row also carries `stats`.
+    Returns None when the store cannot aggregate, e.g. the RPC is not installed yet.
+    """
+    metrics, stats, percentiles = spec or (("pm25",), AGGREGATE_BUCKET_STATS, ())
+    metrics = tuple(dict.fromkeys(("pm25",) + metrics))
+    try:
+        buckets = await db.run(lambda: store.aggregate(start_time.isoformat(), end_time.isoformat(), bucket_seconds, device_ids,
+                                                       metrics, AGGREGATE_BUCKET_STATS, percentiles), "aggregate_rpc")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.warning(f"Database aggregation unavailable, aggregating raw rows instead: {e}")
+        return None
+    data = []
+    for b in buckets:
+        row = {
+            "bucket_time": b["bucket_time"],
+            "average_pm25": b["pm25"]["avg"],
+            "min_pm25": b["pm25"]["min"],
+            "max_pm25": b["pm25"]["max"],
+            "sample_count": b["count"],
+        }
+        if spec:
+            row["stats"] = {m: b[m] for m in spec[0]}
+        data.append(row)
+    return data
+
+async def compute_aggregated_readings(timeframe: str, points: int = None, method: str = None, device_ids=None, spec=None):
     """Get aggregated PM2.5 readings using database-side aggregation for better performance"""
     try:
         from datetime import datetime, timedelta
@@ -245,7 +756,11 @@ async def get_aggregated_readings(timeframe: str = "1h"):
             "30m": {"hours": 0, "minutes": 30, "bucket_interval": "1 minute"},
             "1h": {"hours": 1, "minutes": 0, "bucket_interval": "2 minutes"},
             "4h": {"hours": 4, "minutes": 0, "bucket_interval": "10 minutes"},
-            "24h": {"hours": 24, "minutes": 0, "bucket_interval": "30 minutes"}
+            "24h": {"hours": 24, "minutes": 0, "bucket_interval": "30 minutes"},
+            # Longer than raw retention may reach: served from the 1h/1d rollup tiers only
+            "7d": {"hours": 7 * 24, "minutes": 0, "bucket_interval": "1 hour", "rollup_only": True},
+            "30d": {"hours": 30 * 24, "minutes": 0, "bucket_interval": "6 hours", "rollup_only": True},
+            "1y": {"hours": 365 * 24, "minutes": 0, "bucket_interval": "1 day", "rollup_only": True},
         }
         
         config = timeframe_configs.get(timeframe)
@@ -255,74 +770,150 @@ async def get_aggregated_readings(timeframe: str = "1h"):
         # Calculate start and end times
         now = datetime.utcnow()
         start_time = now - timedelta(hours=config["hours"], minutes=config["minutes"])
+
+        if config.get("rollup_only"):
+            if spec:
+                raise HTTPException(status_code=400, detail=f"metrics and percentiles are not available for {timeframe}")
+            return await get_long_range_aggregation(timeframe, start_time, now, config["bucket_interval"], points, device_ids)
+
+        if points:
+            return await get_downsampled_aggregation(timeframe, start_time, now, points, method, device_ids)
         
-        # Call the Supabase RPC function for aggregation
-        # Note: We'll use a simple aggregation approach since time_bucket may not be available
-        # This approach groups by time intervals and calculates averages
-        response = supabase.rpc('get_aggregated_pm25', {
-            'start_time': start_time.isoformat(),
-            'end_time': now.isoformat(),
-            'bucket_interval': config["bucket_interval"]
-        }).execute()
-        
-        if hasattr(response, 'data') and response.data:
+        # Serve from the pre-aggregated rollup tables when they cover this range; they hold no percentiles
+        bucket_seconds = BUCKET_INTERVALS[config["bucket_interval"]]
+        rollup_result = None if spec else await get_rollup_aggregation(start_time, now, bucket_seconds, device_ids)
+        if rollup_result:
+            return {
+                "timeframe": timeframe,
+                "start_time": start_time.isoformat(),
+                "end_time": now.isoformat(),
+                "bucket_interval": config["bucket_interval"],
+                "source": "rollup",
+                "data": rollup_result,
+                "count": len(rollup_result)
+            }
+
+        # Database-side aggregation (aggregate_readings on Supabase, GROUP BY on SQLite)
+        data = await fetch_bucket_stats(start_time, now, bucket_seconds, device_ids, spec)
+
+        if data is not None:
             return {
                 "timeframe": timeframe,
                 "start_time": start_time.isoformat(),
                 "end_time": now.isoformat(),
                 "bucket_interval": config["bucket_interval"],
-                "data": response.data,
-                "count": len(response.data)
+                "data": data,
+                "count": len(data)
             }
         else:
             # Fallback to simple aggregation if RPC function doesn't exist
-            return await get_aggregated_readings_fallback(timeframe, start_time, now, config["bucket_interval"])
-            
+            if spec:
+                raise HTTPException(status_code=503, detail="Database aggregation is unavailable")
+            return await get_aggregated_readings_fallback(timeframe, start_time, now, config["bucket_interval"], device_ids)
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in get_aggregated_readings: {str(e)}")
         # Fallback to existing logic if aggregation fails
-        return await get_readings_history_fallback(timeframe)
+        return await get_readings_history_fallback(timeframe, device_ids)
+
+def rollup_resolution_for(bucket_seconds: int, span_seconds: float = 0) -> int:
+    """Coarsest rollup tier that evenly divides the bucket width and is retained for the whole span."""
+    return pick_resolution(bucket_seconds, span_seconds, config.ROLLUP_RETENTION)
+
+
+async def get_rollup_aggregation(start_time: datetime, end_time: datetime, bucket_seconds: int, device_ids=None):
+    """Aggregate [start, end) from readings_rollup plus not-yet-flushed deltas.
+
+    Costs O(buckets) instead of O(raw rows). Rollups are complete only from
+    their oldest bucket on (e.g. right after deployment), so buckets before
+    that are aggregated from raw readings. Returns None when no rollup
+    resolution fits the bucket width or no part of the range is rolled up.
+    """
+    start_s = to_micros(start_time) // 1_000_000 // bucket_seconds * bucket_seconds
+    end_s = to_micros(end_time) / 1_000_000
+    resolution = rollup_resolution_for(bucket_seconds, end_s - start_s)
+    if resolution is None:
+        return None
+    # The oldest bucket itself may hold only the tail of its interval (rollups began mid-bucket)
+    oldest = await db.run(lambda: store.rollup_start(resolution), "rollup")
+    covered = [rollups.pending_start(resolution)]
+    if oldest:
+        covered.append(datetime.fromisoformat(str(oldest).replace("Z", "+00:00")).timestamp())
+    covered_from = min((c for c in covered if c is not None), default=None)
+    covered_from = None if covered_from is None else covered_from + resolution
+    split_s = coverage_split(start_s, end_s, bucket_seconds, covered_from)
+    if split_s >= end_s:
+        return None
+    split_iso = datetime.fromtimestamp(split_s, timezone.utc).isoformat()
+    end_iso = datetime.fromtimestamp(end_s, timezone.utc).isoformat()
+    stored = await db.run(lambda: store.rollup_range(resolution, split_iso, end_iso, limit=config.HISTORY_MAX_ROWS, device_ids=device_ids), "rollup")
+    rows = stored + rollups.pending(resolution, split_s, end_s + resolution, device_ids)
+    data = []
+    if split_s > start_s:
+        split_time = datetime.fromtimestamp(split_s, timezone.utc).replace(tzinfo=None)
+        data = await fetch_bucket_stats(start_time, split_time, bucket_seconds, device_ids)
+        if data is None:
+            logger.warning(f"Rollups start at {split_iso}; buckets before it are missing from this response")
+            data = []
+    return data + [
+        {
+            "bucket_time": r["bucket_start"],
+            "average_pm25": r["pm25_avg"],
+            "min_pm25": r["pm25_min"],
+            "max_pm25": r["pm25_max"],
+            "sample_count": r["count"],
+        }
+        for r in combine(rows, bucket_seconds)
+    ]
+
+
+async def get_long_range_aggregation(timeframe: str, start_time: datetime, end_time: datetime, bucket_interval: str,
+                                     points: int = None, device_ids=None):
+    """7d/30d/1y from the rollup tiers alone; raw readings may already be compacted away.
+
+    With `points`, the bucket width is widened to whole hours so the range
+    yields about that many buckets.
+    """
+    bucket_seconds = BUCKET_INTERVALS[bucket_interval]
+    if points:
+        span = (end_time - start_time).total_seconds()
+        hours = max(1, -(-int(span) // (points * 3600)))
+        bucket_seconds = hours * 3600
+        bucket_interval = "1 hour" if hours == 1 else f"{hours} hours"
+    data = await get_rollup_aggregation(start_time, end_time, bucket_seconds, device_ids) or []
+    return {
+        "timeframe": timeframe,
+        "start_time": start_time.isoformat(),
+        "end_time": end_time.isoformat(),
+        "bucket_interval": bucket_interval,
+        "source": "rollup",
+        "data": data,
+        "count": len(data)
+    }
+
 
-async def get_aggregated_readings_fallback(timeframe: str, start_time: datetime, end_time: datetime, bucket_interval: str):
+async def get_aggregated_readings_fallback(timeframe: str, start_time: datetime, end_time: datetime, bucket_interval: str, device_ids=None):
     """Fallback aggregation when database function is not available"""
     try:
-        # Simple time-based aggregation using existing data
-        response = supabase.table("readings").select("created_at, pm25, aqi").neq("device_id", "INTEGRATION_TEST_001").gte("created_at", start_time.isoformat() + "Z").lte("created_at", end_time.isoformat() + "Z").order("created_at", desc=False).execute()
-        
-        raw_data = response.data or []
-        
-        # Group data into time buckets for aggregation
-        bucket_size_minutes = {
-            "10 seconds": 1/6,
-            "1 minute": 1,
-            "2 minutes": 2,
-            "10 minutes": 10,
-            "30 minutes": 30
-        }.get(bucket_interval, 5)
-        
-        buckets = {}
-        for row in raw_data:
-            try:
-                created_at = datetime.fromisoformat(row['created_at'].replace('Z', '+00:00'))
-                # Round to bucket boundary
-                bucket_minutes = int(created_at.minute / bucket_size_minutes) * bucket_size_minutes
-                bucket_time = created_at.replace(minute=int(bucket_minutes), second=0, microsecond=0)
-                bucket_key = bucket_time.isoformat()
-                
-                if bucket_key not in buckets:
-                    buckets[bucket_key] = {'pm25_values': [], 'bucket_time': bucket_time}
-                buckets[bucket_key]['pm25_values'].append(float(row['pm25']))
-            except Exception as e:
-                continue
-        
-        # Calculate averages for each bucket
+        rows = await fetch_readings_range("id, created_at, pm25", start_time.isoformat() + "Z", end_time.isoformat() + "Z", device_ids)
+
+        # Clock-aligned buckets, matching the SQL function's bucket boundaries
+        width_us = BUCKET_INTERVALS.get(bucket_interval, 300) * 1_000_000
+        end_us = to_micros(end_time)
+        first_us = to_micros(start_time) // width_us * width_us
+        n_buckets = int((end_us - first_us) // width_us) + 1
+
+        ts_us, valid = parse_timestamps([r.get("created_at") for r in rows])
+        result = aggregate(ts_us[valid], {"pm25": column(rows, "pm25")[valid]}, first_us, end_us, width_us, n_buckets)
+
+        # Only buckets that actually contain readings, oldest first
         aggregated_data = []
-        for bucket_key in sorted(buckets.keys()):
-            bucket = buckets[bucket_key]
-            avg_pm25 = sum(bucket['pm25_values']) / len(bucket['pm25_values']) if bucket['pm25_values'] else 0
+        for i in np.flatnonzero(result["count"]):
             aggregated_data.append({
-                'bucket_time': bucket['bucket_time'].isoformat(),
-                'average_pm25': round(avg_pm25, 2)
+                'bucket_time': datetime.fromtimestamp((first_us + int(i) * width_us) / 1_000_000, timezone.utc).isoformat(),
+                'average_pm25': value_or_none(result["pm25"]["avg"][i])
             })
         
         return {
@@ -338,61 +929,159 @@ async def get_aggregated_readings_fallback(timeframe: str, start_time: datetime,
         logger.error(f"Error in fallback aggregation: {str(e)}")
         raise HTTPException(status_code=500, detail="Aggregation failed")
 
-async def get_readings_history_fallback(timeframe: str):
+async def get_downsampled_aggregation(timeframe: str, start_time: datetime, end_time: datetime, points: int, method: str, device_ids=None):
+    """Reduce every pm25 reading in [start, end] to about `points` points."""
+    rows = await fetch_readings_range("id, created_at, pm25", start_time.isoformat() + "Z", end_time.isoformat() + "Z", device_ids)
+    ts_us, valid = parse_timestamps([r.get("created_at") for r in rows])
+    ts_us = ts_us[valid]
+    pm25 = column(rows, "pm25")[valid]
+    order = np.argsort(ts_us, kind="stable")
+    ts_us, pm25 = ts_us[order], pm25[order]
+
+    def iso(us):
+        return datetime.fromtimestamp(int(us) / 1_000_000, timezone.utc).isoformat()
+
+    data = []
+    if len(ts_us) and method == "minmax":
+        # Equal-count buckets: min/avg/max per bucket, shaped like the rollup response
+        starts, lows, highs = envelope(pm25, points // 2)
+        present = ~np.isnan(pm25)
+        counts = np.add.reduceat(present.astype(np.int64), starts)
+        sums = np.add.reduceat(np.where(present, pm25, 0.0), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            avgs = sums / counts
+        for i, start in enumerate(starts):
+            data.append({
+                "bucket_time": iso(ts_us[start]),
+                "average_pm25": value_or_none(avgs[i]),
+                "min_pm25": value_or_none(lows[i]),
+                "max_pm25": value_or_none(highs[i]),
+                "sample_count": int(counts[i]),
+            })
+    elif len(ts_us):
+        for i in downsample_select(ts_us, pm25, points, method):
+            data.append({"bucket_time": iso(ts_us[i]), "average_pm25": value_or_none(pm25[i])})
+
+    return {
+        "timeframe": timeframe,
+        "start_time": start_time.isoformat(),
+        "end_time": end_time.isoformat(),
+        "source": method,
+        "data": data,
+        "count": len(data),
+        "rows_aggregated": int(len(ts_us)),
+    }
+
+async def get_readings_history_fallback(timeframe: str, device_ids=None):
     """Fallback to existing history endpoint logic"""
     # Map new timeframe format to existing period format
-    period_map = {"5m": "5min", "30m": "30min", "1h": "1h", "4h": "4h", "24h": "24h"}
+    period_map = {"5m": "5min", "30m": "30min", "1h": "1h", "4h": "4h", "24h": "24h", "7d": "7d", "30d": "30d", "1y": "1y"}
     period = period_map.get(timeframe, "1h")
-    return await get_readings_history(period)
+    return await compute_readings_history(period, device_ids=device_ids)
 
 @app.get("/api/readings/history")
-async def get_readings_history(period: str = "1h", agg: str = "avg", buckets: int = None):
-    """Get historical readings for different time periods with appropriate aggregation"""
+async def get_readings_history(period: str = "1h", agg: str = "avg", buckets: int = None, percentiles: str = None,
+                               points: int = None, downsample: str = "lttb", device_id: str = None,
+                               fields: str = None, raw: bool = True, request: Request = None):
+    """Get historical readings for a period, cached per normalized parameters.
+
+    `fields` limits the raw rows in `data` to those columns and `raw=false`
+    leaves them out. The response carries an ETag and Last-Modified derived
+    from the newest ingested reading; a poll revalidating them gets a 304
+    without any query running.
+    """
+    agg = agg.lower()
+    buckets = buckets if (buckets and buckets > 0) else None
+    if percentiles:
+        try:
+            percentiles = ",".join(f"{q:g}" for q in sorted(set(float(p) for p in percentiles.split(",") if p.strip())))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid percentiles: {percentiles}")
+    points, method = normalize_downsample(points, downsample)
+    device_ids = parse_device_ids(device_id)
+    fields = parse_fields(fields) if raw else None
+    key = ("history", period, agg, buckets, percentiles or None, points, method, device_key(device_ids), fields, raw)
+    # History ends at the newest reading overall, so that is what a cached copy is checked against
+    newest = newest_ingested()
+    if request is not None and not_modified(request.headers, validators(repr(key), newest)):
+        return Response(status_code=304, headers=validators(repr(key), newest))
+    rendered = await cancel_on_disconnect(request, response_cache.get_or_compute(
+        key,
+        HISTORY_CACHE_TTL.get(period, 10),
+        lambda: render("/api/readings/history",
+                       compute_readings_history(period, agg, buckets, percentiles, points, method, device_ids, fields, raw),
+                       newest),
+    ))
+    return rendered_response(rendered, repr(key))
+
+async def compute_readings_history(period: str = "1h", agg: str = "avg", buckets: int = None, percentiles: str = None,
+                                   points: int = None, method: str = None, device_ids=None, fields=None, raw: bool = True):
+    """Get historical readings for different time periods with appropriate aggregation.
+
+    `agg` picks the value reported as `pm25` per bucket: avg, min, max, median
+    or pNN (e.g. p90). `percentiles` adds extra percentiles (comma-separated)
+    to each bucket's `stats`. With `points`, `data` holds about that many
+    readings chosen across the whole period by `method` (lttb or minmax)
+    instead of the newest raw rows. `fields` projects those rows onto the
+    given columns in the query itself; with `raw` false they are not read.
+    """
     try:
         from datetime import datetime, timedelta
         
-        # Use the database's latest created_at as the authoritative 'now' to avoid container clock skew.
-        # Fallback to server UTC time if the DB query fails.
+        # Use the newest reading's created_at as the authoritative 'now' to avoid container clock skew.
+        # The in-memory buffer usually has it; otherwise ask the DB, then fall back to server UTC time.
         now = None
-        try:
-            latest_resp = supabase.table("readings").select("created_at").order("created_at", desc=True).limit(1).execute()
-            if getattr(latest_resp, 'data', None) and len(latest_resp.data) > 0:
-                latest_created = latest_resp.data[0].get('created_at')
-                if latest_created:
-                    # Parse ISO timestamp returned by Supabase (includes timezone offset)
-                    try:
-                        # fromisoformat supports offsets like +00:00
-                        now = datetime.fromisoformat(latest_created)
-                    except Exception:
-                        # As a last resort, fallback to utcnow
-                        now = datetime.utcnow()
-        except Exception as e:
-            # If anything goes wrong with the DB lookup, fall back to utcnow
-            now = None
+        latest_created = (recent_readings.latest() or {}).get('created_at')
+        if not latest_created:
+            try:
+                latest_rows = await db.run(lambda: store.latest(1, "created_at", include_test=True), "latest")
+                if latest_rows:
+                    latest_created = latest_rows[0].get('created_at')
+            except Exception as e:
+                # If anything goes wrong with the DB lookup, fall back to utcnow
+                latest_created = None
+        if latest_created:
+            try:
+                # Work in naive UTC so the "Z" suffix used in queries below stays valid
+                now = datetime.fromisoformat(latest_created.replace('Z', '+00:00')).astimezone(timezone.utc).replace(tzinfo=None)
+            except Exception:
+                now = None
 
         if now is None:
             now = datetime.utcnow()
         
-        # Define time ranges and limits - calculate from current time going backwards
+        # Define time ranges and raw-row limits - calculate from current time going backwards.
+        # The limit only applies to the raw rows returned in "data"; buckets cover the full range.
         time_configs = {
             "5min": {"duration": timedelta(minutes=5), "limit": 100},  # 5 minutes back, more samples
             "30min": {"duration": timedelta(minutes=30), "limit": 150},  # 30 minutes back  
             "1h": {"duration": timedelta(hours=1), "limit": 200},  # 1 hour back
             "4h": {"duration": timedelta(hours=4), "limit": 200},  # 4 hours back
             "24h": {"duration": timedelta(hours=24), "limit": 200},  # 24 hours back
+            # Long periods are bucketed from rollups (see compute_rollup_history)
+            "7d": {"duration": timedelta(days=7), "limit": 200},
+            "30d": {"duration": timedelta(days=30), "limit": 200},
+            "1y": {"duration": timedelta(days=365), "limit": 200},
         }
         
         config = time_configs.get(period, time_configs["1h"])
         start_time = now - config["duration"]
-        
-        # Query raw data from start_time to now, ordered by created_at DESC (newest first)
-        # Using created_at timestamps for proper time filtering
-        response = supabase.table("readings").select("*").neq("device_id", "INTEGRATION_TEST_001").gte("created_at", 
-            start_time.isoformat() + "Z").lte("created_at", now.isoformat() + "Z").order("created_at", desc=True).limit(config["limit"]).execute()
+        start_iso = start_time.isoformat() + "Z"
+        end_iso = now.isoformat() + "Z"
+        # Raw row columns, selected in the query rather than trimmed afterwards
+        raw_columns = ", ".join(fields) if fields else "*"
+
+        if period in LONG_PERIODS:
+            return await compute_rollup_history(period, start_time, now, buckets or points or LONG_PERIODS[period],
+                                                agg, config["limit"] if raw else 0, device_ids, raw_columns)
 
-        raw_rows = response.data or []
-        # Reverse to chronological order (oldest -> newest)
-        raw_rows = list(reversed(raw_rows))
+        raw_rows = []
+        if raw and not points:
+            # Newest raw rows for the response, ordered by created_at DESC (newest first)
+            raw_rows = await db.run(lambda: store.range(raw_columns, start_iso, end_iso, config["limit"], newest_first=True, device_ids=device_ids), "history_raw")
+
+            # Reverse to chronological order (oldest -> newest)
+            raw_rows = list(reversed(raw_rows))
 
         # Create regular time buckets spanning [start_time, now]. Use per-period bucket counts
         # so time bin sizes feel sensible for short vs long ranges.
@@ -410,69 +1099,287 @@ async def get_readings_history(period: str = "1h", agg: str = "avg", buckets: in
         # bucket_size in seconds (minimum 1 second)
         bucket_size = max(1, total_seconds / desired_buckets)
 
-        # Build bucket boundaries
-        buckets = []
-        from datetime import timedelta
-        for i in range(desired_buckets):
-            b_start = start_time + timedelta(seconds=bucket_size * i)
-            b_end = start_time + timedelta(seconds=bucket_size * (i + 1))
-            buckets.append({"start": b_start, "end": b_end, "rows": []})
+        extra_percentiles = []
+        if percentiles:
+            extra_percentiles = [float(q) for q in percentiles.split(",") if q.strip()]
+        if agg.startswith("p") and agg[1:].replace(".", "", 1).isdigit():
+            extra_percentiles.append(float(agg[1:]))
+            agg_key = f"p{float(agg[1:]):g}"
+        else:
+            agg_key = agg if agg in ("min", "max", "median") else "avg"
+        extra_percentiles = sorted(set(extra_percentiles))
 
-        # Assign rows to buckets
-        for r in raw_rows:
-            try:
-                created = r.get('created_at')
-                if not created:
-                    continue
-                created_dt = datetime.fromisoformat(created)
-            except Exception:
-                # skip unparsable timestamps
-                continue
-            # If row is out of bounds, skip
-            if created_dt < start_time or created_dt > now:
-                continue
-            # compute index
-            idx = int((created_dt - start_time).total_seconds() // bucket_size)
-            if idx < 0:
-                idx = 0
-            if idx >= len(buckets):
-                idx = len(buckets) - 1
-            buckets[idx]["rows"].append(r)
-
-        # Aggregate each bucket using the requested aggregation method
-        from statistics import median
+        # Aggregate every reading in the window in one columnar pass
+        range_columns = ["id", "device_id", "created_at", "pm1", "pm25", "pm10"]
+        if raw and points and fields:
+            range_columns = list(dict.fromkeys(range_columns + list(fields)))
+        rows = await fetch_readings_range(", ".join(range_columns), start_iso, end_iso, device_ids)
+        ts_us, valid = parse_timestamps([r.get('created_at') for r in rows])
+        columns = {name: column(rows, name)[valid] for name in METRICS}
+
+        downsampled = None
+        if raw and points:
+            # Rows arrive ordered by created_at, so positions follow time
+            valid_idx = np.flatnonzero(valid)
+            keep = downsample_select(ts_us[valid], columns["pm25"], points, method)
+            raw_rows = [rows[i] for i in valid_idx[keep]]
+            if fields:
+                raw_rows = [{c: r.get(c) for c in fields} for r in raw_rows]
+            downsampled = {"method": method, "points": len(raw_rows), "source_rows": int(len(valid_idx))}
+        start_us = to_micros(start_time)
+        result = aggregate(ts_us[valid], columns, start_us, to_micros(now), int(bucket_size * 1_000_000),
+                           desired_buckets, percentiles=extra_percentiles)
+
+        stat_keys = ["avg", "min", "max", "median"] + [f"p{q:g}" for q in extra_percentiles]
+        # AQI of each bucket's reported pm25, and the NowCast at each bucket end, for all buckets at once
+        bucket_aqi = pm25_to_aqi(result["pm25"][agg_key])
+        ends_s = start_us / 1_000_000 + bucket_size * np.arange(1, desired_buckets + 1)
+        bucket_nowcast = await nowcast_at(start_us / 1_000_000, to_micros(now) / 1_000_000, ends_s, device_ids)
+        nowcast_aqi = pm25_to_aqi(bucket_nowcast)
         agg_buckets = []
-        for b in buckets:
-            rows = b["rows"]
-            if rows:
-                pm25_vals = [float(rr.get('pm25') or 0) for rr in rows]
-                if agg == 'max':
-                    agg_pm25 = max(pm25_vals)
-                elif agg == 'median':
-                    agg_pm25 = median(pm25_vals)
-                else:
-                    # default to average
-                    agg_pm25 = sum(pm25_vals) / len(pm25_vals)
-
-                # choose latest row's aqi (rows are chronological)
-                latest_aqi = rows[-1].get('aqi')
-                count = len(rows)
-            else:
-                agg_pm25 = None
-                latest_aqi = None
-                count = 0
+        for i in range(desired_buckets):
+            count = int(result["count"][i])
             agg_buckets.append({
-                "start": b["start"].isoformat(),
-                "end": b["end"].isoformat(),
-                "pm25": (round(agg_pm25, 2) if agg_pm25 is not None else None),
-                "aqi": latest_aqi,
-                "count": count
+                "start": (start_time + timedelta(seconds=bucket_size * i)).isoformat(),
+                "end": (start_time + timedelta(seconds=bucket_size * (i + 1))).isoformat(),
+                "pm25": value_or_none(result["pm25"][agg_key][i]),
+                "aqi": aqi_or_none(bucket_aqi[i]),
+                "nowcast": value_or_none(bucket_nowcast[i]),
+                "nowcast_aqi": aqi_or_none(nowcast_aqi[i]),
+                "count": count,
+                "stats": ({name: {k: value_or_none(result[name][k][i]) for k in stat_keys} for name in METRICS}
+                          if count else None),
             })
 
-        return {"data": raw_rows, "count": len(raw_rows), "period": period, "start_time": start_time.isoformat(), "end_time": now.isoformat(), "buckets": agg_buckets}
+        response = {"data": raw_rows, "count": len(raw_rows), "period": period, "start_time": start_time.isoformat(), "end_time": now.isoformat(), "buckets": agg_buckets, "rows_aggregated": int(result["count"].sum())}
+        if downsampled:
+            response["downsample"] = downsampled
+        return response
     except Exception as e:
         return {"error": f"Database query failed: {str(e)}"}
 
+def aqi_or_none(v):
+    """Whole AQI for JSON output (truncated, like the firmware), NaN -> None."""
+    return None if np.isnan(v) else int(v)
+
+
+async def fetch_hourly_rollups(start_s: float, end_s: float, device_ids=None) -> list:
+    """Per-device 1h rollup rows (stored plus pending) from NOWCAST_HOURS - 1 hours before start_s to end_s."""
+    first_s = (int(start_s) // 3600 - (NOWCAST_HOURS - 1)) * 3600
+    first_iso = datetime.fromtimestamp(first_s, timezone.utc).isoformat()
+    end_iso = datetime.fromtimestamp(end_s, timezone.utc).isoformat()
+    stored = await db.run(lambda: store.rollup_range(3600, first_iso, end_iso, limit=config.HISTORY_MAX_ROWS, device_ids=device_ids), "rollup")
+    return stored + rollups.pending(3600, first_s, end_s + 3600, device_ids)
+
+
+async def nowcast_at(start_s: float, end_s: float, ends_s: np.ndarray, device_ids=None) -> np.ndarray:
+    """Fleet NowCast at each of `ends_s` (capped at end_s); all NaN when the 1h rollups cannot be read.
+
+    NowCast is an extra on the history buckets, so a missing readings_rollup
+    table or a timed-out read must not fail the response.
+    """
+    try:
+        hourly = await fetch_hourly_rollups(start_s, end_s, device_ids)
+    except Exception as e:
+        logger.warning(f"Hourly rollups unavailable, history is served without NowCast: {e}")
+        return np.full(len(ends_s), np.nan)
+    return fleet_nowcast(hourly, np.minimum(ends_s, end_s))
+
+
+def add_bucket_aqi(result: dict) -> dict:
+    """Add `aqi` (from average_pm25) to every row of an aggregated-readings response."""
+    rows = [r for r in result.get("data") or [] if "average_pm25" in r]
+    values = pm25_to_aqi(np.array([r["average_pm25"] for r in rows], dtype=float))
+    for row, v in zip(rows, values.tolist()):
+        row["aqi"] = aqi_or_none(v)
+    return result
+
+
+# Default bucket counts of the history periods served from rollups
+LONG_PERIODS = {"7d": 168, "30d": 120, "1y": 365}
+
+
+async def compute_rollup_history(period: str, start_time: datetime, now: datetime, desired_buckets: int,
+                                 agg: str, limit: int, device_ids=None, raw_columns: str = "*"):
+    """History buckets for the long periods, built from rollup tiers instead of raw readings.
+
+    Bucket widths are rounded up to whole hours and aligned to them, so the
+    1h and 1d tiers can answer. Rollups carry count/sum/min/max: `agg` min
+    and max are honoured, anything else reports the average, and `stats`
+    holds avg/min/max only. `data` still holds the newest `limit` raw
+    readings (`raw_columns` of them), none when `limit` is 0.
+    """
+    end_s = to_micros(now) / 1_000_000
+    span_s = end_s - to_micros(start_time) / 1_000_000
+    bucket_s = max(3600, -(-int(span_s // max(1, desired_buckets)) // 3600) * 3600)
+    first_s = int(end_s - span_s) // bucket_s * bucket_s
+    n_buckets = int((end_s - first_s) // bucket_s) + 1
+    resolution = rollup_resolution_for(bucket_s, end_s - first_s)
+    first_iso = datetime.fromtimestamp(first_s, timezone.utc).isoformat()
+    end_iso = datetime.fromtimestamp(end_s, timezone.utc).isoformat()
+
+    stored = await db.run(lambda: store.rollup_range(resolution, first_iso, end_iso, limit=config.HISTORY_MAX_ROWS, device_ids=device_ids), "rollup")
+    raw_rows = []
+    if limit:
+        raw_rows = await db.run(lambda: store.range(raw_columns, first_iso, end_iso, limit, newest_first=True, device_ids=device_ids), "history_raw")
+    merged = combine(stored + rollups.pending(resolution, first_s, end_s + resolution, device_ids), bucket_s)
+    by_start = {int(datetime.fromisoformat(r["bucket_start"]).timestamp()): r for r in merged}
+
+    value_key = f"pm25_{agg}" if agg in ("min", "max") else "pm25_avg"
+    starts_s = first_s + bucket_s * np.arange(n_buckets)
+    pm25 = np.array([by_start[s][value_key] if s in by_start else None for s in starts_s.tolist()], dtype=float)
+    bucket_aqi = pm25_to_aqi(pm25)
+    # NowCast is an hourly indicator; day-wide buckets (1y) would need a year of hourly rows for it
+    if bucket_s < 86400:
+        bucket_nowcast = await nowcast_at(first_s, end_s, starts_s + bucket_s, device_ids)
+    else:
+        bucket_nowcast = np.full(n_buckets, np.nan)
+    nowcast_aqi = pm25_to_aqi(bucket_nowcast)
+    agg_buckets = []
+    for i in range(n_buckets):
+        start_s = first_s + i * bucket_s
+        row = by_start.get(start_s)
+        count = row["count"] if row else 0
+        agg_buckets.append({
+            "start": datetime.fromtimestamp(start_s, timezone.utc).isoformat(),
+            "end": datetime.fromtimestamp(start_s + bucket_s, timezone.utc).isoformat(),
+            "pm25": value_or_none(pm25[i]),
+            "aqi": aqi_or_none(bucket_aqi[i]),
+            "nowcast": value_or_none(bucket_nowcast[i]),
+            "nowcast_aqi": aqi_or_none(nowcast_aqi[i]),
+            "count": count,
+            "stats": ({name: {k: row[f"{name}_{k}"] for k in ("avg", "min", "max")} for name in ROLLUP_METRICS}
+                      if count else None),
+        })
+
+    raw_rows = list(reversed(raw_rows))
+    return {"data": raw_rows, "count": len(raw_rows), "period": period, "start_time": first_iso, "end_time": end_iso,
+            "buckets": agg_buckets, "rows_aggregated": sum(b["count"] for b in agg_buckets),
+            "source": "rollup", "bucket_seconds": bucket_s}
+
+# Fleet summary windows: (seconds, rollup resolution to read)
+FLEET_WINDOWS = {"5m": (300, 10), "1h": (3600, 60), "24h": (86400, 600)}
+
+
+@app.get("/api/v1/fleet/summary")
+async def get_fleet_summary(window: str = "1h", device_id: str = None, request: Request = None):
+    """Latest reading plus a rollup summary over `window` for every device, in one response"""
+    if window not in FLEET_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"Invalid window: {window}")
+    device_ids = parse_device_ids(device_id)
+    return await cancel_on_disconnect(request, response_cache.get_or_compute(
+        ("fleet", window, device_key(device_ids)),
+        5,
+        lambda: compute_fleet_summary(window, device_ids),
+    ))
+
+async def compute_fleet_summary(window: str, device_ids=None):
+    seconds, resolution = FLEET_WINDOWS[window]
+    now = datetime.now(timezone.utc)
+    end_s = now.timestamp()
+    start_s = (end_s - seconds) // resolution * resolution
+    start_iso = datetime.fromtimestamp(start_s, timezone.utc).isoformat()
+    try:
+        stored = await db.run(lambda: store.rollup_range(resolution, start_iso, now.isoformat(), limit=100000, device_ids=device_ids), "rollup")
+    except Exception as e:
+        # Latest values are still useful without the window summary
+        logger.error(f"Fleet summary rollup query failed: {e}")
+        stored = []
+    summaries = summarize(stored + rollups.pending(resolution, start_s, end_s + resolution, device_ids))
+    latest = recent_readings.last_by_device(device_ids)
+    latest.pop("INTEGRATION_TEST_001", None)
+    summaries.pop("INTEGRATION_TEST_001", None)
+
+    devices = []
+    for dev in sorted(set(latest) | set(summaries)):
+        row = latest.get(dev)
+        age = None
+        if row and row.get("created_at"):
+            try:
+                created = datetime.fromisoformat(row["created_at"].replace("Z", "+00:00"))
+                age = round(end_s - created.timestamp(), 1)
+            except ValueError:
+                pass
+        devices.append({"device_id": dev, "latest": row, "age_seconds": age, "window": summaries.get(dev)})
+    return {"window": window, "generated_at": now.isoformat(), "devices": devices, "count": len(devices)}
+
+@app.get("/api/v1/readings/export")
+async def export_readings(request: Request, start: str = None, end: str = None, device_id: str = None,
+                          format: str = "csv", columns: str = None):
+    """Stream every reading in [start, end] as csv, ndjson, parquet or arrow, oldest first.
+
+    Pages through the range with the (created_at, id) keyset, reading only the
+    requested `columns`, and encodes each page as soon as it arrives; the next
+    page is fetched while the current one is sent. Memory stays bounded by a
+    page however long the range is. `end` defaults to now.
+    """
+    if config.EXPORT_TOKEN and request.headers.get("authorization") != f"Bearer {config.EXPORT_TOKEN}":
+        raise HTTPException(status_code=401, detail="invalid export token")
+    if not start:
+        raise HTTPException(status_code=400, detail="start is required")
+    fmt = format.lower()
+    try:
+        names = export.parse_columns(columns)
+        encoder = export.make_encoder(fmt, names)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=f"{fmt} export unavailable: {e}")
+    device_ids = parse_device_ids(device_id)
+    end = end or datetime.now(timezone.utc).isoformat()
+    fetch = export.fetch_columns(names)
+    page_size = config.EXPORT_PAGE_SIZE
+
+    def next_page(after):
+        return asyncio.ensure_future(db.run(lambda: store.range(fetch, start, end, page_size, after=after, device_ids=device_ids), "export"))
+
+    async def body():
+        pending = next_page(None)
+        rows = 0
+        try:
+            yield encoder.begin()
+            while pending is not None:
+                page = await pending
+                pending = next_page(page[-1]) if len(page) == page_size else None
+                rows += len(page)
+                yield encoder.encode(page)
+            yield encoder.finish()
+            logger.info(f"Exported {rows} readings as {fmt}")
+        except Exception as e:
+            # Headers are already sent; the client sees a truncated body
+            logger.error(f"Export failed after {rows} readings: {e}")
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    filename = f"readings-{start[:10]}-{end[:10]}.{fmt}"
+    return StreamingResponse(body(), media_type=export.MEDIA_TYPES[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.post("/api/internal/rollups/rebuild")
+async def rebuild_rollups(request: Request, resolution: str = "1m", start: str = None, end: str = None):
+    """Recompute one rollup resolution from raw readings over [start, end) (ISO timestamps).
+
+    Meant for closed ranges: readings still queued or spooled when the range is
+    rebuilt are not in the raw table yet. Requires the X-Debug-Token header to
+    match DEBUG_TOKEN.
+    """
+    token = os.getenv("DEBUG_TOKEN")
+    if not token:
+        raise HTTPException(status_code=403, detail="rebuild endpoint not configured")
+    if request.headers.get("X-Debug-Token") != token:
+        raise HTTPException(status_code=401, detail="invalid debug token")
+    resolution_s = RESOLUTIONS.get(resolution)
+    if resolution_s is None:
+        raise HTTPException(status_code=400, detail=f"Invalid resolution: {resolution}")
+    if not start or not end:
+        raise HTTPException(status_code=400, detail="start and end are required")
+
+    # Persist pending deltas first so the rebuilt range is not double counted afterwards
+    await db.run(rollup_flusher.flush, "rollup_flush")
+    rebuilt = await db.run(lambda: store.rebuild_rollups(resolution_s, start, end), "rollup_rebuild", timeout=config.DB_REBUILD_TIMEOUT)
+    return {"resolution": resolution, "start": start, "end": end, "buckets": rebuilt}
+
 @app.get("/api/internal/wake")
 async def wake_endpoint(request: Request):
     """
@@ -490,6 +1397,7 @@ async def wake_endpoint(request: Request):
         "status": "awake",
         "timestamp": int(time.time() * 1000),
         "mqtt_connected": mqtt_connected,
+        "ready": readiness.is_ready(),
         "last_received": last_received
     }
 
@@ -0,0 +1,264 @@
+# Prometheus metrics for SmartPM2.5 Backend
+# Counters and histograms are accumulated per thread, so recording a value on
+# the ingest or request path never takes a lock; a scrape sums every thread's
+# cells. Gauges are callbacks evaluated only at scrape time.
+
+import bisect
+import threading
+import time
+
+# Seconds; covers sub-millisecond decode up to slow remote queries
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Bytes; response bodies from a few hundred bytes up to multi-megabyte histories
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Starlette appends "; charset=utf-8" to text responses
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Holds metric declarations and one cell table per recording thread.
+
+    Each thread only ever writes to its own table, so increments are plain
+    Python arithmetic with no lock. The lock is taken once per thread (the
+    first time it records) and at scrape time. Tables of threads that have
+    exited are kept, so their counts are not lost.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._local = threading.local()
+        self._tables = []
+        self._lock = threading.Lock()
+
+    def _cells(self) -> dict:
+        cells = getattr(self._local, "cells", None)
+        if cells is None:
+            cells = self._local.cells = {}
+            with self._lock:
+                self._tables.append(cells)
+        return cells
+
+    def _register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"metric {metric.name} already registered")
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames=()) -> "Counter":
+        return self._register(Counter(self, name, help, tuple(labelnames)))
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> "Histogram":
+        return self._register(Histogram(self, name, help, tuple(labelnames), tuple(sorted(buckets))))
+
+    def gauge(self, name: str, help: str, fn, labelnames=()) -> "Gauge":
+        """`fn()` returns a number, or a {label values tuple: number} dict when labelled."""
+        return self._register(Gauge(name, help, tuple(labelnames), fn))
+
+    def _merged(self, metric) -> dict:
+        with self._lock:
+            tables = list(self._tables)
+        merged = {}
+        for table in tables:
+            # dict() copies in one step, so a concurrent insert cannot break the iteration
+            for (name, labels), cell in dict(table).items():
+                if name != metric.name:
+                    continue
+                total = merged.get(labels)
+                if total is None:
+                    merged[labels] = list(cell)
+                else:
+                    for i, v in enumerate(cell):
+                        total[i] += v
+        return merged
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            metric.render(self, lines)
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self, name: str) -> dict:
+        """{label values: cell} of a counter or histogram; for tests and debugging."""
+        metric = next(m for m in self._metrics if m.name == name)
+        return self._merged(metric)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, registry: Registry, name: str, help: str, labelnames: tuple):
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+
+    def inc(self, *labels, amount: float = 1):
+        cells = self._registry._cells()
+        key = (self.name, labels)
+        cell = cells.get(key)
+        if cell is None:
+            cell = cells[key] = [0]
+        cell[0] += amount
+
+    def render(self, registry: Registry, lines: list):
+        for labels, (value,) in sorted(registry._merged(self).items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+
+
+class Histogram:
+    """Fixed-bucket histogram; a cell is [count per bucket..., count above the last bound, sum]."""
+
+    type = "histogram"
+
+    def __init__(self, registry: Registry, name: str, help: str, labelnames: tuple, buckets: tuple):
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels):
+        cells = self._registry._cells()
+        key = (self.name, labels)
+        cell = cells.get(key)
+        if cell is None:
+            cell = cells[key] = [0] * (len(self.buckets) + 2)
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def render(self, registry: Registry, lines: list):
+        for labels, cell in sorted(registry._merged(self).items()):
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), cell[:-1]):
+                running += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {running}")
+            suffix = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {_format_value(cell[-1])}")
+            lines.append(f"{self.name}_count{suffix} {running}")
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware timing each HTTP request into `histogram` (route, method, status).
+
+    The route label is the matched path template (e.g. `/api/readings/history`),
+    never the raw URL, so query strings and ids cannot explode cardinality.
+    With `size_histogram`, the body bytes sent are recorded per (route,
+    encoding) as well. Requests for paths in `skip` are not recorded.
+    """
+
+    def __init__(self, app, histogram: Histogram, skip=(), size_histogram: Histogram = None):
+        self.app = app
+        self.histogram = histogram
+        self.size_histogram = size_histogram
+        self.skip = set(skip)
+        self._paths = None
+
+    def _route(self, scope) -> str:
+        # The router stores the matched endpoint in the shared scope dict
+        if self._paths is None:
+            self._paths = {getattr(r, "endpoint", None): r.path for r in scope["app"].routes}
+        return self._paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = [500]
+        encoding = ["identity"]
+        size = [0]
+
+        async def send_and_record_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                for k, v in message.get("headers", ()):
+                    if k.lower() == b"content-encoding":
+                        encoding[0] = v.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                size[0] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        finally:
+            route = self._route(scope)
+            if route not in self.skip:
+                self.histogram.observe(time.perf_counter() - started, route, scope["method"], str(status[0]))
+                if self.size_histogram is not None:
+                    self.size_histogram.observe(size[0], route, encoding[0])
+
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple, fn):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.fn = fn
+
+    def render(self, registry: Registry, lines: list):
+        value = self.fn()
+        if value is None:
+            return
+        values = value if self.labelnames else {(): value}
+        for labels, v in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}")
+
+
+# The process-wide registry and the metrics recorded by the pipeline modules
+registry = Registry()
+
+ingest_messages = registry.counter(
+    "smartpm_ingest_messages_total", "MQTT messages by outcome (accepted, duplicate, limited, invalid, ignored, dropped)", ("outcome",))
+ingest_limited = registry.counter(
+    "smartpm_ingest_limited_total",
+    "Readings over their device's budget, by fate (limited: held back; coalesced: merged away; released)",
+    ("outcome",))
+ingest_stage_seconds = registry.histogram(
+    "smartpm_ingest_stage_seconds", "Time spent in each ingest stage (decode, normalize, write)", ("stage",))
+ingest_rows = registry.counter(
+    "smartpm_ingest_rows_total", "Readings leaving the ingest writers by result (written, spooled, dropped)", ("result",))
+ingest_retries = registry.counter(
+    "smartpm_ingest_retries_total", "Batch insert attempts that failed and were retried")
+mqtt_connects = registry.counter(
+    "smartpm_mqtt_connects_total", "MQTT connection attempts by result code (first connect and reconnects)", ("rc",))
+mqtt_disconnects = registry.counter(
+    "smartpm_mqtt_disconnects_total", "MQTT disconnections (unexpected ones trigger a reconnect)")
+http_request_seconds = registry.histogram(
+    "smartpm_http_request_seconds", "HTTP request latency by route, method and status", ("route", "method", "status"))
+http_response_bytes = registry.histogram(
+    "smartpm_http_response_bytes", "HTTP response body bytes sent, by route and content encoding",
+    ("route", "encoding"), buckets=SIZE_BUCKETS)
+http_serialize_seconds = registry.histogram(
+    "smartpm_http_serialize_seconds", "Time spent encoding JSON response bodies (cache misses only), by route", ("route",))
+db_query_seconds = registry.histogram(
+    "smartpm_db_query_seconds", "Storage query time by query kind", ("kind",))
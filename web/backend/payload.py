@@ -0,0 +1,80 @@
+# Telemetry payload decoding for SmartPM2.5 Backend
+# Devices publish either the original JSON document or a compact binary
+# record; the first byte tells them apart (JSON always starts with '{').
+
+import json
+import struct
+
+from ingest import build_row, device_id_from_topic
+
+# Binary record, little-endian:
+#   magic u8 (0xB5) | version u8 | pm1 u16 | pm25 u16 | pm10 u16 | aqi u16 |
+#   timestamp u64 (ms) | wifi_rssi i8 | ipv4 4 bytes | device_id length u8 |
+#   device_id (utf-8)
+BINARY_MAGIC = 0xB5
+BINARY_VERSION = 1
+_HEADER = struct.Struct("<BBHHHHQb4sB")
+
+
+class PayloadError(ValueError):
+    """Raised for a binary payload that is truncated or of an unknown version,
+    or for a reading whose device_id is neither in the payload nor the topic."""
+
+
+def decode_binary(payload) -> dict:
+    """Decode a binary record into a readings row (timestamp not yet normalized).
+
+    Works on a memoryview of the MQTT payload, so nothing is copied except
+    the device id.
+    """
+    view = memoryview(payload)
+    if len(view) < _HEADER.size:
+        raise PayloadError(f"binary payload too short: {len(view)} bytes")
+    magic, version, pm1, pm25, pm10, aqi, ts, rssi, ip, id_len = _HEADER.unpack_from(view)
+    if version != BINARY_VERSION:
+        raise PayloadError(f"unsupported binary payload version {version}")
+    end = _HEADER.size + id_len
+    if len(view) < end:
+        raise PayloadError("binary payload truncated in device_id")
+    return {
+        "device_id": str(view[_HEADER.size:end], "utf-8") or None,
+        "pm1": pm1,
+        "pm25": pm25,
+        "pm10": pm10,
+        "aqi": aqi,
+        "timestamp": ts,
+        "wifi_rssi": rssi,
+        "ip_address": f"{ip[0]}.{ip[1]}.{ip[2]}.{ip[3]}",
+    }
+
+
+def encode_binary(row: dict) -> bytes:
+    """Inverse of decode_binary; used by simulators, tests and benchmarks."""
+    device_id = (row.get("device_id") or "").encode()
+    ip = bytes(int(p) for p in (row.get("ip_address") or "0.0.0.0").split("."))
+    return _HEADER.pack(
+        BINARY_MAGIC, BINARY_VERSION,
+        row["pm1"], row["pm25"], row["pm10"], row["aqi"],
+        int(row.get("timestamp") or 0), int(row.get("wifi_rssi") or 0), ip, len(device_id),
+    ) + device_id
+
+
+def decode_payload(payload, topic: str = None) -> dict:
+    """Decode a JSON or binary telemetry message into a readings row.
+
+    The row's `timestamp` is the raw device value; callers normalize it.
+    A missing device_id is taken from a per-device topic; a reading with
+    neither (e.g. on the legacy shared topic) is rejected, since one row
+    without a device_id fails the whole batch it is inserted with.
+    """
+    if payload[:1] == b"\xb5":
+        row = decode_binary(payload)
+    else:
+        data = json.loads(payload)
+        data["device_id"] = data.get("device_id") or device_id_from_topic(topic)
+        row = build_row(data, (data.get("metadata") or {}).get("timestamp"))
+    if not row["device_id"]:
+        row["device_id"] = device_id_from_topic(topic)
+    if not row["device_id"]:
+        raise PayloadError(f"no device_id in the payload or topic {topic!r}")
+    return row
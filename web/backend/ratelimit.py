@@ -0,0 +1,206 @@
+# Per-device ingest budget for SmartPM2.5 Backend
+# The firmware publishes every 10 seconds. A publish-loop bug or a
+# misconfigured test device can send hundreds of messages a second, and
+# each one would become a row to buffer, roll up and insert. A token bucket
+# per device caps that. Readings over budget are held and coalesced, then
+# written once the device has budget again, so a flood costs a bounded
+# number of rows and still delivers the newest (or most extreme) values.
+# Only a device over its own budget is limited; a backed-up ingest queue is
+# handled by the writers, which spool rather than coalesce.
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import ingest_limited
+
+logger = logging.getLogger("smartpm")
+
+MODES = ("latest", "minmax")
+
+
+def envelope(rows: list) -> list:
+    """The readings with the lowest and highest pm25, in arrival order (one if they coincide)."""
+    valued = [r for r in rows if r.get("pm25") is not None]
+    if not valued:
+        return rows[-1:]
+    lo = min(valued, key=lambda r: r["pm25"])
+    hi = max(valued, key=lambda r: r["pm25"])
+    return [r for r in rows if r is lo or r is hi]
+
+
+class _Device:
+    __slots__ = ("tokens", "updated", "held", "admitted", "limited", "coalesced", "released")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.held = []
+        self.admitted = 0
+        self.limited = 0
+        self.coalesced = 0
+        self.released = 0
+
+
+class DeviceRateLimiter:
+    """Token bucket per device; readings over budget are held and coalesced rather than dropped.
+
+    Each device earns `rate` readings per second, up to `burst` (rate 0
+    means no per-device limit). A reading over budget joins its device's
+    held readings, which `mode` keeps small: "latest" keeps only the newest,
+    "minmax" the lowest and highest pm25 (the envelope minmax downsampling
+    keeps). Held readings go out with the device's next reading once it has
+    budget, or from release().
+    """
+
+    def __init__(self, rate: float = 1.0, burst: float = 10.0, mode: str = "latest", max_devices: int = 10_000):
+        if mode not in MODES:
+            raise ValueError(f"Unknown rate limit mode: {mode}")
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.mode = mode
+        self.max_devices = max_devices
+        self._devices = OrderedDict()
+        self._holding = set()  # device ids with held readings
+        self._lock = threading.Lock()
+
+    def _device(self, device_id, now: float) -> _Device:
+        dev = self._devices.get(device_id)
+        if dev is None:
+            dev = self._devices[device_id] = _Device(self.burst, now)
+            self._evict()
+        else:
+            self._devices.move_to_end(device_id)
+            if self.rate > 0:
+                dev.tokens = min(self.burst, dev.tokens + (now - dev.updated) * self.rate)
+            dev.updated = now
+        return dev
+
+    def _evict(self):
+        # Idle devices go first; a device holding readings is kept until they are released
+        if len(self._devices) <= self.max_devices:
+            return
+        for device_id in list(self._devices):
+            if device_id not in self._holding:
+                del self._devices[device_id]
+                if len(self._devices) <= self.max_devices:
+                    return
+
+    def _hold(self, device_id, dev: _Device, row: dict):
+        dev.limited += 1
+        ingest_limited.inc("limited")
+        rows = dev.held + [row]
+        dev.held = rows[-1:] if self.mode == "latest" else envelope(rows)
+        dropped = len(rows) - len(dev.held)
+        if dropped:
+            dev.coalesced += dropped
+            ingest_limited.inc("coalesced", amount=dropped)
+        self._holding.add(device_id)
+
+    def _take(self, device_id, dev: _Device) -> list:
+        rows = dev.held
+        dev.held = []
+        self._holding.discard(device_id)
+        if self.rate > 0:
+            dev.tokens -= len(rows)
+        dev.released += len(rows)
+        ingest_limited.inc("released", amount=len(rows))
+        return rows
+
+    def offer(self, row: dict, now: float = None) -> list:
+        """Readings to ingest now, in order: [row] within budget, [] when it is held,
+        or the device's held readings (row coalesced into them) once budget is back."""
+        now = time.monotonic() if now is None else now
+        device_id = row.get("device_id")
+        with self._lock:
+            dev = self._device(device_id, now)
+            within = self.rate <= 0 or dev.tokens >= 1
+            if not dev.held and within:
+                if self.rate > 0:
+                    dev.tokens -= 1
+                dev.admitted += 1
+                return [row]
+            self._hold(device_id, dev, row)
+            return self._take(device_id, dev) if within else []
+
+    def release(self, now: float = None, force: bool = False) -> list:
+        """Held readings of devices that have budget again (every held reading with `force`)."""
+        now = time.monotonic() if now is None else now
+        out = []
+        with self._lock:
+            for device_id in list(self._holding):
+                dev = self._device(device_id, now)
+                if force or self.rate <= 0 or dev.tokens >= 1:
+                    out.extend(self._take(device_id, dev))
+        return out
+
+    def held(self) -> int:
+        with self._lock:
+            return sum(len(self._devices[d].held) for d in self._holding)
+
+    def device_stats(self, top: int = 50) -> dict:
+        """Counters of the `top` devices with the most limited readings."""
+        with self._lock:
+            limited = [(d, dev) for d, dev in self._devices.items() if dev.limited]
+        limited.sort(key=lambda item: item[1].limited, reverse=True)
+        return {
+            device_id: {"admitted": dev.admitted, "limited": dev.limited, "coalesced": dev.coalesced,
+                        "released": dev.released, "held": len(dev.held), "tokens": round(dev.tokens, 2)}
+            for device_id, dev in limited[:top]
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = {k: sum(getattr(dev, k) for dev in self._devices.values())
+                      for k in ("admitted", "limited", "coalesced", "released")}
+            held = sum(len(self._devices[d].held) for d in self._holding)
+            devices = len(self._devices)
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "mode": self.mode,
+            "devices": devices,
+            "held": held,
+            **totals,
+            "by_device": self.device_stats(),
+        }
+
+
+class HeldReadingReleaser:
+    """Background thread passing released readings to `ingest_fn` every `interval` seconds.
+
+    stop() releases whatever is still held, so shutdown loses nothing.
+    """
+
+    def __init__(self, limiter: DeviceRateLimiter, ingest_fn, interval: float = 1.0):
+        self.limiter = limiter
+        self.ingest_fn = ingest_fn
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="held-reading-releaser", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.release(force=True)
+
+    def release(self, force: bool = False):
+        for row in self.limiter.release(force=force):
+            try:
+                self.ingest_fn(row)
+            except Exception as e:
+                logger.error(f"Ingesting a held reading from {row.get('device_id')} failed: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.release()
@@ -0,0 +1,51 @@
+# Startup readiness for SmartPM2.5 Backend
+# With fast start, the app answers HTTP before the store, the warm buffer and
+# the MQTT connection exist; each is initialized in the background and
+# reports here, for /ready, /api/internal/wake and /metrics.
+
+import threading
+import time
+
+
+class Readiness:
+    """State of each startup component: pending, ready or failed (with the last error).
+
+    Components may be marked from any thread (MQTT callbacks run on paho's
+    network thread). A failed component can still become ready on a later
+    attempt. `required` lists the components /ready waits for.
+    """
+
+    def __init__(self, components, required=None):
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._states = {name: {"state": "pending", "attempts": 0, "ms": None, "error": None} for name in components}
+        self.required = tuple(required if required is not None else components)
+
+    def _mark(self, name: str, state: str, error=None):
+        with self._lock:
+            entry = self._states[name]
+            entry["state"] = state
+            entry["attempts"] += 1
+            entry["ms"] = round((time.monotonic() - self._started) * 1000, 1)
+            entry["error"] = str(error) if error is not None else None
+
+    def ready(self, name: str):
+        self._mark(name, "ready")
+
+    def failed(self, name: str, error):
+        self._mark(name, "failed", error)
+
+    def is_ready(self, name: str = None) -> bool:
+        """One component, or every required one when `name` is None."""
+        with self._lock:
+            names = (name,) if name else self.required
+            return all(self._states[n]["state"] == "ready" for n in names)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            components = {name: dict(entry) for name, entry in self._states.items()}
+        return {
+            "ready": all(components[n]["state"] == "ready" for n in self.required),
+            "uptime_ms": round((time.monotonic() - self._started) * 1000, 1),
+            "components": components,
+        }
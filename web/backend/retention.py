@@ -0,0 +1,166 @@
+# Retention and compaction for SmartPM2.5 Backend
+# Raw readings older than the raw retention are deleted one hour at a time,
+# after making sure the long-term rollup tiers hold them; each rollup
+# resolution is then pruned to its own retention one day at a time.
+
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from rollups import coarsen
+
+logger = logging.getLogger("smartpm")
+
+# Tiers rebuilt from raw readings before a chunk is deleted; the 1d tier is
+# then re-derived from the day's 1h buckets
+REBUILT_RESOLUTIONS = (60, 600, 3600)
+DAY_S = 86400
+
+# Raw readings are compacted in aligned hour chunks, so every rebuilt bucket
+# is either fully inside a chunk or fully outside it
+RAW_CHUNK_S = 3600
+ROLLUP_CHUNK_S = DAY_S
+
+EPOCH_ISO = "1970-01-01T00:00:00+00:00"
+
+
+def _iso(epoch_s: float) -> str:
+    return datetime.fromtimestamp(epoch_s, timezone.utc).isoformat()
+
+
+def _epoch(iso: str) -> float:
+    return datetime.fromisoformat(iso.replace("Z", "+00:00")).timestamp()
+
+
+class Compactor:
+    """Background thread enforcing raw and per-resolution rollup retention.
+
+    Each pass handles at most `max_chunks` chunks per table and pauses
+    `pause` seconds between them, so every delete is short and the store is
+    never locked for long. A raw chunk is checked against its 1h rollups
+    first: if the rollups hold fewer readings than the raw table (e.g. rows
+    imported without going through ingest), the 1m/10m/1h tiers are rebuilt
+    from raw for that hour and the day's 1d buckets are re-derived from its
+    1h buckets, before the raw rows are deleted.
+
+    `rollup_retention` maps resolution seconds to retention seconds; 0 or a
+    missing entry keeps that resolution forever. `raw_retention_s` of 0
+    disables raw compaction.
+    """
+
+    def __init__(self, store, raw_retention_s: float, rollup_retention: dict, interval: float = 600.0,
+                 max_chunks: int = 24, pause: float = 0.1):
+        self.store = store
+        self.raw_retention_s = raw_retention_s
+        self.rollup_retention = dict(rollup_retention)
+        self.interval = interval
+        self.max_chunks = max_chunks
+        self.pause = pause
+        self._stop = threading.Event()
+        self._thread = None
+        self.passes = 0
+        self.failures = 0
+        self.readings_deleted = 0
+        self.chunks_rebuilt = 0
+        self.buckets_deleted = 0
+        self.last_run_ms = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self, now_s: float = None) -> dict:
+        """One pass over raw readings and every rollup resolution."""
+        now_s = time.time() if now_s is None else now_s
+        started = time.monotonic()
+        result = {"readings_deleted": 0, "chunks_rebuilt": 0, "buckets_deleted": 0}
+        try:
+            self._compact_raw(now_s, result)
+            self._prune_rollups(now_s, result)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Retention pass failed: {e}")
+        self.passes += 1
+        self.readings_deleted += result["readings_deleted"]
+        self.chunks_rebuilt += result["chunks_rebuilt"]
+        self.buckets_deleted += result["buckets_deleted"]
+        self.last_run_ms = round((time.monotonic() - started) * 1000, 1)
+        if any(result.values()):
+            logger.info(f"Retention pass: {result}")
+        return result
+
+    def _compact_raw(self, now_s: float, result: dict):
+        if not self.raw_retention_s:
+            return
+        cutoff = (now_s - self.raw_retention_s) // RAW_CHUNK_S * RAW_CHUNK_S
+        for _ in range(self.max_chunks):
+            if self._stop.is_set():
+                return
+            oldest = self.store.range("created_at, id", EPOCH_ISO, _iso(cutoff), 1)
+            if not oldest:
+                return
+            start = _epoch(oldest[0]["created_at"]) // RAW_CHUNK_S * RAW_CHUNK_S
+            if start >= cutoff:
+                return
+            start_iso, end_iso = _iso(start), _iso(start + RAW_CHUNK_S)
+            raw = self.store.count(start_iso, end_iso)
+            stored = sum(r.get("count") or 0 for r in self.store.rollup_range(3600, start_iso, start_iso, limit=100000))
+            if raw > stored:
+                for res in REBUILT_RESOLUTIONS:
+                    self.store.rebuild_rollups(res, start_iso, end_iso)
+                self._rederive_day(start // DAY_S * DAY_S)
+                result["chunks_rebuilt"] += 1
+            elif raw < stored:
+                logger.warning(f"Compacting {start_iso}: rollups count {stored} readings but only {raw} raw rows remain")
+            result["readings_deleted"] += self.store.delete_range(start_iso, end_iso)
+            self._stop.wait(self.pause)
+
+    def _rederive_day(self, day: float):
+        hours = self.store.rollup_range(3600, _iso(day), _iso(day + DAY_S - 1), limit=100000)
+        self.store.delete_rollups(DAY_S, _iso(day), _iso(day + DAY_S))
+        self.store.merge_rollups(coarsen(hours, DAY_S))
+
+    def _prune_rollups(self, now_s: float, result: dict):
+        for resolution_s, retention_s in sorted(self.rollup_retention.items()):
+            if not retention_s:
+                continue
+            cutoff = now_s - retention_s
+            for _ in range(self.max_chunks):
+                if self._stop.is_set():
+                    return
+                oldest = self.store.rollup_range(resolution_s, EPOCH_ISO, _iso(cutoff), limit=1)
+                if not oldest:
+                    break
+                start = _epoch(oldest[0]["bucket_start"]) // ROLLUP_CHUNK_S * ROLLUP_CHUNK_S
+                end = min(start + ROLLUP_CHUNK_S, cutoff)
+                deleted = self.store.delete_rollups(resolution_s, _iso(start), _iso(end))
+                result["buckets_deleted"] += deleted
+                if not deleted:
+                    break
+                self._stop.wait(self.pause)
+
+    def stats(self) -> dict:
+        return {
+            "raw_retention_days": round(self.raw_retention_s / 86400, 2) if self.raw_retention_s else None,
+            "passes": self.passes,
+            "failures": self.failures,
+            "readings_deleted": self.readings_deleted,
+            "chunks_rebuilt": self.chunks_rebuilt,
+            "buckets_deleted": self.buckets_deleted,
+            "last_run_ms": self.last_run_ms,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
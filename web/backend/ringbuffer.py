@@ -0,0 +1,202 @@
+# In-memory recent readings for SmartPM2.5 Backend
+# Fixed-size, per-device ring buffers fed from on_message so the latest-reading
+# endpoints are answered without a database round trip.
+
+import heapq
+import threading
+
+
+def _row_key(row: dict) -> tuple:
+    return row.get("device_id"), row.get("timestamp"), row.get("created_at")
+
+
+class DeviceRing:
+    """Array-backed ring buffer holding the newest `capacity` rows of one device."""
+
+    __slots__ = ("_buf", "_capacity", "_next", "_size")
+
+    def __init__(self, capacity: int):
+        self._buf = [None] * capacity
+        self._capacity = capacity
+        self._next = 0
+        self._size = 0
+
+    def append(self, row: dict):
+        self._buf[self._next] = row
+        self._next = (self._next + 1) % self._capacity
+        if self._size < self._capacity:
+            self._size += 1
+
+    def last(self):
+        if not self._size:
+            return None
+        return self._buf[self._next - 1]
+
+    def latest(self, n: int) -> list:
+        """Newest `n` rows in chronological order (oldest first)."""
+        n = min(n, self._size)
+        if n <= 0:
+            return []
+        start = self._next - n
+        if start >= 0:
+            return self._buf[start:self._next]
+        return self._buf[start:] + self._buf[:self._next]
+
+    def __len__(self):
+        return self._size
+
+
+class LatestReadings:
+    """Per-device rings plus the cross-device queries the dashboard needs.
+
+    Rows are ordered by `created_at` (ISO-8601 UTC strings compare correctly
+    as text). The buffer counts as warm once it has been loaded from the DB;
+    until then only `latest` is trusted from memory. A fleet-wide warm-up
+    only holds the newest rows overall, so a device's ring answers a
+    request of `limit` rows on its own only when it has that many rows or is
+    known to hold the device's whole history.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self._rings = {}
+        self._lock = threading.Lock()
+        self.warm = False
+        self._all_complete = False  # the last fleet-wide load held every stored row
+        self._complete = set()  # devices whose every stored row was loaded
+        self.version = 0  # bumped by every append/load, so a copy can tell when it is stale
+        self.hits = 0
+        self.misses = 0
+
+    def append(self, row: dict):
+        device_id = row.get("device_id")
+        with self._lock:
+            ring = self._rings.get(device_id)
+            if ring is None:
+                ring = self._rings[device_id] = DeviceRing(self.capacity)
+            ring.append(row)
+            self.version += 1
+
+    def load(self, rows: list, complete: bool = False, device_ids=None):
+        """Merge DB rows (any order) into the buffer.
+
+        Without `device_ids` this is the fleet-wide warm-up and marks the
+        buffer warm; with them, `rows` are those devices' newest readings.
+        `complete` says the query returned every stored row it matched.
+
+        Live readings may have been appended while the DB was queried, so the
+        rows are merged with each ring's contents by `created_at`, and a row
+        already held (same device, timestamp and created_at) is kept once.
+        """
+        by_device = {}
+        for row in rows:
+            by_device.setdefault(row.get("device_id"), []).append(row)
+        with self._lock:
+            for device_id, loaded in by_device.items():
+                ring = self._rings.get(device_id)
+                held = ring.latest(len(ring)) if ring is not None else []
+                merged = {_row_key(r): r for r in loaded}
+                merged.update((_row_key(r), r) for r in held)
+                ordered = sorted(merged.values(), key=lambda r: r.get("created_at") or "")
+                ring = self._rings[device_id] = DeviceRing(self.capacity)
+                for row in ordered[-self.capacity:]:
+                    ring.append(row)
+            if device_ids is None:
+                self.warm = True
+                self._all_complete = self._all_complete or complete
+            elif complete:
+                self._complete.update(device_ids)
+            self.version += 1
+
+    def rows(self, per_device=None) -> list:
+        """Every buffered row (or each device's newest `per_device`), device by device, each device oldest first."""
+        with self._lock:
+            return [row for ring in self._rings.values()
+                    for row in ring.latest(len(ring) if per_device is None else per_device)]
+
+    def replace(self, rows: list, warm: bool):
+        """Swap the whole buffer for `rows` (as returned by rows()), e.g. another process's copy."""
+        rings = {}
+        for row in rows:
+            device_id = row.get("device_id")
+            ring = rings.get(device_id)
+            if ring is None:
+                ring = rings[device_id] = DeviceRing(self.capacity)
+            ring.append(row)
+        with self._lock:
+            self._rings = rings
+            self.warm = warm
+            # Nothing is known about how much of each device the other copy held
+            self._all_complete = False
+            self._complete = set()
+            self.version += 1
+
+    def latest(self, device_ids=None):
+        """Most recent row across all devices (or just `device_ids`), or None when empty."""
+        with self._lock:
+            candidates = [
+                ring.last() for device_id, ring in self._rings.items()
+                if len(ring) and (device_ids is None or device_id in device_ids)
+            ]
+        if not candidates:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return max(candidates, key=lambda r: r.get("created_at") or "")
+
+    def latest_batch(self, limit: int, device_ids=None):
+        """Newest `limit` rows across devices, oldest first.
+
+        Returns None when the buffer cannot answer authoritatively, signalling
+        a DB fallback: for the whole fleet, when it is not warmed and holds
+        fewer than `limit` rows; for `device_ids`, when one of them has fewer
+        than `limit` rows buffered and is not known to have no more.
+        """
+        with self._lock:
+            per_device = [
+                ring.latest(limit) for device_id, ring in self._rings.items()
+                if device_ids is None or device_id in device_ids
+            ]
+            total = sum(len(rows) for rows in per_device)
+            if device_ids is None:
+                known = self.warm or total >= limit
+            else:
+                known = self._all_complete or all(
+                    device_id in self._complete or len(self._rings.get(device_id) or ()) >= limit
+                    for device_id in device_ids
+                )
+            if not known:
+                self.misses += 1
+                return None
+        self.hits += 1
+        if len(per_device) <= 1:
+            return per_device[0][-limit:] if per_device else []
+        merged = heapq.merge(*per_device, key=lambda r: r.get("created_at") or "")
+        return list(merged)[-limit:]
+
+    def last_by_device(self, device_ids=None) -> dict:
+        """Newest row of every device (optionally only `device_ids`)."""
+        with self._lock:
+            return {
+                device_id: ring.last() for device_id, ring in self._rings.items()
+                if len(ring) and (device_ids is None or device_id in device_ids)
+            }
+
+    def devices(self) -> list:
+        with self._lock:
+            return list(self._rings.keys())
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = sum(len(ring) for ring in self._rings.values())
+            devices = len(self._rings)
+        return {
+            "warm": self.warm,
+            "complete": self._all_complete,
+            "complete_devices": len(self._complete),
+            "devices": devices,
+            "rows": rows,
+            "capacity_per_device": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,269 @@
+# Multi-resolution rollups for SmartPM2.5 Backend
+# count/sum/min/max per (resolution, device, bucket), updated as readings
+# arrive and flushed to the readings_rollup table as additive deltas.
+
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger("smartpm")
+
+# Resolution name -> bucket width in seconds
+RESOLUTIONS = {"10s": 10, "1m": 60, "10m": 600, "1h": 3600, "1d": 86400}
+
+ROLLUP_METRICS = ("pm1", "pm25", "pm10")
+
+
+def _new_stats():
+    # [count, pm1_sum, pm1_min, pm1_max, pm25_sum, ..., pm10_max]
+    return [0] + [0.0, None, None] * len(ROLLUP_METRICS)
+
+
+def _merge(stats, count, values):
+    """Fold `count` readings summarised by `values` (sum, min, max per metric) into stats."""
+    stats[0] += count
+    for m in range(len(ROLLUP_METRICS)):
+        s, lo, hi = values[3 * m:3 * m + 3]
+        i = 1 + 3 * m
+        stats[i] += s
+        stats[i + 1] = lo if stats[i + 1] is None else min(stats[i + 1], lo)
+        stats[i + 2] = hi if stats[i + 2] is None else max(stats[i + 2], hi)
+
+
+def pick_resolution(bucket_s: int, age_s: float = 0, retention: dict = None):
+    """Rollup tier for buckets of `bucket_s` reaching back `age_s` seconds.
+
+    The coarsest resolution that evenly divides the bucket width and whose
+    stored rows (per `retention`, resolution -> seconds, 0/None = forever)
+    still reach that far back. If no dividing tier is retained long enough,
+    the coarsest dividing one is returned anyway; None if none divides.
+    """
+    fits = [res for res in RESOLUTIONS.values() if bucket_s % res == 0]
+    kept = [res for res in fits if not (retention or {}).get(res) or retention[res] >= age_s]
+    return max(kept or fits) if fits else None
+
+
+def bucket_iso(epoch_s: int) -> str:
+    return datetime.fromtimestamp(epoch_s, timezone.utc).isoformat()
+
+
+def stats_to_row(resolution_s: int, device_id: str, bucket_start: int, stats: list) -> dict:
+    """Shape one bucket like a readings_rollup row."""
+    row = {
+        "resolution_s": resolution_s,
+        "device_id": device_id,
+        "bucket_start": bucket_iso(bucket_start),
+        "count": stats[0],
+    }
+    for m, name in enumerate(ROLLUP_METRICS):
+        row[f"{name}_sum"] = stats[1 + 3 * m]
+        row[f"{name}_min"] = stats[2 + 3 * m]
+        row[f"{name}_max"] = stats[3 + 3 * m]
+    return row
+
+
+def row_to_stats(row: dict) -> list:
+    stats = [row.get("count") or 0]
+    for name in ROLLUP_METRICS:
+        stats += [row.get(f"{name}_sum") or 0.0, row.get(f"{name}_min"), row.get(f"{name}_max")]
+    return stats
+
+
+class RollupStore:
+    """Rollup deltas not yet persisted to readings_rollup.
+
+    `add` is O(number of resolutions) per reading. Only unflushed deltas are
+    kept in memory; the DB table holds everything flushed.
+    """
+
+    def __init__(self, resolutions=tuple(RESOLUTIONS.values())):
+        self.resolutions = tuple(resolutions)
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self.flushed_buckets = 0
+        self.generation = 0  # bumped whenever deltas leave or return without a reading
+
+    def add(self, row: dict, epoch_s: float):
+        try:
+            values = []
+            for name in ROLLUP_METRICS:
+                v = float(row[name])
+                values += [v, v, v]
+        except (KeyError, TypeError, ValueError):
+            return
+        device_id = row.get("device_id")
+        with self._lock:
+            for res in self.resolutions:
+                key = (res, device_id, int(epoch_s // res) * res)
+                stats = self._dirty.get(key)
+                if stats is None:
+                    stats = self._dirty[key] = _new_stats()
+                _merge(stats, 1, values)
+
+    def drain_dirty(self) -> list:
+        """Take every unpersisted delta as readings_rollup rows."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            self.generation += 1
+        return [stats_to_row(res, dev, start, stats) for (res, dev, start), stats in dirty.items()]
+
+    def restore_dirty(self, rows: list):
+        """Put deltas back after a failed flush so they are retried."""
+        with self._lock:
+            self.generation += 1
+            for row in rows:
+                bucket = int(datetime.fromisoformat(row["bucket_start"]).timestamp())
+                key = (row["resolution_s"], row["device_id"], bucket)
+                stats = self._dirty.get(key)
+                if stats is None:
+                    stats = self._dirty[key] = _new_stats()
+                _merge(stats, row["count"], row_to_stats(row)[1:])
+
+    def dirty_state(self) -> list:
+        """Copy of the unpersisted deltas as JSON-friendly [key, stats] pairs, for handing to another process."""
+        with self._lock:
+            return [[list(key), list(stats)] for key, stats in self._dirty.items()]
+
+    def replace_dirty(self, state: list):
+        """Serve `state` (from dirty_state()) as the pending deltas; only for processes that never flush."""
+        dirty = {tuple(key): stats for key, stats in state}
+        with self._lock:
+            self._dirty = dirty
+
+    def pending(self, resolution_s: int, start_s: float, end_s: float, device_ids=None) -> list:
+        """Unflushed deltas in [start, end) as readings_rollup rows."""
+        with self._lock:
+            items = [
+                (key, list(stats)) for key, stats in self._dirty.items()
+                if key[0] == resolution_s and start_s <= key[2] < end_s
+                and (device_ids is None or key[1] in device_ids)
+            ]
+        return [stats_to_row(res, dev, start, stats) for (res, dev, start), stats in items]
+
+    def pending_start(self, resolution_s: int):
+        """Epoch of the oldest unflushed bucket at this resolution, or None."""
+        with self._lock:
+            return min((key[2] for key in self._dirty if key[0] == resolution_s), default=None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending_buckets": len(self._dirty),
+                "flushed_buckets": self.flushed_buckets,
+            }
+
+
+def coverage_split(start_s: float, end_s: float, bucket_s: int, covered_from_s) -> float:
+    """First `bucket_s` boundary in [start, end] from which rollups (complete from `covered_from_s`) serve a range.
+
+    Buckets before it must come from raw readings; a bucket straddling
+    `covered_from_s` goes to the raw side whole. Returns `end_s` when
+    nothing is covered.
+    """
+    if covered_from_s is None:
+        return end_s
+    split = -(-int(covered_from_s) // bucket_s) * bucket_s
+    return min(max(start_s, split), end_s)
+
+
+def combine(rows: list, bucket_s: int) -> list:
+    """Merge readings_rollup rows (any devices, finer resolution) into `bucket_s` buckets.
+
+    Returns rows oldest first with bucket_start, count and per-metric
+    sum/min/max/avg.
+    """
+    merged = {}
+    for row in rows:
+        start = row["bucket_start"]
+        epoch = int(datetime.fromisoformat(start.replace("Z", "+00:00")).timestamp()) if isinstance(start, str) else int(start)
+        key = epoch // bucket_s * bucket_s
+        stats = merged.get(key)
+        if stats is None:
+            stats = merged[key] = _new_stats()
+        _merge(stats, row.get("count") or 0, row_to_stats(row)[1:])
+    out = []
+    for key in sorted(merged):
+        row = stats_to_row(bucket_s, None, key, merged[key])
+        del row["device_id"]
+        for name in ROLLUP_METRICS:
+            row[f"{name}_avg"] = round(row[f"{name}_sum"] / row["count"], 2) if row["count"] else None
+        out.append(row)
+    return out
+
+
+def coarsen(rows: list, resolution_s: int) -> list:
+    """Merge readings_rollup rows into per-device rows at the coarser `resolution_s`."""
+    merged = {}
+    for row in rows:
+        start = row["bucket_start"]
+        epoch = int(datetime.fromisoformat(start.replace("Z", "+00:00")).timestamp()) if isinstance(start, str) else int(start)
+        key = (row["device_id"], epoch // resolution_s * resolution_s)
+        stats = merged.get(key)
+        if stats is None:
+            stats = merged[key] = _new_stats()
+        _merge(stats, row.get("count") or 0, row_to_stats(row)[1:])
+    return [stats_to_row(resolution_s, dev, start, stats) for (dev, start), stats in sorted(merged.items())]
+
+
+def summarize(rows: list) -> dict:
+    """Merge readings_rollup rows into one summary per device.
+
+    Returns {device_id: {"count", "<metric>_avg", "<metric>_min", "<metric>_max"}}.
+    """
+    merged = {}
+    for row in rows:
+        stats = merged.get(row["device_id"])
+        if stats is None:
+            stats = merged[row["device_id"]] = _new_stats()
+        _merge(stats, row.get("count") or 0, row_to_stats(row)[1:])
+    out = {}
+    for device_id, stats in merged.items():
+        summary = {"count": stats[0]}
+        for m, name in enumerate(ROLLUP_METRICS):
+            summary[f"{name}_avg"] = round(stats[1 + 3 * m] / stats[0], 2) if stats[0] else None
+            summary[f"{name}_min"] = stats[2 + 3 * m]
+            summary[f"{name}_max"] = stats[3 + 3 * m]
+        out[device_id] = summary
+    return out
+
+
+class RollupFlusher:
+    """Background thread persisting rollup deltas every `interval` seconds."""
+
+    def __init__(self, store: RollupStore, flush_fn, interval: float = 10.0):
+        self.store = store
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.failures = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rollup-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        rows = self.store.drain_dirty()
+        if not rows:
+            return
+        try:
+            self.flush_fn(rows)
+            self.store.flushed_buckets += len(rows)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Rollup flush of {len(rows)} buckets failed: {e}")
+            self.store.restore_dirty(rows)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
@@ -0,0 +1,336 @@
+# Durable local spool for readings that could not be inserted
+# Backed by SQLite so spooled rows survive a restart; replayed in bulk once
+# Supabase accepts inserts again. Rows that are rejected on their own while
+# the database is reachable are moved to a dead-letter table instead of
+# blocking the rows behind them.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from logs import LogSampler
+
+logger = logging.getLogger("smartpm")
+replay_log = LogSampler(logger)
+
+
+class Spool:
+    """Append-only write-ahead spool of reading rows with a disk cap.
+
+    When the stored payload bytes exceed `max_bytes`, the oldest rows are
+    evicted first so the newest data is kept.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 50_000_000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letter (id INTEGER PRIMARY KEY, payload TEXT NOT NULL, "
+            "error TEXT, failed_at TEXT NOT NULL)"
+        )
+        rows, size = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM spool"
+        ).fetchone()
+        self._rows = rows
+        self._bytes = size
+        self._dead = self._conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+        self.appended = 0
+        self.evicted = 0
+        if rows:
+            logger.info(f"Spool {path} opened with {rows} pending readings")
+
+    def append(self, rows: list) -> int:
+        """Persist rows; returns the number of rows evicted to honour the cap."""
+        # created_at normally defaults to the insert time in the DB; pin it now so
+        # replayed readings land at (close to) the time they were received.
+        now_iso = datetime.now(timezone.utc).isoformat()
+        encoded = [
+            (json.dumps({"created_at": now_iso, **r}, separators=(",", ":")),) for r in rows
+        ]
+        added = sum(len(e[0]) for e in encoded)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT INTO spool (payload) VALUES (?)", encoded)
+            self._conn.execute("COMMIT")
+            self._rows += len(encoded)
+            self._bytes += added
+            self.appended += len(encoded)
+            evicted = self._enforce_cap()
+        if evicted:
+            logger.error(f"Spool over {self.max_bytes} bytes; evicted {evicted} oldest readings")
+        return evicted
+
+    def peek(self, limit: int) -> list:
+        """Return up to `limit` oldest entries as (id, row) pairs."""
+        with self._lock:
+            cur = self._conn.execute("SELECT id, payload FROM spool ORDER BY id LIMIT ?", (limit,))
+            return [(row_id, json.loads(payload)) for row_id, payload in cur.fetchall()]
+
+    def ack(self, last_id: int):
+        """Remove every entry up to and including `last_id`."""
+        with self._lock:
+            rows, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM spool WHERE id <= ?", (last_id,)
+            ).fetchone()
+            self._conn.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+            self._rows -= rows
+            self._bytes -= size
+
+    def remove(self, row_ids: list):
+        """Remove the given entries, e.g. the ones a partial replay got in."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for row_id in row_ids:
+                found = self._conn.execute("SELECT LENGTH(payload) FROM spool WHERE id = ?", (row_id,)).fetchone()
+                if found is None:
+                    continue
+                self._conn.execute("DELETE FROM spool WHERE id = ?", (row_id,))
+                self._rows -= 1
+                self._bytes -= found[0]
+            self._conn.execute("COMMIT")
+
+    def dead_letter(self, entries: list, error: str):
+        """Move (id, row) entries that can never be inserted out of the spool."""
+        now_iso = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for row_id, _ in entries:
+                found = self._conn.execute("SELECT LENGTH(payload) FROM spool WHERE id = ?", (row_id,)).fetchone()
+                if found is None:
+                    continue
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO dead_letter (id, payload, error, failed_at) "
+                    "SELECT id, payload, ?, ? FROM spool WHERE id = ?",
+                    (error, now_iso, row_id),
+                )
+                self._conn.execute("DELETE FROM spool WHERE id = ?", (row_id,))
+                self._rows -= 1
+                self._bytes -= found[0]
+            self._conn.execute("COMMIT")
+            self._dead = self._conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+    def dead_letters(self, limit: int = 100) -> list:
+        """Oldest dead-lettered entries as (id, row, error) tuples."""
+        with self._lock:
+            cur = self._conn.execute("SELECT id, payload, error FROM dead_letter ORDER BY id LIMIT ?", (limit,))
+            return [(row_id, json.loads(payload), error) for row_id, payload, error in cur.fetchall()]
+
+    def __len__(self):
+        return self._rows
+
+    def stats(self) -> dict:
+        try:
+            file_bytes = sum(
+                os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p)
+            )
+        except OSError:
+            file_bytes = None
+        return {
+            "rows": self._rows,
+            "payload_bytes": self._bytes,
+            "file_bytes": file_bytes,
+            "max_bytes": self.max_bytes,
+            "appended": self.appended,
+            "evicted": self.evicted,
+            "dead_letters": self._dead,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _enforce_cap(self) -> int:
+        # Called with the lock held
+        evicted = 0
+        while self._bytes > self.max_bytes and self._rows > 0:
+            batch = self._conn.execute(
+                "SELECT id, LENGTH(payload) FROM spool ORDER BY id LIMIT 500"
+            ).fetchall()
+            last_id = None
+            for row_id, size in batch:
+                if self._bytes <= self.max_bytes:
+                    break
+                last_id = row_id
+                self._bytes -= size
+                self._rows -= 1
+                evicted += 1
+            if last_id is None:
+                break
+            self._conn.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+        self.evicted += evicted
+        return evicted
+
+
+class SpoolReplayer:
+    """Background thread that drains a Spool through `insert_fn` in bulk.
+
+    A batch that fails is bisected to find the rows that fail on their own.
+    Before such a row is written off the database is probed again
+    (`probe_fn`, which raises when it is unreachable; without one, part of
+    the batch going in or a live insert succeeding meanwhile counts): a row
+    that fails while the database answers is a permanent failure and goes to
+    the spool's dead-letter table, so it cannot block the rows behind it. When
+    the probe fails, or `probe_limit` inserts fail with no sign of the
+    database, it is an outage: only the rows that went in leave the spool,
+    nothing is dead-lettered and the replay backs off exponentially up to
+    `max_delay`. An empty spool is re-checked every `interval` seconds.
+    """
+
+    def __init__(self, spool: Spool, insert_fn, batch_size: int = 500,
+                 interval: float = 5.0, max_delay: float = 60.0, probe_limit: int = 12, probe_fn=None):
+        self.spool = spool
+        self.insert_fn = insert_fn
+        self.probe_fn = probe_fn
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_delay = max_delay
+        self.probe_limit = probe_limit
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._live_ok = 0.0  # monotonic time of the last successful live insert
+        self.replayed = 0
+        self.failures = 0
+        self.dead_lettered = 0
+        self.last_rows_per_sec = None
+        self._replay_seconds = 0.0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="spool-replayer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def notify_healthy(self):
+        """Signal that a live insert just succeeded, so replay can resume now."""
+        self._live_ok = time.monotonic()
+        if len(self.spool):
+            self._wake.set()
+
+    def stats(self) -> dict:
+        return {
+            "replayed": self.replayed,
+            "replay_failures": self.failures,
+            "dead_lettered": self.dead_lettered,
+            "last_replay_rows_per_sec": self.last_rows_per_sec,
+            "avg_replay_rows_per_sec": (
+                round(self.replayed / self._replay_seconds, 1) if self._replay_seconds else None
+            ),
+        }
+
+    def _run(self):
+        delay = self.interval
+        while not self._stop.is_set():
+            if not len(self.spool):
+                delay = self.interval
+                self._sleep(delay)
+                continue
+            entries = self.spool.peek(self.batch_size)
+            started = time.monotonic()
+            try:
+                self.insert_fn([row for _, row in entries])
+                inserted, rejected, done = entries, [], True
+            except Exception as e:
+                self.failures += 1
+                outcome = self._isolate(entries, started, e)
+                if outcome is None:
+                    delay = min(max(delay, 1.0) * 2, self.max_delay)
+                    logger.error(f"Spool replay of {len(entries)} readings failed, retrying in {delay:.0f}s: {e}")
+                    self._sleep(delay)
+                    continue
+                inserted, rejected, done = outcome
+            elapsed = max(time.monotonic() - started, 1e-6)
+            if rejected:
+                for error, group in _by_error(rejected).items():
+                    self.spool.dead_letter(group, error)
+                self.dead_lettered += len(rejected)
+                logger.error(f"Moved {len(rejected)} spooled readings that cannot be inserted to the dead-letter "
+                             f"table: {rejected[0][2]}")
+            if done:
+                self.spool.ack(entries[-1][0])
+            else:
+                # The rest of the batch stays spooled for the next attempt
+                self.spool.remove([row_id for row_id, _ in inserted])
+            self.replayed += len(inserted)
+            self._replay_seconds += elapsed
+            self.last_rows_per_sec = round(len(inserted) / elapsed, 1)
+            if not done:
+                delay = min(max(delay, 1.0) * 2, self.max_delay)
+                logger.error(f"Database stopped answering during spool replay after {len(inserted)} readings; "
+                             f"{len(self.spool)} still spooled, retrying in {delay:.0f}s")
+                self._sleep(delay)
+                continue
+            delay = self.interval
+            replay_log.info("spool_replayed", "Replayed %d spooled readings (%d left)", len(inserted), len(self.spool),
+                            rows=len(inserted))
+
+    def _isolate(self, entries: list, started: float, error: Exception):
+        """Bisect a failed batch: ([(id, row)] inserted, [(id, row, error)] rejected alone, done), or None for an outage.
+
+        `done` is False when the database stopped answering partway; the
+        entries neither inserted nor rejected then stay in the spool.
+        """
+        inserted = []
+        failed_calls = 1
+        rejected = []
+        pending = [(entries, error)]
+        while pending:
+            batch, batch_error = pending.pop()
+            if len(batch) == 1:
+                # The row only failed on its own account if the database still answers
+                if not self._reachable(inserted, started):
+                    return (inserted, rejected, False) if inserted or rejected else None
+                rejected.append((batch[0][0], batch[0][1], repr(batch_error)))
+                continue
+            reachable = inserted or self._live_ok > started
+            if not reachable and failed_calls >= self.probe_limit:
+                return None
+            mid = len(batch) // 2
+            for half in (batch[:mid], batch[mid:]):
+                try:
+                    self.insert_fn([row for _, row in half])
+                    inserted.extend(half)
+                except Exception as e:
+                    failed_calls += 1
+                    pending.append((half, e))
+        return inserted, rejected, True
+
+    def _reachable(self, inserted: list, started: float) -> bool:
+        if self.probe_fn is None:
+            return bool(inserted) or self._live_ok > started
+        try:
+            self.probe_fn()
+            return True
+        except Exception as e:
+            logger.warning(f"Database probe during spool replay failed: {e}")
+            return False
+
+    def _sleep(self, seconds: float):
+        self._wake.wait(seconds)
+        self._wake.clear()
+
+
+def _by_error(rejected: list) -> dict:
+    groups = {}
+    for row_id, row, error in rejected:
+        groups.setdefault(error, []).append((row_id, row))
+    return groups
@@ -0,0 +1,19 @@
+-- Unique key for idempotent readings inserts
+-- Run this in Supabase SQL editor (or via supabase cli) on an existing readings table.
+-- The backend inserts with on_conflict on this key and ignores duplicates, so a
+-- retried batch or a replayed spool entry never stores a reading twice.
+--
+-- created_at is part of the key because the firmware's timestamp is uptime in
+-- milliseconds and repeats after every reboot; created_at is pinned when the
+-- backend receives a reading and is reused by every retry of it.
+
+-- Drop copies left by earlier retries, keeping the first one
+delete from readings a
+using readings b
+where a.device_id = b.device_id
+  and a.timestamp = b.timestamp
+  and a.created_at = b.created_at
+  and a.id > b.id;
+
+create unique index if not exists readings_device_timestamp_created_key
+  on readings(device_id, timestamp, created_at);
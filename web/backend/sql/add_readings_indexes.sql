@@ -0,0 +1,13 @@
+-- Indexes for time-range scans over readings, for every device or a chosen few
+-- Run this in Supabase SQL editor (or via supabase cli) on an existing readings table.
+-- CONCURRENTLY keeps inserts flowing while an index builds but cannot run inside a
+-- transaction block, so run each statement on its own.
+
+-- aggregate_readings, history and export with a device filter: one index range per device
+create index concurrently if not exists readings_device_created_idx on readings (device_id, created_at);
+
+-- The same without a device filter, and the (created_at, id) keyset used to page ranges
+create index concurrently if not exists readings_created_idx on readings (created_at, id);
+
+-- Covered by readings_device_created_idx
+drop index concurrently if exists readings_device_id_idx;
@@ -0,0 +1,107 @@
+-- Multi-metric aggregation of readings for any bucket width
+-- Run this in Supabase SQL editor (or via supabase cli) after create_readings_table.sql,
+-- together with add_readings_indexes.sql. Replaces get_aggregated_pm25
+-- (sql/aggregation_function.sql), which knows five interval names and averages pm25 only.
+-- Needs PostgreSQL 14+ for date_bin.
+--
+-- Buckets are bucket_seconds wide and aligned to the Unix epoch, so any width works,
+-- not just those dividing an hour. One set-based query returns, per bucket, the row
+-- count and for each requested metric (pm1, pm25, pm10) the requested stats
+-- (avg, min, max, count) plus p<q> for each percentile q in 0..100:
+--
+--   select * from aggregate_readings(now() - interval '1 day', now(), 900,
+--                                    array['A1'], array['pm25', 'pm10'],
+--                                    array['avg', 'max'], array[50, 90]);
+--   bucket_time | sample_count | aggregates
+--               |              | {"pm25": {"avg": 12.4, "max": 31, "p50": 11, "p90": 22.6}, "pm10": {...}}
+
+-- The SQL text aggregate_readings executes, with $1 start, $2 end, $3 bucket_seconds
+-- and $4 device_ids. Separate so the query plan can be inspected (see tests/test_query_plan.py).
+create or replace function aggregate_readings_query(
+  metrics text[],
+  stats text[],
+  percentiles double precision[],
+  by_device boolean
+)
+returns text
+language plpgsql
+immutable
+as $$
+declare
+  metric text;
+  stat text;
+  q double precision;
+  fields text;
+  per_metric text := '';
+begin
+  if coalesce(cardinality(metrics), 0) = 0 then
+    raise exception 'at least one metric is required' using errcode = '22023';
+  end if;
+  foreach metric in array metrics loop
+    if metric not in ('pm1', 'pm25', 'pm10') then
+      raise exception 'unknown metric: %', metric using errcode = '22023';
+    end if;
+    fields := '';
+    foreach stat in array coalesce(stats, '{}') loop
+      fields := fields || format(', %L, ', stat) || case stat
+        when 'avg' then format('round(avg(r.%I)::numeric, 2)', metric)
+        when 'min' then format('min(r.%I)', metric)
+        when 'max' then format('max(r.%I)', metric)
+        when 'count' then format('count(r.%I)', metric)
+      end;
+      if fields is null then
+        raise exception 'unknown stat: %', stat using errcode = '22023';
+      end if;
+    end loop;
+    foreach q in array coalesce(percentiles, '{}') loop
+      if q is null or q < 0 or q > 100 then
+        raise exception 'percentiles must be between 0 and 100' using errcode = '22023';
+      end if;
+      fields := fields || format(
+        ', %L, round((percentile_cont(%s) within group (order by r.%I))::numeric, 2)',
+        'p' || trim_scale(q::numeric), q / 100, metric);
+    end loop;
+    per_metric := per_metric || format(', %L, jsonb_build_object(%s)', metric, substr(fields, 3));
+  end loop;
+
+  return format(
+    'select date_bin(make_interval(secs => $3), r.created_at, timestamptz ''epoch'') as bucket_time, '
+    'count(*) as sample_count, jsonb_build_object(%s) as aggregates '
+    'from public.readings r '
+    'where r.created_at >= $1 and r.created_at < $2 and %s '
+    'group by 1 order by 1',
+    substr(per_metric, 3),
+    case when by_device then 'r.device_id = any($4)' else 'r.device_id <> ''INTEGRATION_TEST_001''' end
+  );
+end;
+$$;
+
+create or replace function aggregate_readings(
+  start_time timestamptz,
+  end_time timestamptz,
+  bucket_seconds integer,
+  device_ids text[] default null,
+  metrics text[] default array['pm25'],
+  stats text[] default array['avg'],
+  percentiles double precision[] default '{}'
+)
+returns table (
+  bucket_time timestamptz,
+  sample_count bigint,
+  aggregates jsonb
+)
+language plpgsql
+stable
+as $$
+begin
+  if bucket_seconds is null or bucket_seconds < 1 then
+    raise exception 'bucket_seconds must be at least 1' using errcode = '22023';
+  end if;
+  return query execute aggregate_readings_query(metrics, stats, percentiles, device_ids is not null)
+    using start_time, end_time, bucket_seconds, device_ids;
+end;
+$$;
+
+grant execute on function aggregate_readings_query(text[], text[], double precision[], boolean) to authenticated, anon;
+grant execute on function aggregate_readings(timestamptz, timestamptz, integer, text[], text[], text[], double precision[])
+  to authenticated, anon;
@@ -0,0 +1,105 @@
+-- Rollup table for pre-aggregated readings (10s, 1m, 10m and 1h buckets)
+-- Run this in Supabase SQL editor (or via supabase cli) after create_readings_table.sql
+
+create table if not exists readings_rollup (
+  resolution_s integer not null,
+  device_id text not null,
+  bucket_start timestamp with time zone not null,
+  count bigint not null default 0,
+  pm1_sum double precision not null default 0,
+  pm1_min double precision,
+  pm1_max double precision,
+  pm25_sum double precision not null default 0,
+  pm25_min double precision,
+  pm25_max double precision,
+  pm10_sum double precision not null default 0,
+  pm10_min double precision,
+  pm10_max double precision,
+  primary key (resolution_s, device_id, bucket_start)
+);
+
+-- Range scans across all devices for one resolution
+create index if not exists readings_rollup_resolution_bucket_idx on readings_rollup(resolution_s, bucket_start);
+
+-- Merge deltas computed by the backend at ingest time. Deltas are additive, so
+-- several flushes (or several processes) touching the same bucket combine correctly.
+create or replace function merge_readings_rollup(rows jsonb)
+returns void as $$
+begin
+  insert into readings_rollup as r (
+    resolution_s, device_id, bucket_start, count,
+    pm1_sum, pm1_min, pm1_max,
+    pm25_sum, pm25_min, pm25_max,
+    pm10_sum, pm10_min, pm10_max
+  )
+  select
+    x.resolution_s, x.device_id, x.bucket_start, x.count,
+    x.pm1_sum, x.pm1_min, x.pm1_max,
+    x.pm25_sum, x.pm25_min, x.pm25_max,
+    x.pm10_sum, x.pm10_min, x.pm10_max
+  from jsonb_to_recordset(rows) as x(
+    resolution_s integer, device_id text, bucket_start timestamptz, count bigint,
+    pm1_sum double precision, pm1_min double precision, pm1_max double precision,
+    pm25_sum double precision, pm25_min double precision, pm25_max double precision,
+    pm10_sum double precision, pm10_min double precision, pm10_max double precision
+  )
+  on conflict (resolution_s, device_id, bucket_start) do update set
+    count = r.count + excluded.count,
+    pm1_sum = r.pm1_sum + excluded.pm1_sum,
+    pm1_min = least(r.pm1_min, excluded.pm1_min),
+    pm1_max = greatest(r.pm1_max, excluded.pm1_max),
+    pm25_sum = r.pm25_sum + excluded.pm25_sum,
+    pm25_min = least(r.pm25_min, excluded.pm25_min),
+    pm25_max = greatest(r.pm25_max, excluded.pm25_max),
+    pm10_sum = r.pm10_sum + excluded.pm10_sum,
+    pm10_min = least(r.pm10_min, excluded.pm10_min),
+    pm10_max = greatest(r.pm10_max, excluded.pm10_max);
+end;
+$$ language plpgsql;
+
+-- Recompute one resolution over [start_time, end_time) from raw readings.
+-- The range is widened to whole buckets so partially covered buckets are not halved.
+create or replace function rebuild_readings_rollup(
+  p_resolution_s integer,
+  start_time timestamptz,
+  end_time timestamptz
+)
+returns bigint as $$
+declare
+  aligned_start timestamptz := to_timestamp(floor(extract(epoch from start_time) / p_resolution_s) * p_resolution_s);
+  aligned_end timestamptz := to_timestamp(ceil(extract(epoch from end_time) / p_resolution_s) * p_resolution_s);
+  rebuilt bigint;
+begin
+  delete from readings_rollup
+  where resolution_s = p_resolution_s
+    and bucket_start >= aligned_start
+    and bucket_start < aligned_end;
+
+  insert into readings_rollup (
+    resolution_s, device_id, bucket_start, count,
+    pm1_sum, pm1_min, pm1_max,
+    pm25_sum, pm25_min, pm25_max,
+    pm10_sum, pm10_min, pm10_max
+  )
+  select
+    p_resolution_s,
+    r.device_id,
+    to_timestamp(floor(extract(epoch from r.created_at) / p_resolution_s) * p_resolution_s) as bucket_start,
+    count(*),
+    sum(r.pm1), min(r.pm1), max(r.pm1),
+    sum(r.pm25), min(r.pm25), max(r.pm25),
+    sum(r.pm10), min(r.pm10), max(r.pm10)
+  from public.readings r
+  where r.created_at >= aligned_start
+    and r.created_at < aligned_end
+    and r.device_id != 'INTEGRATION_TEST_001'
+  group by r.device_id, 3;
+
+  get diagnostics rebuilt = row_count;
+  return rebuilt;
+end;
+$$ language plpgsql;
+
+-- Writes only come from the backend (service_role key); dashboards read the table directly if needed
+grant execute on function merge_readings_rollup(jsonb) to service_role;
+grant execute on function rebuild_readings_rollup(integer, timestamptz, timestamptz) to service_role;
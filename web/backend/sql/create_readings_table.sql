@@ -16,5 +16,9 @@ create table readings (
 );
 
 -- Create indexes for better query performance
-create index readings_device_id_idx on readings(device_id);
+create index readings_device_created_idx on readings(device_id, created_at);
+create index readings_created_idx on readings(created_at, id);
 create index readings_timestamp_idx on readings(timestamp);
+
+-- Unique key for idempotent inserts (see add_readings_dedup.sql)
+create unique index readings_device_timestamp_created_key on readings(device_id, timestamp, created_at);
@@ -0,0 +1,611 @@
+# Storage backends for SmartPM2.5 Backend
+# Every readings/readings_rollup operation the API and ingest path need,
+# behind one interface: Supabase (remote Postgres) or an embedded SQLite file.
+# Methods are synchronous; request handlers call them through db.QueryRunner.
+
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger("smartpm")
+
+TEST_DEVICE_ID = "INTEGRATION_TEST_001"
+
+READING_COLUMNS = ("id", "device_id", "pm1", "pm25", "pm10", "aqi", "timestamp", "wifi_rssi", "ip_address", "created_at")
+
+ROLLUP_COLUMNS = (
+    "resolution_s", "device_id", "bucket_start", "count",
+    "pm1_sum", "pm1_min", "pm1_max",
+    "pm25_sum", "pm25_min", "pm25_max",
+    "pm10_sum", "pm10_min", "pm10_max",
+)
+
+# Bucket names of the aggregated timeframes, in seconds
+BUCKET_INTERVALS = {
+    "10 seconds": 10,
+    "1 minute": 60,
+    "2 minutes": 120,
+    "10 minutes": 600,
+    "30 minutes": 1800,
+    "1 hour": 3600,
+    "6 hours": 21600,
+    "1 day": 86400,
+}
+
+
+# What aggregate() can report per metric, besides p<q> percentiles
+AGGREGATE_METRICS = ("pm1", "pm25", "pm10")
+AGGREGATE_STATS = ("avg", "min", "max", "count")
+
+
+def aggregate_spec(bucket_seconds: int, metrics, stats, percentiles) -> tuple:
+    """Validated (metrics, stats, percentiles) for aggregate(); ValueError names what is wrong."""
+    if int(bucket_seconds) < 1:
+        raise ValueError("bucket_seconds must be at least 1")
+    metrics = tuple(dict.fromkeys(metrics))
+    stats = tuple(dict.fromkeys(stats))
+    percentiles = tuple(sorted(set(float(q) for q in percentiles)))
+    unknown = [m for m in metrics if m not in AGGREGATE_METRICS] + [s for s in stats if s not in AGGREGATE_STATS]
+    if unknown:
+        raise ValueError(f"Unknown metrics or stats: {', '.join(unknown)}")
+    if not metrics:
+        raise ValueError("At least one metric is required")
+    if any(not 0 <= q <= 100 for q in percentiles):
+        raise ValueError("Percentiles must be between 0 and 100")
+    return metrics, stats, percentiles
+
+
+def _column_list(columns: str) -> list:
+    if columns.strip() == "*":
+        return list(READING_COLUMNS)
+    names = [c.strip() for c in columns.split(",") if c.strip()]
+    unknown = [c for c in names if c not in READING_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown readings columns: {', '.join(unknown)}")
+    return names
+
+
+class ReadingStore:
+    """Operations on readings and readings_rollup used by the backend.
+
+    Timestamps are ISO-8601 strings. Row lists are plain dicts shaped like the
+    Supabase tables. Readings from the integration test device are excluded
+    unless `include_test` is set. `device_ids`, where accepted, restricts the
+    result to those devices (None means every device).
+    """
+
+    name = "base"
+
+    def insert(self, rows: list):
+        """Insert readings; a row whose (device_id, timestamp, created_at) is already stored is skipped."""
+        raise NotImplementedError
+
+    def latest(self, limit: int, columns: str = "*", include_test: bool = False, device_ids=None) -> list:
+        """Newest readings first."""
+        raise NotImplementedError
+
+    def range(self, columns: str, start_iso: str, end_iso: str, limit: int,
+              newest_first: bool = False, after: dict = None, device_ids=None) -> list:
+        """Readings with start <= created_at <= end, ordered by (created_at, id).
+
+        `after` is the last row of the previous page (ascending order only);
+        the page resumes strictly after it. `columns` must then include
+        created_at and id.
+        """
+        raise NotImplementedError
+
+    def aggregate(self, start_iso: str, end_iso: str, bucket_seconds: int, device_ids=None,
+                  metrics=("pm25",), stats=("avg",), percentiles=()) -> list:
+        """Statistics per `bucket_seconds`-wide, epoch-aligned bucket over [start, end), in one query.
+
+        For each of `metrics` (see AGGREGATE_METRICS) the requested `stats`
+        (AGGREGATE_STATS) plus `p<q>` for each of `percentiles` (0-100,
+        interpolated like percentile_cont); averages and percentiles are
+        rounded to 2 decimals. Only buckets holding readings are returned,
+        oldest first: {"bucket_time": iso, "count": rows, "pm25": {"avg": ...}}.
+        Like the aggregate_readings RPC (sql/aggregate_readings.sql).
+        """
+        raise NotImplementedError
+
+    def rollup_range(self, resolution_s: int, start_iso: str, end_iso: str, limit: int = 10000, device_ids=None) -> list:
+        raise NotImplementedError
+
+    def rollup_start(self, resolution_s: int):
+        """bucket_start of the oldest stored bucket at this resolution, or None when there is none.
+
+        Rollups are complete from the following bucket on (this one may have
+        started mid-interval): the flusher writes every reading ingested
+        since, and backfills and rebuilds extend it backwards.
+        """
+        raise NotImplementedError
+
+    def merge_rollups(self, rows: list):
+        """Add rollup deltas into readings_rollup."""
+        raise NotImplementedError
+
+    def rebuild_rollups(self, resolution_s: int, start_iso: str, end_iso: str) -> int:
+        """Recompute one resolution from raw readings; returns the number of buckets written."""
+        raise NotImplementedError
+
+    def count(self, start_iso: str, end_iso: str) -> int:
+        """Number of readings with start <= created_at < end."""
+        raise NotImplementedError
+
+    def delete_range(self, start_iso: str, end_iso: str) -> int:
+        """Delete readings (test device included) with start <= created_at < end; returns rows deleted."""
+        raise NotImplementedError
+
+    def delete_rollups(self, resolution_s: int, start_iso: str, end_iso: str) -> int:
+        """Delete one resolution's buckets with start <= bucket_start < end; returns buckets deleted."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SupabaseStore(ReadingStore):
+    """Readings in Supabase, through the synchronous supabase-py client."""
+
+    name = "supabase"
+
+    def __init__(self, url: str, key: str):
+        from supabase import create_client
+        self.url = url
+        self.client = create_client(url, key)
+
+    def _readings(self, columns: str, include_test: bool = False, device_ids=None):
+        query = self.client.table("readings").select(columns)
+        if device_ids:
+            query = query.in_("device_id", sorted(device_ids))
+        elif not include_test:
+            query = query.neq("device_id", TEST_DEVICE_ID)
+        return query
+
+    def insert(self, rows: list):
+        # Needs the unique index from sql/add_readings_dedup.sql
+        self.client.table("readings").upsert(
+            rows, on_conflict="device_id,timestamp,created_at", ignore_duplicates=True, returning="minimal"
+        ).execute()
+
+    def latest(self, limit: int, columns: str = "*", include_test: bool = False, device_ids=None) -> list:
+        return self._readings(columns, include_test, device_ids).order("created_at", desc=True).limit(limit).execute().data or []
+
+    def range(self, columns: str, start_iso: str, end_iso: str, limit: int,
+              newest_first: bool = False, after: dict = None, device_ids=None) -> list:
+        if after is None:
+            query = self._readings(columns, device_ids=device_ids).gte("created_at", start_iso).lte("created_at", end_iso)
+            return query.order("created_at,id" if not newest_first else "created_at", desc=newest_first).limit(limit).execute().data or []
+
+        # (created_at, id) > (ts, id) spelled out, as postgrest has no row comparison; the
+        # gte bounds the index scan, and values are quoted since timestamps hold ':' and '+'
+        ts, last_id = after["created_at"], int(after["id"])
+        query = self._readings(columns, device_ids=device_ids).gte("created_at", ts).lte("created_at", end_iso)
+        # or=(...) added by hand: the pinned postgrest-py has no or_()
+        query.params = query.params.add("or", f'(created_at.gt."{ts}",and(created_at.eq."{ts}",id.gt.{last_id}))')
+        return query.order("created_at,id").limit(limit).execute().data or []
+
+    def aggregate(self, start_iso: str, end_iso: str, bucket_seconds: int, device_ids=None,
+                  metrics=("pm25",), stats=("avg",), percentiles=()) -> list:
+        metrics, stats, percentiles = aggregate_spec(bucket_seconds, metrics, stats, percentiles)
+        rows = self.client.rpc("aggregate_readings", {
+            "start_time": start_iso,
+            "end_time": end_iso,
+            "bucket_seconds": int(bucket_seconds),
+            "device_ids": sorted(device_ids) if device_ids else None,
+            "metrics": list(metrics),
+            "stats": list(stats),
+            "percentiles": list(percentiles),
+        }).execute().data or []
+        return [{"bucket_time": r["bucket_time"], "count": r["sample_count"], **r["aggregates"]} for r in rows]
+
+    def rollup_range(self, resolution_s: int, start_iso: str, end_iso: str, limit: int = 10000, device_ids=None) -> list:
+        query = self.client.table("readings_rollup").select("*").eq("resolution_s", resolution_s)
+        if device_ids:
+            query = query.in_("device_id", sorted(device_ids))
+        return (query.gte("bucket_start", start_iso).lte("bucket_start", end_iso)
+                .order("bucket_start").limit(limit).execute().data or [])
+
+    def rollup_start(self, resolution_s: int):
+        rows = (self.client.table("readings_rollup").select("bucket_start").eq("resolution_s", resolution_s)
+                .order("bucket_start").limit(1).execute().data or [])
+        return rows[0]["bucket_start"] if rows else None
+
+    def merge_rollups(self, rows: list):
+        self.client.rpc("merge_readings_rollup", {"rows": rows}).execute()
+
+    def rebuild_rollups(self, resolution_s: int, start_iso: str, end_iso: str) -> int:
+        return self.client.rpc("rebuild_readings_rollup", {
+            "p_resolution_s": resolution_s,
+            "start_time": start_iso,
+            "end_time": end_iso,
+        }).execute().data
+
+    def count(self, start_iso: str, end_iso: str) -> int:
+        query = self.client.table("readings").select("id", count="exact").neq("device_id", TEST_DEVICE_ID)
+        return query.gte("created_at", start_iso).lt("created_at", end_iso).limit(1).execute().count or 0
+
+    def delete_range(self, start_iso: str, end_iso: str) -> int:
+        query = self.client.table("readings").delete(count="exact", returning="minimal")
+        return query.gte("created_at", start_iso).lt("created_at", end_iso).execute().count or 0
+
+    def delete_rollups(self, resolution_s: int, start_iso: str, end_iso: str) -> int:
+        query = self.client.table("readings_rollup").delete(count="exact", returning="minimal").eq("resolution_s", resolution_s)
+        return query.gte("bucket_start", start_iso).lt("bucket_start", end_iso).execute().count or 0
+
+
+def _to_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def canonical_iso(value) -> str:
+    """Fixed-width UTC ISO string, so text comparison in SQLite orders by time."""
+    return _to_datetime(value).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+
+def _month(dt: datetime) -> int:
+    return dt.year * 12 + dt.month - 1
+
+
+def _partition_name(month: int) -> str:
+    return f"readings_{month // 12:04d}_{month % 12 + 1:02d}"
+
+
+def _add_dedup_key(conn, table: str):
+    """Unique (device_id, timestamp, created_at) on a partition, dropping copies stored before it existed."""
+    index = f"{table}_dedup_key"
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index,)).fetchone():
+        return
+    conn.execute(
+        f"DELETE FROM {table} WHERE id NOT IN "
+        f"(SELECT MIN(id) FROM {table} GROUP BY device_id, timestamp, created_at)"
+    )
+    conn.execute(f"CREATE UNIQUE INDEX {index} ON {table}(device_id, timestamp, created_at)")
+
+
+def _month_start(month: int) -> datetime:
+    return datetime(month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def _device_filter(device_ids, include_test: bool = False) -> tuple:
+    """WHERE fragment and params restricting rows to `device_ids`."""
+    if device_ids:
+        ids = sorted(device_ids)
+        return f"device_id IN ({', '.join('?' * len(ids))})", tuple(ids)
+    if include_test:
+        return "1", ()
+    return "device_id != ?", (TEST_DEVICE_ID,)
+
+
+# Epoch seconds of a canonical created_at string, inside SQL
+_EPOCH_SQL = "CAST(strftime('%s', substr(created_at, 1, 19)) AS INTEGER)"
+
+# aggregate() statistics as SQLite expressions over one metric column
+_SQLITE_STATS = {"avg": "ROUND(AVG({0}), 2)", "min": "MIN({0})", "max": "MAX({0})", "count": "COUNT({0})"}
+
+
+def _aggregate_sql(union: str, metrics, stats) -> str:
+    """GROUP BY over the partition union (epoch plus metric columns); :w is the bucket width."""
+    exprs = "".join(f", {_SQLITE_STATS[stat].format(metric)}" for metric in metrics for stat in stats)
+    return f"SELECT epoch / :w * :w AS bucket, COUNT(*){exprs} FROM ({union}) GROUP BY bucket ORDER BY bucket"
+
+
+class SQLiteStore(ReadingStore):
+    """Readings in a local SQLite file, partitioned into one table per month.
+
+    Each partition (`readings_YYYY_MM`) is indexed on (device_id, created_at)
+    and on (created_at, id), so range scans only touch the months they cover
+    and old months can be dropped as whole tables. Ids come from a shared
+    counter so they stay unique across partitions. Reads use one connection
+    per thread (WAL mode lets them run alongside the writer).
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS readings_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO readings_meta VALUES ('next_id', 1)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS readings_rollup ("
+            "resolution_s INTEGER NOT NULL, device_id TEXT NOT NULL, bucket_start TEXT NOT NULL, "
+            "count INTEGER NOT NULL DEFAULT 0, "
+            "pm1_sum REAL NOT NULL DEFAULT 0, pm1_min REAL, pm1_max REAL, "
+            "pm25_sum REAL NOT NULL DEFAULT 0, pm25_min REAL, pm25_max REAL, "
+            "pm10_sum REAL NOT NULL DEFAULT 0, pm10_min REAL, pm10_max REAL, "
+            "PRIMARY KEY (resolution_s, device_id, bucket_start))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS readings_rollup_resolution_bucket_idx ON readings_rollup(resolution_s, bucket_start)")
+        # Replaced rather than mutated so reader threads can iterate it without a lock
+        self._partitions = frozenset(
+            int(name[9:13]) * 12 + int(name[14:16]) - 1
+            for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'readings_[0-9][0-9][0-9][0-9]_[0-9][0-9]'")
+        )
+        # Partitions created before the dedup key existed get it on first open
+        for month in self._partitions:
+            _add_dedup_key(conn, _partition_name(month))
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            self._connections.append(conn)
+        return conn
+
+    def _ensure_partition(self, conn, month: int):
+        if month in self._partitions:
+            return
+        table = _partition_name(month)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "id INTEGER PRIMARY KEY, device_id TEXT NOT NULL, "
+            "pm1 INTEGER, pm25 INTEGER, pm10 INTEGER, aqi INTEGER, "
+            "timestamp INTEGER, wifi_rssi INTEGER, ip_address TEXT, created_at TEXT NOT NULL)"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_device_created_idx ON {table}(device_id, created_at)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_created_idx ON {table}(created_at, id)")
+        _add_dedup_key(conn, table)
+        self._partitions = self._partitions | {month}
+
+    def _partitions_between(self, start_iso, end_iso, newest_first=False) -> list:
+        lo = _month(_to_datetime(start_iso)) if start_iso else None
+        hi = _month(_to_datetime(end_iso)) if end_iso else None
+        months = sorted(
+            (m for m in self._partitions if (lo is None or m >= lo) and (hi is None or m <= hi)),
+            reverse=newest_first,
+        )
+        return [_partition_name(m) for m in months]
+
+    def insert(self, rows: list):
+        if not rows:
+            return
+        now_iso = datetime.now(timezone.utc).isoformat()
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                next_id = conn.execute("SELECT value FROM readings_meta WHERE key = 'next_id'").fetchone()[0]
+                by_table = {}
+                for row in rows:
+                    created = canonical_iso(row.get("created_at") or now_iso)
+                    month = _month(_to_datetime(created))
+                    self._ensure_partition(conn, month)
+                    values = [next_id] + [row.get(c) for c in READING_COLUMNS[1:-1]] + [created]
+                    by_table.setdefault(_partition_name(month), []).append(values)
+                    next_id += 1
+                placeholders = ", ".join("?" * len(READING_COLUMNS))
+                for table, values in by_table.items():
+                    conn.executemany(f"INSERT OR IGNORE INTO {table} ({', '.join(READING_COLUMNS)}) VALUES ({placeholders})", values)
+                conn.execute("UPDATE readings_meta SET value = ? WHERE key = 'next_id'", (next_id,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _select(self, tables, names, where, params, order, limit) -> list:
+        conn = self._conn()
+        out = []
+        for table in tables:
+            cur = conn.execute(
+                f"SELECT {', '.join(names)} FROM {table} WHERE {where} ORDER BY {order} LIMIT ?",
+                (*params, limit - len(out)),
+            )
+            out.extend(dict(r) for r in cur.fetchall())
+            if len(out) >= limit:
+                break
+        return out
+
+    def latest(self, limit: int, columns: str = "*", include_test: bool = False, device_ids=None) -> list:
+        where, params = _device_filter(device_ids, include_test)
+        return self._select(self._partitions_between(None, None, newest_first=True), _column_list(columns),
+                            where, params, "created_at DESC, id DESC", limit)
+
+    def range(self, columns: str, start_iso: str, end_iso: str, limit: int,
+              newest_first: bool = False, after: dict = None, device_ids=None) -> list:
+        names = _column_list(columns)
+        where, params = _device_filter(device_ids)
+        where += " AND created_at >= ? AND created_at <= ?"
+        params = [*params, canonical_iso(start_iso), canonical_iso(end_iso)]
+        if after is not None:
+            where += " AND (created_at > ? OR (created_at = ? AND id > ?))"
+            after_iso = canonical_iso(after["created_at"])
+            params += [after_iso, after_iso, after["id"]]
+            start_iso = after_iso
+        order = "created_at DESC, id DESC" if newest_first else "created_at, id"
+        return self._select(self._partitions_between(start_iso, end_iso, newest_first), names, where, params, order, limit)
+
+    def _union(self, start_iso, end_iso, columns: str, device_ids=None) -> tuple:
+        """UNION ALL over the partitions in [start, end), with named params for the device filter."""
+        tables = self._partitions_between(start_iso, end_iso)
+        if not tables:
+            return None, {}
+        if device_ids:
+            params = {f"d{i}": d for i, d in enumerate(sorted(device_ids))}
+            devices = f"device_id IN ({', '.join(':' + k for k in params)})"
+        else:
+            params = {"test_device": TEST_DEVICE_ID}
+            devices = "device_id != :test_device"
+        sql = " UNION ALL ".join(
+            f"SELECT {columns} FROM {t} WHERE {devices} AND created_at >= :start AND created_at < :end"
+            for t in tables
+        )
+        return sql, params
+
+    def aggregate(self, start_iso: str, end_iso: str, bucket_seconds: int, device_ids=None,
+                  metrics=("pm25",), stats=("avg",), percentiles=()) -> list:
+        metrics, stats, percentiles = aggregate_spec(bucket_seconds, metrics, stats, percentiles)
+        union, params = self._union(start_iso, end_iso, f"{_EPOCH_SQL} AS epoch, {', '.join(metrics)}", device_ids)
+        if union is None:
+            return []
+        params = {**params, "start": canonical_iso(start_iso), "end": canonical_iso(end_iso), "w": int(bucket_seconds)}
+        cur = self._conn().execute(_aggregate_sql(union, metrics, stats), params)
+        buckets, result = [], []
+        for bucket, count, *values in cur.fetchall():
+            row = {"bucket_time": datetime.fromtimestamp(bucket, timezone.utc).isoformat(), "count": count}
+            for i, metric in enumerate(metrics):
+                row[metric] = dict(zip(stats, values[i * len(stats):(i + 1) * len(stats)]))
+            buckets.append(bucket)
+            result.append(row)
+        if percentiles and result:
+            # SQLite has no percentile function: fetch the values and sort them per bucket in NumPy
+            import numpy as np
+            from aggregation import aggregate
+            width = int(bucket_seconds)
+            n_buckets = (buckets[-1] - buckets[0]) // width + 1
+            values = np.array(self._conn().execute(f"SELECT epoch, {', '.join(metrics)} FROM ({union})", params).fetchall(),
+                              dtype=float)
+            by_bucket = aggregate(values[:, 0].astype(np.int64) * 1_000_000,
+                                  {m: values[:, i + 1] for i, m in enumerate(metrics)},
+                                  buckets[0] * 1_000_000, (buckets[-1] + width) * 1_000_000 - 1, width * 1_000_000,
+                                  n_buckets, percentiles=percentiles)
+            for bucket, row in zip(buckets, result):
+                i = (bucket - buckets[0]) // width
+                for metric in metrics:
+                    for q in percentiles:
+                        v = by_bucket[metric][f"p{q:g}"][i]
+                        row[metric][f"p{q:g}"] = None if np.isnan(v) else round(float(v), 2)
+        return result
+
+    def rollup_range(self, resolution_s: int, start_iso: str, end_iso: str, limit: int = 10000, device_ids=None) -> list:
+        where, params = _device_filter(device_ids, include_test=True)
+        cur = self._conn().execute(
+            f"SELECT * FROM readings_rollup WHERE resolution_s = ? AND bucket_start >= ? AND bucket_start <= ? AND {where} "
+            "ORDER BY bucket_start LIMIT ?",
+            (resolution_s, canonical_iso(start_iso), canonical_iso(end_iso), *params, limit),
+        )
+        return [dict(r) for r in cur.fetchall()]
+
+    def rollup_start(self, resolution_s: int):
+        (oldest,) = self._conn().execute(
+            "SELECT MIN(bucket_start) FROM readings_rollup WHERE resolution_s = ?", (resolution_s,)
+        ).fetchone()
+        return oldest
+
+    def merge_rollups(self, rows: list):
+        if not rows:
+            return
+        values = [
+            [r["resolution_s"], r["device_id"], canonical_iso(r["bucket_start"])] + [r.get(c) for c in ROLLUP_COLUMNS[3:]]
+            for r in rows
+        ]
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    f"INSERT INTO readings_rollup ({', '.join(ROLLUP_COLUMNS)}) VALUES ({', '.join('?' * len(ROLLUP_COLUMNS))}) "
+                    "ON CONFLICT (resolution_s, device_id, bucket_start) DO UPDATE SET "
+                    "count = count + excluded.count, "
+                    + ", ".join(
+                        f"{m}_sum = {m}_sum + excluded.{m}_sum, "
+                        f"{m}_min = min(coalesce({m}_min, excluded.{m}_min), coalesce(excluded.{m}_min, {m}_min)), "
+                        f"{m}_max = max(coalesce({m}_max, excluded.{m}_max), coalesce(excluded.{m}_max, {m}_max))"
+                        for m in ("pm1", "pm25", "pm10")
+                    ),
+                    values,
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def rebuild_rollups(self, resolution_s: int, start_iso: str, end_iso: str) -> int:
+        # Widen to whole buckets, as rebuild_readings_rollup does
+        start_s = int(_to_datetime(start_iso).timestamp()) // resolution_s * resolution_s
+        end_s = -(-int(_to_datetime(end_iso).timestamp()) // resolution_s) * resolution_s
+        start = canonical_iso(datetime.fromtimestamp(start_s, timezone.utc))
+        end = canonical_iso(datetime.fromtimestamp(end_s, timezone.utc))
+        union, params = self._union(start, end, f"device_id, {_EPOCH_SQL} AS epoch, pm1, pm25, pm10")
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "DELETE FROM readings_rollup WHERE resolution_s = ? AND bucket_start >= ? AND bucket_start < ?",
+                    (resolution_s, start, end),
+                )
+                rebuilt = 0
+                if union is not None:
+                    rows = conn.execute(
+                        f"SELECT device_id, epoch / :w * :w AS bucket, count(*), "
+                        "sum(pm1), min(pm1), max(pm1), sum(pm25), min(pm25), max(pm25), sum(pm10), min(pm10), max(pm10) "
+                        f"FROM ({union}) GROUP BY device_id, bucket",
+                        {**params, "start": start, "end": end, "w": resolution_s},
+                    ).fetchall()
+                    conn.executemany(
+                        f"INSERT INTO readings_rollup ({', '.join(ROLLUP_COLUMNS)}) VALUES ({', '.join('?' * len(ROLLUP_COLUMNS))})",
+                        [
+                            (resolution_s, r[0], canonical_iso(datetime.fromtimestamp(r[1], timezone.utc)), *r[2:])
+                            for r in rows
+                        ],
+                    )
+                    rebuilt = len(rows)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return rebuilt
+
+    def count(self, start_iso: str, end_iso: str) -> int:
+        union, params = self._union(start_iso, end_iso, "1")
+        if union is None:
+            return 0
+        cur = self._conn().execute(
+            f"SELECT count(*) FROM ({union})",
+            {**params, "start": canonical_iso(start_iso), "end": canonical_iso(end_iso)},
+        )
+        return cur.fetchone()[0]
+
+    def delete_range(self, start_iso: str, end_iso: str) -> int:
+        start, end = canonical_iso(start_iso), canonical_iso(end_iso)
+        deleted = 0
+        # One short autocommit statement per month, under the same lock as inserts
+        with self._write_lock:
+            conn = self._conn()
+            lo, hi = _month(_to_datetime(start)), _month(_to_datetime(end))
+            for month in sorted(m for m in self._partitions if lo <= m <= hi):
+                table = _partition_name(month)
+                deleted += conn.execute(f"DELETE FROM {table} WHERE created_at >= ? AND created_at < ?", (start, end)).rowcount
+                # A past month left empty is dropped as a whole table
+                next_month = canonical_iso(_month_start(month + 1))
+                if next_month <= end and conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None:
+                    conn.execute(f"DROP TABLE {table}")
+                    self._partitions = self._partitions - {month}
+        return deleted
+
+    def delete_rollups(self, resolution_s: int, start_iso: str, end_iso: str) -> int:
+        with self._write_lock:
+            return self._conn().execute(
+                "DELETE FROM readings_rollup WHERE resolution_s = ? AND bucket_start >= ? AND bucket_start < ?",
+                (resolution_s, canonical_iso(start_iso), canonical_iso(end_iso)),
+            ).rowcount
+
+    def close(self):
+        for conn in self._connections:
+            conn.close()
+        self._connections.clear()
+        self._local = threading.local()
+
+
+def open_store(backend: str, supabase_url: str = None, supabase_key: str = None, path: str = None) -> ReadingStore:
+    """Build the store selected by STORAGE_BACKEND."""
+    if backend == "sqlite":
+        return SQLiteStore(path)
+    if backend == "supabase":
+        return SupabaseStore(supabase_url, supabase_key)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -0,0 +1,88 @@
+# Live reading fan-out for SmartPM2.5 Backend
+# Readings decoded in on_message are pushed to every connected stream client.
+
+import asyncio
+import threading
+
+
+class Subscription:
+    """One connected client: a device filter and a bounded queue.
+
+    When the client falls behind and its queue is full, the oldest queued
+    reading is discarded so the client always converges on the newest data.
+    """
+
+    def __init__(self, device_ids=None, queue_size: int = 100):
+        self.device_ids = set(device_ids) if device_ids else None
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def wants(self, row: dict) -> bool:
+        return self.device_ids is None or row.get("device_id") in self.device_ids
+
+    def offer(self, row: dict):
+        if not self.wants(row):
+            return
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            self.dropped += 1
+        self.queue.put_nowait(row)
+
+
+class ReadingBroadcaster:
+    """Fans readings out to stream subscribers on the asyncio event loop.
+
+    `publish` is safe to call from the MQTT network thread; the actual fan-out
+    runs on the loop bound via `bind_loop`.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._loop = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped_from_closed = 0
+
+    def bind_loop(self, loop):
+        self._loop = loop
+
+    def subscribe(self, device_ids=None) -> Subscription:
+        sub = Subscription(device_ids, self.queue_size)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscribers.discard(sub)
+            self.dropped_from_closed += sub.dropped
+
+    def publish(self, row: dict):
+        # Cheap no-op when nobody is listening
+        if not self._subscribers or self._loop is None:
+            return
+        self.published += 1
+        try:
+            self._loop.call_soon_threadsafe(self._fanout, row)
+        except RuntimeError:
+            # Loop already closed during shutdown
+            pass
+
+    def _fanout(self, row: dict):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.offer(row)
+
+    def stats(self) -> dict:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return {
+            "subscribers": len(subscribers),
+            "published": self.published,
+            "dropped": self.dropped_from_closed + sum(s.dropped for s in subscribers),
+        }
@@ -0,0 +1,70 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from statistics import median
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregation import aggregate, column, parse_timestamps, to_micros, value_or_none
+
+
+def test_parse_timestamps_matches_fromisoformat():
+    values = [
+        "2025-01-01T00:00:00+00:00",
+        "2025-01-01T00:00:00.5+00:00",
+        "2025-06-30T23:59:59.123456+00:00",
+        "2025-01-01T07:00:00+07:00",
+        "2024-02-29T12:30:00Z",
+        "2025-01-01 00:00:01.25-01:30",
+        "2025-01-01T00:00:00",
+    ]
+    parsed, valid = parse_timestamps(values)
+    assert valid.all()
+    for value, micros in zip(values, parsed):
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        assert micros == to_micros(dt), value
+
+
+def test_parse_timestamps_flags_garbage():
+    parsed, valid = parse_timestamps(["not a date", None, "2025-01-01T00:00:00+00:00"])
+    assert list(valid) == [False, False, True]
+
+
+def test_aggregate_matches_reference():
+    rng = np.random.default_rng(7)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    offsets = np.sort(rng.integers(0, 3600, size=5000))
+    rows = [{"created_at": (start + timedelta(seconds=int(s))).isoformat(),
+             "pm25": float(v)} for s, v in zip(offsets, rng.integers(0, 300, size=5000))]
+    ts, valid = parse_timestamps([r["created_at"] for r in rows])
+    width = 60 * 1_000_000
+    result = aggregate(ts, {"pm25": column(rows, "pm25")}, to_micros(start),
+                       to_micros(start) + 3600 * 1_000_000, width, 60, percentiles=(90,))
+
+    buckets = {}
+    for s, r in zip(offsets, rows):
+        buckets.setdefault(int(s) // 60, []).append(r["pm25"])
+    for i in range(60):
+        vals = buckets.get(i, [])
+        assert result["count"][i] == len(vals)
+        if not vals:
+            assert value_or_none(result["pm25"]["avg"][i]) is None
+            continue
+        assert np.isclose(result["pm25"]["avg"][i], sum(vals) / len(vals))
+        assert result["pm25"]["min"][i] == min(vals)
+        assert result["pm25"]["max"][i] == max(vals)
+        assert np.isclose(result["pm25"]["median"][i], median(vals))
+        assert np.isclose(result["pm25"]["p90"][i], np.percentile(vals, 90))
+        assert result["pm25"]["last"][i] == vals[-1]
+
+
+def test_aggregate_clamps_end_and_skips_out_of_range():
+    ts = np.array([-1, 0, 5, 10, 11], dtype=np.int64)
+    vals = np.array([100.0, 1.0, 2.0, 3.0, 100.0])
+    result = aggregate(ts, {"pm25": vals}, 0, 10, 5, 2)
+    assert list(result["count"]) == [1, 2]
+    assert result["pm25"]["max"][1] == 3.0
@@ -0,0 +1,58 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aqi import fleet_nowcast, hourly_means, nowcast, pm25_to_aqi
+
+T0 = 1_735_689_600  # 2025-01-01T00:00:00Z
+
+
+def hour_row(device_id, hour, pm25, count=1):
+    return {"device_id": device_id, "bucket_start": datetime.fromtimestamp(T0 + hour * 3600, timezone.utc).isoformat(),
+            "count": count, "pm25_sum": pm25 * count}
+
+
+def test_aqi_follows_the_firmware_breakpoints():
+    aqi = pm25_to_aqi([0, 6, 12, 12.5, 35, 55, 100, 150, 250, 500, 900, np.nan])
+    assert aqi[:3].tolist() == [0, 25, 50]
+    # Just above a breakpoint starts the next segment
+    assert round(float(aqi[3]), 2) == round(49 / 23 * 0.5 + 51, 2)
+    assert aqi[4:6].tolist() == [100, 150]
+    assert round(float(aqi[6]), 2) == round(49 / 95 * 45 + 151, 2)
+    assert aqi[7:11].tolist() == [200, 300, 500, 500]
+    assert np.isnan(aqi[11])
+
+
+def test_nowcast_weights_recent_hours_and_needs_two_of_the_last_three():
+    steady = nowcast(np.full(12, 20.0))
+    assert steady[-1] == 20.0
+
+    # Rising sharply: min/max < 0.5, so the weight is floored at 0.5
+    rising = np.array([10.0] * 11 + [40.0])
+    weights = 0.5 ** np.arange(12)
+    expected = (weights * np.array([40.0] + [10.0] * 11)).sum() / weights.sum()
+    assert np.isclose(nowcast(rising)[-1], expected)
+
+    gappy = np.array([20.0] * 9 + [20.0, np.nan, np.nan])
+    assert np.isnan(nowcast(gappy)[-1])
+    # Fleet rows evaluated at selected hours only, devices on the first axis
+    both = nowcast(np.vstack([np.full(24, 10.0), np.full(24, 30.0)]), at=[5, 23])
+    assert both.shape == (2, 2) and both[1].tolist() == [30.0, 30.0]
+
+
+def test_fleet_nowcast_from_rollup_rows():
+    rows = [hour_row("A", h, 10) for h in range(12)] + [hour_row("B", h, 30) for h in range(12)]
+    rows.append(hour_row("A", 11, 10, count=3))  # pending delta for the same hour merges in
+    assert hourly_means(rows, T0, 12).shape == (2, 12)
+
+    # 12:00 exactly belongs to hour 11; 12:30 to hour 12, which has no data yet
+    out = fleet_nowcast(rows, [T0 + 12 * 3600, T0 + 12 * 3600 + 1800, T0 + 2 * 3600, T0 + 3600])
+    assert out[0] == 20.0
+    assert out[1] == 20.0  # hours 11 and 10 still make two of the last three
+    assert out[2] == 20.0
+    assert np.isnan(out[3])  # only hour 0 is known
+    assert np.isnan(fleet_nowcast(rows, [T0 + 20 * 3600])[0])
@@ -0,0 +1,108 @@
+import io
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backfill import Backfill, Checkpoint, RecordError, parse_record
+from export import CsvEncoder
+from storage import READING_COLUMNS, SQLiteStore
+
+DAY = datetime(2024, 3, 5, tzinfo=timezone.utc)
+
+
+def firmware(device_id, i, ts=None):
+    return {"device_id": device_id, "readings": {"pm1": i, "pm25": 2 * i, "pm10": 3 * i}, "aqi": {"value": i},
+            "metadata": {"timestamp": ts if ts is not None else int((DAY + timedelta(minutes=i)).timestamp() * 1000),
+                         "wifi_rssi": -60, "ip": "10.0.0.2"}}
+
+
+def write_jsonl(path, records):
+    with open(path, "w") as f:
+        for r in records:
+            f.write((r if isinstance(r, str) else json.dumps(r)) + "\n")
+
+
+def test_parse_record_places_readings_in_time():
+    row = parse_record(firmware("A", 1))
+    assert row["created_at"] == "2024-03-05T00:01:00.000000+00:00"
+    assert (row["pm25"], row["aqi"], row["ip_address"]) == (2, 1, "10.0.0.2")
+    # Seconds are normalized to milliseconds, as on ingest
+    assert parse_record(firmware("A", 1, ts=1709596860))["timestamp"] == 1709596860000
+    # An uptime timestamp is normalized exactly as live ingest stores it, but the time must come from created_at
+    row = parse_record({**firmware("A", 1, ts=42_000), "created_at": "2024-03-05T10:00:00Z"})
+    assert (row["timestamp"], row["created_at"]) == (42_000_000, "2024-03-05T10:00:00.000000+00:00")
+    with pytest.raises(RecordError):
+        parse_record(firmware("A", 1, ts=42_000))
+    with pytest.raises(RecordError):
+        parse_record({"pm25": "12"})
+    with pytest.raises(RecordError):
+        parse_record({"device_id": "A", "pm25": "lots", "created_at": "2024-03-05T10:00:00Z"})
+
+
+def test_jsonl_import_skips_duplicates_and_bad_lines_and_rebuilds_rollups(tmp_path):
+    store = SQLiteStore(str(tmp_path / "r.sqlite3"))
+    path = str(tmp_path / "in.jsonl")
+    records = [firmware(d, i) for i in range(50) for d in "AB"]
+    write_jsonl(path, records + records[:10] + ["not json", firmware("A", 1, ts=5), firmware("INTEGRATION_TEST_001", 1)])
+    out = io.StringIO()
+    backfill = Backfill(store, workers=3, chunk_size=7, out=out)
+    stats = backfill.run_file(path)
+    assert (stats["stored"], stats["duplicates"], stats["invalid"], stats["ignored"]) == (100, 10, 2, 1)
+    assert store.count("2024-03-05T00:00:00Z", "2024-03-06T00:00:00Z") == 100
+    assert stats["rollup_buckets"] > 0
+    hourly = store.rollup_range(3600, "2024-03-05T00:00:00Z", "2024-03-06T00:00:00Z")
+    assert sum(r["count"] for r in hourly) == 100
+
+    # A finished file is skipped; a forced re-run stores nothing twice
+    assert backfill.run_file(path)["skipped"]
+    assert Backfill(store, out=out).run_file(path, restart=True)["stored"] == 100
+    assert store.count("2024-03-05T00:00:00Z", "2024-03-06T00:00:00Z") == 100
+
+
+class FlakyStore:
+    """Fails every insert after the first `ok` chunks."""
+
+    def __init__(self, store, ok):
+        self.store = store
+        self.ok = ok
+
+    def insert(self, rows):
+        if self.ok <= 0:
+            raise ConnectionError("database went away")
+        self.ok -= 1
+        self.store.insert(rows)
+
+
+def test_failed_chunk_keeps_checkpoint_and_resume_completes(tmp_path):
+    store = SQLiteStore(str(tmp_path / "r.sqlite3"))
+    path = str(tmp_path / "in.jsonl")
+    write_jsonl(path, [firmware("A", i) for i in range(100)])
+    with pytest.raises(RuntimeError):
+        Backfill(FlakyStore(store, ok=3), workers=1, chunk_size=10, base_delay=0, out=io.StringIO()).run_file(path, rollups=False)
+    checkpoint = Checkpoint(path)
+    assert checkpoint.load(os.path.getsize(path)) and not checkpoint.done
+    assert checkpoint.rows == 30 and 0 < checkpoint.offset < os.path.getsize(path)
+
+    stats = Backfill(store, workers=4, chunk_size=10, out=io.StringIO()).run_file(path, rollups=False)
+    assert stats["stored"] == 70
+    assert store.count("2024-03-05T00:00:00Z", "2024-03-06T00:00:00Z") == 100
+
+
+def test_csv_in_export_layout_round_trips(tmp_path):
+    source = SQLiteStore(str(tmp_path / "a.sqlite3"))
+    source.insert([parse_record(firmware(d, i)) for i in range(20) for d in "AB"])
+    rows = source.range("*", "2024-03-05T00:00:00Z", "2024-03-06T00:00:00Z", 1000)
+    encoder = CsvEncoder(list(READING_COLUMNS))
+    path = tmp_path / "export.csv"
+    path.write_bytes(encoder.begin() + encoder.encode(rows))
+
+    target = SQLiteStore(str(tmp_path / "b.sqlite3"))
+    assert Backfill(target, chunk_size=8, out=io.StringIO()).run_file(str(path))["stored"] == 40
+    copied = target.range("*", "2024-03-05T00:00:00Z", "2024-03-06T00:00:00Z", 1000)
+    strip = lambda rs: sorted((r["device_id"], r["created_at"], r["pm25"], r["timestamp"]) for r in rs)
+    assert strip(copied) == strip(rows)
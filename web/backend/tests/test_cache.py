@@ -0,0 +1,172 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import Rendered, ResponseCache, not_modified, validators
+
+
+def test_concurrent_misses_share_one_computation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"data": [1, 2, 3]}
+
+    async def scenario():
+        cache = ResponseCache()
+        results = await asyncio.gather(*[cache.get_or_compute(("history", "1h"), 10, compute) for _ in range(20)])
+        assert all(r == {"data": [1, 2, 3]} for r in results)
+        assert len(calls) == 1
+        stats = cache.stats()
+        assert stats["misses"] == 1
+        assert stats["coalesced"] == 19
+        await cache.get_or_compute(("history", "1h"), 10, compute)
+        assert cache.stats()["hits"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_ttl_expiry_depends_on_ingest():
+    async def compute():
+        return {"data": time.monotonic()}
+
+    async def scenario():
+        cache = ResponseCache(idle_factor=100)
+        first = await cache.get_or_compute("k", 0.01, compute)
+        await asyncio.sleep(0.02)
+        # Past the TTL but nothing new was ingested: still served from cache
+        assert await cache.get_or_compute("k", 0.01, compute) == first
+        cache.note_ingest()
+        assert await cache.get_or_compute("k", 0.01, compute) != first
+
+    asyncio.run(scenario())
+
+
+def test_ingest_invalidates_long_ttl_entries_after_min_ttl():
+    async def compute():
+        return {"data": time.monotonic()}
+
+    async def scenario():
+        cache = ResponseCache(min_ttl=0.02)
+        first = await cache.get_or_compute("1y", 3600, compute)
+        cache.note_ingest()
+        # Within the minimum TTL a burst of polls still shares the entry
+        assert await cache.get_or_compute("1y", 3600, compute) == first
+        await asyncio.sleep(0.03)
+        second = await cache.get_or_compute("1y", 3600, compute)
+        assert second != first
+        # Nothing ingested since the recompute: fresh for the whole TTL
+        await asyncio.sleep(0.03)
+        assert await cache.get_or_compute("1y", 3600, compute) == second
+
+    asyncio.run(scenario())
+
+
+def test_errors_are_not_cached_and_propagate():
+    async def scenario():
+        cache = ResponseCache()
+
+        async def failing():
+            raise RuntimeError("db down")
+
+        with pytest.raises(RuntimeError):
+            await cache.get_or_compute("k", 10, failing)
+
+        async def error_payload():
+            return {"error": "Database query failed"}
+
+        await cache.get_or_compute("k", 10, error_payload)
+        assert cache.stats()["entries"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_lru_eviction():
+    async def scenario():
+        cache = ResponseCache(max_entries=2)
+
+        async def compute():
+            return {"data": []}
+
+        for key in ("a", "b", "a", "c"):
+            await cache.get_or_compute(key, 10, compute)
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["entries"] == 2
+        # "a" was used more recently than "b", so "b" went
+        await cache.get_or_compute("a", 10, compute)
+        assert cache.stats()["hits"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_fail_others():
+    async def scenario():
+        cache = ResponseCache()
+        started = asyncio.Event()
+
+        async def compute():
+            started.set()
+            await asyncio.sleep(0.05)
+            return {"data": "ok"}
+
+        first = asyncio.ensure_future(cache.get_or_compute("k", 10, compute))
+        second = asyncio.ensure_future(cache.get_or_compute("k", 10, compute))
+        await started.wait()
+        first.cancel()
+        assert await second == {"data": "ok"}
+        assert first.cancelled()
+
+        # With no one left waiting the computation itself is abandoned
+        async def slow():
+            await asyncio.sleep(10)
+
+        only = asyncio.ensure_future(cache.get_or_compute("slow", 10, slow))
+        await asyncio.sleep(0.01)
+        only.cancel()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert "slow" not in cache._inflight
+
+    asyncio.run(scenario())
+
+
+def test_rendered_errors_are_not_cached():
+    async def scenario():
+        cache = ResponseCache()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            return Rendered({"error": "Database query failed"})
+
+        await cache.get_or_compute("k", 10, compute)
+        await cache.get_or_compute("k", 10, compute)
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+    assert Rendered({"pm25": 1.5, "data": []}).body == b'{"pm25":1.5,"data":[]}'
+
+
+def test_validators_follow_the_newest_reading():
+    headers = validators("history|1h", "2024-05-01T10:00:00.250000+00:00")
+    assert headers["ETag"].startswith('W/"')
+    assert headers["Last-Modified"] == "Wed, 01 May 2024 10:00:00 GMT"
+    assert validators("history|1h", "2024-05-01T10:00:01+00:00")["ETag"] != headers["ETag"]
+    assert validators("history|24h", "2024-05-01T10:00:00.250000+00:00")["ETag"] != headers["ETag"]
+    assert validators("history|1h", None) == {}
+
+    assert not_modified({"if-none-match": headers["ETag"]}, headers)
+    assert not_modified({"if-none-match": '"other", ' + headers["ETag"].removeprefix("W/")}, headers)
+    assert not not_modified({"if-none-match": '"other"'}, headers)
+    # If-None-Match wins over a matching If-Modified-Since
+    assert not not_modified({"if-none-match": '"other"', "if-modified-since": headers["Last-Modified"]}, headers)
+    assert not_modified({"if-modified-since": headers["Last-Modified"]}, headers)
+    assert not not_modified({"if-modified-since": "Wed, 01 May 2024 09:59:59 GMT"}, headers)
+    assert not not_modified({"if-modified-since": "garbage"}, headers)
+    assert not not_modified({"if-none-match": "*"}, {})
@@ -0,0 +1,70 @@
+import asyncio
+import gzip
+import os
+import sys
+import zlib
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import CompressionMiddleware, choose_encoding
+
+
+def test_choose_encoding_honours_q_values():
+    assert choose_encoding("gzip, deflate, br", brotli_available=True) == "br"
+    assert choose_encoding("gzip, deflate, br", brotli_available=False) == "gzip"
+    assert choose_encoding("br;q=0, gzip;q=0.5", brotli_available=True) == "gzip"
+    assert choose_encoding("gzip;q=0", brotli_available=False) is None
+    assert choose_encoding("*", brotli_available=False) == "gzip"
+    assert choose_encoding("identity", brotli_available=True) is None
+    assert choose_encoding("", brotli_available=True) is None
+
+
+def run(app, accept="gzip", **kwargs):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept.encode())]}
+    asyncio.run(CompressionMiddleware(app, **kwargs)(scope, None, send))
+    headers = {k.decode(): v.decode() for k, v in sent[0]["headers"]}
+    return sent[0]["status"], headers, [m.get("body", b"") for m in sent[1:]]
+
+
+def response(status, content_type, *chunks):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", content_type.encode()), (b"content-length", b"0")]})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+    return app
+
+
+def test_whole_body_is_gzipped_with_exact_length():
+    body = b'{"pm25":12.5,"count":3}' * 200
+    status, headers, bodies = run(response(200, "application/json", body))
+    assert headers["content-encoding"] == "gzip"
+    assert headers["vary"] == "Accept-Encoding"
+    assert int(headers["content-length"]) == len(bodies[0]) < len(body)
+    assert gzip.decompress(bodies[0]) == body
+
+
+def test_streamed_chunks_are_flushed_as_they_go():
+    chunks = [b"device_id,pm25\n", b"A,12\n" * 300, b"B,14\n" * 300]
+    status, headers, bodies = run(response(200, "text/csv", *chunks))
+    assert headers["content-encoding"] == "gzip"
+    assert "content-length" not in headers
+    # Every chunk but the last ends on a flush point, so it can be decoded on arrival
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert d.decompress(bodies[0]) == chunks[0]
+    assert d.decompress(b"".join(bodies[1:])) == b"".join(chunks[1:])
+
+
+def test_small_streaming_and_304_bodies_pass_through():
+    for app in (response(200, "application/json", b"{}"),
+                response(200, "text/event-stream", b"data: x\n\n" * 500, b""),
+                response(304, "application/json", b"")):
+        status, headers, bodies = run(app)
+        assert "content-encoding" not in headers
+    status, headers, bodies = run(response(200, "application/json", b"x" * 5000), accept="identity")
+    assert "content-encoding" not in headers and bodies == [b"x" * 5000]
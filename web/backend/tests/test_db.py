@@ -0,0 +1,129 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import QueryRunner, cancel_on_disconnect
+
+
+class FakeQuery:
+    """Stands in for a postgrest builder; execute() blocks like a network call."""
+
+    def __init__(self, delay, tracker=None):
+        self.delay = delay
+        self.tracker = tracker
+
+    def execute(self):
+        if self.tracker is not None:
+            with self.tracker["lock"]:
+                self.tracker["active"] += 1
+                self.tracker["peak"] = max(self.tracker["peak"], self.tracker["active"])
+        time.sleep(self.delay)
+        if self.tracker is not None:
+            with self.tracker["lock"]:
+                self.tracker["active"] -= 1
+        return "rows"
+
+
+def test_queries_are_capped_and_loop_stays_responsive():
+    async def scenario():
+        runner = QueryRunner(max_concurrency=3, timeout=5)
+        tracker = {"lock": threading.Lock(), "active": 0, "peak": 0}
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        tick_task = asyncio.ensure_future(ticker())
+        results = await asyncio.gather(*[runner.execute(FakeQuery(0.05, tracker), "history") for _ in range(9)])
+        tick_task.cancel()
+        runner.shutdown()
+
+        assert results == ["rows"] * 9
+        assert tracker["peak"] == 3
+        # Three waves of 50ms; a blocked loop would not have ticked at all
+        assert ticks >= 10
+        stats = runner.stats()
+        assert stats["in_flight"] == 0
+        assert stats["by_kind"]["history"]["count"] == 9
+
+    asyncio.run(scenario())
+
+
+def test_timeout_raises_504_and_holds_slot_until_thread_finishes():
+    async def scenario():
+        runner = QueryRunner(max_concurrency=1, timeout=0.02)
+        with pytest.raises(HTTPException) as exc:
+            await runner.execute(FakeQuery(0.1), "latest")
+        assert exc.value.status_code == 504
+        assert runner.stats()["in_flight"] == 1
+        await asyncio.sleep(0.15)
+        assert runner.stats()["in_flight"] == 0
+        assert runner.stats()["timeouts"] == 1
+        runner.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_queries_wait_for_the_store_then_503_if_it_never_opens():
+    async def scenario():
+        runner = QueryRunner(max_concurrency=2, timeout=0.05)
+        ready = asyncio.get_running_loop().create_future()
+        runner.hold_until(ready)
+        with pytest.raises(HTTPException) as exc:
+            await runner.execute(FakeQuery(0), "latest")
+        assert exc.value.status_code == 503
+        assert runner.stats()["not_ready"] == 1
+
+        waiting = asyncio.ensure_future(runner.execute(FakeQuery(0), "latest"))
+        await asyncio.sleep(0.01)
+        ready.set_result(True)
+        assert await waiting == "rows"
+        runner.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_cancel_on_disconnect():
+    class FakeRequest:
+        def __init__(self):
+            self.gone = False
+
+        async def is_disconnected(self):
+            return self.gone
+
+    async def scenario():
+        request = FakeRequest()
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def hang_up():
+            await asyncio.sleep(0.02)
+            request.gone = True
+
+        asyncio.ensure_future(hang_up())
+        with pytest.raises(HTTPException) as exc:
+            await cancel_on_disconnect(request, work(), poll_interval=0.01)
+        assert exc.value.status_code == 499
+        await asyncio.sleep(0)
+        assert cancelled.is_set()
+
+        assert await cancel_on_disconnect(FakeRequest(), asyncio.sleep(0, "done"), poll_interval=0.01) == "done"
+        assert await cancel_on_disconnect(None, asyncio.sleep(0, "done")) == "done"
+
+    asyncio.run(scenario())
@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedup import DuplicateFilter
+
+
+def reading(device_id, timestamp, pm25=12):
+    return {"device_id": device_id, "timestamp": timestamp, "pm1": pm25 - 2, "pm25": pm25, "pm10": pm25 + 5,
+            "aqi": 50, "wifi_rssi": -60}
+
+
+def test_repeated_reading_is_a_duplicate_within_the_window():
+    dedup = DuplicateFilter(capacity=100, window=60)
+    assert not dedup.seen(reading("A", 1000), now=0)
+    assert dedup.seen(reading("A", 1000), now=10)
+    assert not dedup.seen(reading("B", 1000), now=10)
+    assert not dedup.seen(reading("A", 2000), now=10)
+    # Past the window the key has expired and the reading is accepted again
+    assert not dedup.seen(reading("A", 1000), now=61)
+    assert dedup.stats() == {"keys": 3, "capacity": 100, "window_s": 60, "checked": 5, "duplicates": 1,
+                             "hit_rate": 0.2, "evicted": 0}
+
+
+def test_same_timestamp_with_new_values_is_not_a_duplicate():
+    # After a reboot the firmware's uptime timestamp starts over with fresh readings
+    dedup = DuplicateFilter(capacity=100, window=600)
+    assert not dedup.seen(reading("A", 5000, pm25=12), now=0)
+    assert not dedup.seen(reading("A", 5000, pm25=30), now=120)
+    assert dedup.seen(reading("A", 5000, pm25=30), now=121)
+    assert not dedup.seen(reading("A", 5000, pm25=12), now=122)
+
+
+def test_capacity_evicts_oldest_keys():
+    dedup = DuplicateFilter(capacity=3, window=600)
+    for ts in range(5):
+        dedup.seen(reading("A", ts), now=ts)
+    assert dedup.stats()["keys"] == 3
+    assert not dedup.seen(reading("A", 0), now=5)
+    assert dedup.seen(reading("A", 4), now=5)
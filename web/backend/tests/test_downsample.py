@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downsample import envelope, lttb, minmax, select
+
+
+def day_of_seconds():
+    x = np.arange(86_400, dtype=np.int64) * 1_000_000
+    y = 20 + 5 * np.sin(np.arange(86_400) / 3000.0)
+    y[43_210] = 180.0  # a single one-second spike
+    return x, y
+
+
+def test_lttb_keeps_endpoints_and_spike():
+    x, y = day_of_seconds()
+    idx = lttb(x, y, 500)
+    assert len(idx) == 500
+    assert idx[0] == 0 and idx[-1] == len(x) - 1
+    assert np.all(np.diff(idx) > 0)
+    assert 43_210 in idx
+
+
+def test_lttb_matches_reference_on_small_series():
+    rng = np.random.default_rng(1)
+    x = np.arange(40, dtype=float)
+    y = rng.normal(size=40)
+    n_out = 8
+
+    # Straightforward per-point implementation of the same algorithm
+    edges = np.linspace(0, 38, n_out - 1).astype(int) + 1
+    expected = [0]
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 1 < n_out - 2:
+            nx, ny = x[edges[i + 1]:edges[i + 2]].mean(), y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            nx, ny = x[-1], y[-1]
+        a = expected[-1]
+        areas = [abs((x[a] - nx) * (y[j] - y[a]) - (x[a] - x[j]) * (ny - y[a])) for j in range(lo, hi)]
+        expected.append(lo + int(np.argmax(areas)))
+    expected.append(39)
+    assert lttb(x, y, n_out).tolist() == expected
+
+
+def test_minmax_and_envelope_keep_peaks():
+    x, y = day_of_seconds()
+    idx = minmax(y, 200)
+    assert len(idx) <= 202
+    assert 43_210 in idx
+    starts, lows, highs = envelope(y, 100)
+    assert len(starts) == 100
+    assert highs.max() == 180.0
+    assert lows.min() == y.min()
+
+
+def test_select_skips_missing_values_and_short_series():
+    x = np.arange(10, dtype=np.int64)
+    y = np.array([1, np.nan, 3, 4, 9, 2, np.nan, 1, 0, 5], dtype=float)
+    # Fewer points than requested: every row with a value is kept
+    assert select(x, y, 50).tolist() == [0, 2, 3, 4, 5, 7, 8, 9]
+    assert select(x, y, 50, "minmax").tolist() == list(range(10))
+    kept = select(x, y, 4, "lttb")
+    assert not np.isnan(y[kept]).any()
+
+
+def test_full_day_reduces_quickly():
+    x, y = day_of_seconds()
+    started = time.perf_counter()
+    lttb(x, y, 1000)
+    minmax(y, 1000)
+    assert time.perf_counter() - started < 1.0
@@ -0,0 +1,62 @@
+import csv
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from export import fetch_columns, make_encoder, parse_columns
+
+
+def rows(start, n):
+    return [{"id": i, "device_id": "A", "pm1": i, "pm25": i * 2, "pm10": i * 3, "aqi": i * 4,
+             "timestamp": 1_700_000_000_000 + i, "wifi_rssi": -60, "ip_address": "10.0.0.2",
+             "created_at": f"2025-01-01T00:00:{i:02d}.000000+00:00"} for i in range(start, start + n)]
+
+
+def encode(fmt, columns, pages):
+    encoder = make_encoder(fmt, columns)
+    return encoder.begin() + b"".join(encoder.encode(p) for p in pages) + encoder.finish()
+
+
+def test_projection_keeps_order_and_always_fetches_the_keyset():
+    assert parse_columns("pm25, device_id,pm25") == ["pm25", "device_id"]
+    assert parse_columns(None)[0] == "id"
+    assert fetch_columns(["pm25"]) == "pm25, created_at, id"
+    with pytest.raises(ValueError):
+        parse_columns("pm25,password")
+    with pytest.raises(ValueError):
+        make_encoder("xlsx", ["pm25"])
+
+
+def test_csv_and_ndjson_emit_only_the_projected_columns():
+    pages = [rows(0, 3), rows(3, 2), []]
+    lines = list(csv.reader(io.StringIO(encode("csv", ["created_at", "pm25"], pages).decode())))
+    assert lines[0] == ["created_at", "pm25"]
+    assert [line[1] for line in lines[1:]] == ["0", "2", "4", "6", "8"]
+
+    records = [json.loads(line) for line in encode("ndjson", ["device_id", "pm10"], pages).decode().splitlines()]
+    assert records[-1] == {"device_id": "A", "pm10": 12}
+    assert len(records) == 5
+
+
+def test_parquet_and_arrow_stream_row_groups():
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    pages = [rows(0, 3), rows(3, 3), rows(6, 1)]
+
+    encoder = make_encoder("parquet", ["created_at", "device_id", "pm25"])
+    encoder.row_group_rows = 4
+    data = encoder.begin() + b"".join(encoder.encode(p) for p in pages) + encoder.finish()
+    parquet = pq.ParquetFile(io.BytesIO(data))
+    assert parquet.metadata.num_row_groups == 2
+    table = parquet.read()
+    assert table.column("pm25").to_pylist() == [i * 2 for i in range(7)]
+    assert str(table.schema.field("created_at").type) == "timestamp[us, tz=UTC]"
+
+    table = pa.ipc.open_stream(encode("arrow", ["id", "aqi"], pages)).read_all()
+    assert table.column_names == ["id", "aqi"]
+    assert table.num_rows == 7
@@ -0,0 +1,64 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hotstate import SnapshotPublisher, SnapshotReader
+from ringbuffer import LatestReadings
+from rollups import RollupStore
+
+
+def reading(device_id, second, pm25=10):
+    return {"device_id": device_id, "pm1": pm25, "pm25": pm25, "pm10": pm25,
+            "created_at": f"2025-01-01T00:00:{second:02d}+00:00"}
+
+
+def test_readings_and_rollup_deltas_reach_another_process_copy(tmp_path):
+    path = str(tmp_path / "hot_state.json")
+    source, source_rollups = LatestReadings(capacity=2), RollupStore(resolutions=(10,))
+    for second in (1, 2, 3):
+        source.append(reading("A", second))
+        source_rollups.add(reading("A", second), 1_700_000_000 + second)
+    source.append(reading("B", 4))
+    publisher = SnapshotPublisher(
+        path, lambda: {"readings": source.rows(), "warm": True, "rollups": source_rollups.dirty_state()},
+        lambda: (source.version, source_rollups.generation))
+
+    target, target_rollups, applied = LatestReadings(capacity=2), RollupStore(resolutions=(10,)), []
+
+    def apply(state):
+        target.replace(state["readings"], state["warm"])
+        target_rollups.replace_dirty(state["rollups"])
+        applied.append(state["written_at"])
+
+    reader = SnapshotReader(path, apply)
+    assert not reader.poll()  # nothing published yet
+    publisher.publish()
+    assert reader.poll()
+    assert target.warm
+    assert [r["created_at"][-8:-6] for r in target.latest_batch(10)] == ["02", "03", "04"]
+    assert target_rollups.pending(10, 0, 2e9) == source_rollups.pending(10, 0, 2e9)
+
+    # Unchanged state is neither rewritten nor reloaded
+    publisher.publish()
+    assert not reader.poll()
+    assert publisher.written == 1 and len(applied) == 1
+
+    source.append(reading("B", 5))
+    publisher.publish()
+    assert reader.poll()
+    assert target.latest()["created_at"].endswith(":05+00:00")
+    assert [f for f in os.listdir(tmp_path) if f != "hot_state.json"] == []
+
+
+def test_unreadable_snapshot_is_skipped_until_replaced(tmp_path):
+    path = tmp_path / "hot_state.json"
+    path.write_bytes(b"not json")
+    applied = []
+    reader = SnapshotReader(str(path), applied.append)
+    assert not reader.poll()
+    assert not reader.poll()
+    assert reader.failures == 1
+    SnapshotPublisher(str(path), lambda: {"n": 1}, lambda: 1).publish()
+    assert reader.poll()
+    assert applied[0]["n"] == 1
@@ -0,0 +1,154 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest import IngestWriter, ShardedIngestWriter, build_row, device_id_from_topic, normalize_timestamp, shard_for
+from spool import Spool
+
+
+def make_row(i, device_id="ESP32_PM25_001"):
+    data = {
+        "device_id": device_id,
+        "readings": {"pm1": 1, "pm25": i, "pm10": 3},
+        "aqi": {"value": 5},
+        "metadata": {"timestamp": 1_700_000_000_000 + i, "wifi_rssi": -50, "ip": "127.0.0.1"},
+    }
+    return build_row(data, data["metadata"]["timestamp"])
+
+
+def test_normalize_timestamp():
+    assert normalize_timestamp(1_700_000_000) == 1_700_000_000_000
+    assert normalize_timestamp("1700000000123") == 1_700_000_000_123
+    assert normalize_timestamp(None, now_ms=42) == 42
+    assert normalize_timestamp("not-a-number", now_ms=42) == 42
+
+
+def test_writer_flushes_by_size():
+    batches = []
+    writer = IngestWriter(batches.append, max_batch=10, max_age=60)
+    writer.start()
+    for i in range(25):
+        assert writer.submit(make_row(i))
+    time.sleep(0.3)
+    # Two full batches go out on size; the remainder waits for its age threshold
+    assert [len(b) for b in batches] == [10, 10]
+    writer.stop()
+    assert [len(b) for b in batches] == [10, 10, 5]
+    stats = writer.stats()
+    assert stats["written"] == 25
+    assert stats["batches"] == 3
+    assert stats["queue_depth"] == 0
+
+
+def test_writer_flushes_by_age():
+    flushed = threading.Event()
+    batches = []
+
+    def insert(rows):
+        batches.append(rows)
+        flushed.set()
+
+    writer = IngestWriter(insert, max_batch=100, max_age=0.05)
+    writer.start()
+    writer.submit(make_row(1))
+    assert flushed.wait(2)
+    writer.stop()
+    assert len(batches[0]) == 1
+
+
+def test_writer_retries_then_drops_batch():
+    calls = []
+
+    def insert(rows):
+        calls.append(len(rows))
+        raise RuntimeError("supabase down")
+
+    writer = IngestWriter(insert, max_batch=2, max_age=60, max_attempts=3, base_delay=0.01)
+    writer.start()
+    writer.submit(make_row(1))
+    writer.submit(make_row(2))
+    time.sleep(0.3)
+    writer.stop()
+    assert calls == [2, 2, 2]
+    stats = writer.stats()
+    assert stats["failed_batches"] == 1
+    assert stats["dropped"] == 2
+    assert stats["retries"] == 2
+
+
+def test_submit_does_not_block_when_queue_full():
+    writer = IngestWriter(lambda rows: None, max_queue=2)
+    assert writer.submit(make_row(1))
+    assert writer.submit(make_row(2))
+    started = time.monotonic()
+    assert not writer.submit(make_row(3))
+    assert time.monotonic() - started < 0.1
+    assert writer.stats()["dropped"] == 1
+
+
+def test_saturated_queue_spools_instead_of_losing_readings(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"))
+    # Not started: nothing drains the queue, as with a database that stopped answering
+    writer = IngestWriter(lambda rows: None, max_queue=10, spool=spool, high_water=0.8, low_water=0.5)
+    assert all(writer.submit(make_row(i)) for i in range(50))
+    stats = writer.stats()
+    assert (stats["enqueued"], stats["spooled"], stats["dropped"]) == (8, 42, 0)
+    assert stats["shedding"] and stats["shed_episodes"] == 1
+    assert sorted(r["pm25"] for _, r in spool.peek(100)) == list(range(8, 50))
+
+    # Still shedding between the marks; queueing again once below the low-water mark
+    for _ in range(3):
+        writer._queue.get_nowait()
+    assert writer.submit(make_row(50)) and writer.stats()["spooled"] == 43
+    writer._queue.get_nowait()
+    assert writer.submit(make_row(51)) and not writer.stats()["shedding"]
+    assert writer.stats()["enqueued"] == 9
+
+
+def test_load_is_the_fullest_shard():
+    writer = ShardedIngestWriter(lambda rows: None, shards=2, max_queue=4)
+    device = "ESP32_PM25_000"
+    for i in range(3):
+        writer.submit(make_row(i, device))
+    assert writer.load() == 0.75
+    assert writer.shards[1 - shard_for(device, 2)].load() == 0.0
+
+
+def test_device_id_from_topic():
+    assert device_id_from_topic("smartpm25/ESP32_PM25_007/data") == "ESP32_PM25_007"
+    assert device_id_from_topic("smartpm25.sensor.data") is None
+    assert device_id_from_topic("smartpm25//data") is None
+
+
+def test_sharded_writer_keeps_each_device_on_one_shard():
+    written = []
+    lock = threading.Lock()
+
+    def insert(rows):
+        with lock:
+            written.append((threading.current_thread().name, [(r["device_id"], r["pm25"]) for r in rows]))
+
+    writer = ShardedIngestWriter(insert, shards=3, max_batch=5, max_age=0.05)
+    writer.start()
+    devices = [f"ESP32_PM25_{n:03d}" for n in range(8)]
+    for i in range(40):
+        assert writer.submit(make_row(i, devices[i % len(devices)]))
+    writer.stop()
+
+    threads_by_device = {}
+    order_by_device = {}
+    for thread, rows in written:
+        for device_id, pm25 in rows:
+            threads_by_device.setdefault(device_id, set()).add(thread)
+            order_by_device.setdefault(device_id, []).append(pm25)
+    assert all(len(t) == 1 for t in threads_by_device.values())
+    assert all(seq == sorted(seq) for seq in order_by_device.values())
+    for device_id, threads in threads_by_device.items():
+        assert threads == {f"ingest-writer-{shard_for(device_id, 3)}"}
+    stats = writer.stats()
+    assert stats["written"] == 40
+    assert stats["queue_depth"] == 0
+    assert len(stats["shards"]) == 3
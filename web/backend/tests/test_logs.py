@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import queue
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logs
+from logs import JsonFormatter, LogSampler, NonBlockingQueueHandler, setup_logging
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_logger(name):
+    logger = logging.getLogger(name)
+    logger.handlers = []
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = ListHandler()
+    logger.addHandler(handler)
+    return logger, handler
+
+
+def test_sampler_lets_a_burst_through_then_summarizes():
+    logger, handler = make_logger("test.sampler")
+    sampler = LogSampler(logger, interval=0.05, burst=3)
+
+    for i in range(100):
+        sampler.info("received", "reading %d", i, device_id="A")
+    assert [r.getMessage() for r in handler.records] == ["reading 0", "reading 1", "reading 2"]
+    assert handler.records[0].fields == {"event": "received", "device_id": "A"}
+
+    time.sleep(0.06)
+    sampler.info("received", "reading %d", 100)
+    summary, first_of_window = handler.records[3:]
+    assert summary.fields["event"] == "received.summary"
+    assert summary.fields["count"] == 100
+    assert summary.fields["suppressed"] == 97
+    assert first_of_window.getMessage() == "reading 100"
+
+
+def test_sampler_never_suppresses_warnings_and_flush_reports_pending():
+    logger, handler = make_logger("test.sampler.errors")
+    sampler = LogSampler(logger, interval=60, burst=1)
+
+    for _ in range(5):
+        sampler.info("batch", "routine")
+        sampler.log(logging.ERROR, "batch", "failure")
+    levels = [r.levelno for r in handler.records]
+    assert levels.count(logging.ERROR) == 5
+    assert levels.count(logging.INFO) == 1
+
+    sampler.flush()
+    assert handler.records[-1].fields["suppressed"] == 4
+
+
+def test_listener_writes_summaries_without_waiting_for_the_next_record(tmp_path):
+    logger = logging.getLogger("test.sampler.timer")
+    listener, _ = setup_logging(logger, str(tmp_path / "backend.log"), json_format=True, sample_interval=0.05)
+    try:
+        sampler = LogSampler(logger, burst=1)
+        for i in range(5):
+            sampler.info("received", "reading %d", i)
+        # No further record arrives; the listener's timer reports the suppressed ones
+        deadline = time.monotonic() + 2
+        summaries = []
+        while not summaries and time.monotonic() < deadline:
+            time.sleep(0.05)
+            lines = [json.loads(line) for line in (tmp_path / "backend.log").read_text().splitlines()]
+            summaries = [line for line in lines if line.get("event") == "received.summary"]
+    finally:
+        listener.stop()
+        logs.SAMPLE_INTERVAL = 10.0
+    assert summaries and summaries[0]["count"] == 5 and summaries[0]["suppressed"] == 4
+
+
+def test_sampler_skips_work_when_level_disabled():
+    logger, handler = make_logger("test.sampler.disabled")
+    logger.setLevel(logging.WARNING)
+    sampler = LogSampler(logger, interval=60, burst=1)
+
+    class Explodes:
+        def __str__(self):
+            raise AssertionError("formatted a disabled record")
+
+    sampler.info("received", "%s", Explodes())
+    assert handler.records == []
+
+
+def test_queue_handler_drops_routine_records_but_keeps_errors_when_full():
+    q = queue.Queue(maxsize=2)
+    handler = NonBlockingQueueHandler(q, error_timeout=0.5)
+    logger = logging.getLogger("test.queue")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+    logger.info("one")
+    logger.info("two")
+    logger.info("three")
+    assert handler.dropped == 1
+
+    # An error waits for room instead of being discarded
+    first = q.get_nowait()
+    logger.error("boom %s", 42)
+    assert [first.msg, q.get_nowait().msg, q.get_nowait().msg] == ["one", "two", "boom 42"]
+
+
+def test_json_lines_with_fields_and_exception(tmp_path):
+    logger = logging.getLogger("test.json")
+    listener, _ = setup_logging(logger, str(tmp_path / "backend.log"), json_format=True)
+    try:
+        logger.info("Inserted %d rows", 5, extra={"fields": {"event": "batch", "rows": 5}})
+        try:
+            raise ValueError("bad payload")
+        except ValueError:
+            logger.exception("decode failed")
+    finally:
+        listener.stop()
+
+    lines = [json.loads(line) for line in (tmp_path / "backend.log").read_text().splitlines()]
+    assert lines[0]["msg"] == "Inserted 5 rows"
+    assert lines[0]["event"] == "batch" and lines[0]["rows"] == 5 and lines[0]["level"] == "INFO"
+    assert lines[1]["level"] == "ERROR"
+    assert "ValueError: bad payload" in lines[1]["exc"]
+
+
+def test_json_formatter_stringifies_values_json_cannot_encode():
+    record = logging.LogRecord("smartpm", logging.INFO, __file__, 1, "x", None, None)
+    record.fields = {"ids": {"A"}}
+    assert json.loads(JsonFormatter().format(record))["ids"] == "{'A'}"
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Registry, RequestMetricsMiddleware
+
+
+def test_counters_from_many_threads_are_summed_at_scrape():
+    registry = Registry()
+    messages = registry.counter("test_messages_total", "Messages", ("outcome",))
+
+    def worker():
+        for _ in range(10_000):
+            messages.inc("accepted")
+        messages.inc("dropped", amount=3)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert registry.snapshot("test_messages_total") == {("accepted",): [80_000], ("dropped",): [24]}
+    text = registry.render()
+    assert "# TYPE test_messages_total counter" in text
+    assert 'test_messages_total{outcome="accepted"} 80000' in text
+    assert 'test_messages_total{outcome="dropped"} 24' in text
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    latency = registry.histogram("test_seconds", "Latency", ("stage",), buckets=(0.01, 0.1, 1.0))
+    for value in (0.005, 0.01, 0.05, 0.5, 3.0):
+        latency.observe(value, "write")
+
+    lines = registry.render().splitlines()
+    assert 'test_seconds_bucket{stage="write",le="0.01"} 2' in lines
+    assert 'test_seconds_bucket{stage="write",le="0.1"} 3' in lines
+    assert 'test_seconds_bucket{stage="write",le="1"} 4' in lines
+    assert 'test_seconds_bucket{stage="write",le="+Inf"} 5' in lines
+    assert 'test_seconds_count{stage="write"} 5' in lines
+    assert 'test_seconds_sum{stage="write"} 3.565' in lines
+
+
+def test_gauges_are_evaluated_at_scrape_and_label_values_escaped():
+    registry = Registry()
+    depth = {"value": 1}
+    registry.gauge("test_depth", "Depth", lambda: depth["value"])
+    registry.gauge("test_per_shard", "Per shard", lambda: {('a"b',): 2}, ("shard",))
+
+    depth["value"] = 7
+    text = registry.render()
+    assert "test_depth 7" in text
+    assert 'test_per_shard{shard="a\\"b"} 2' in text
+
+
+def test_duplicate_metric_names_are_rejected():
+    registry = Registry()
+    registry.counter("test_total", "x")
+    try:
+        registry.counter("test_total", "y")
+    except ValueError:
+        return
+    raise AssertionError("expected ValueError")
+
+
+def test_middleware_labels_by_route_template_and_skips():
+    registry = Registry()
+    requests = registry.histogram("test_http_seconds", "HTTP", ("route", "method", "status"))
+    sizes = registry.histogram("test_http_bytes", "HTTP bytes", ("route", "encoding"), buckets=(10, 100))
+
+    def endpoint():
+        pass
+
+    class Route:
+        def __init__(self, path, endpoint):
+            self.path = path
+            self.endpoint = endpoint
+
+    class App:
+        routes = [Route("/api/items/{item_id}", endpoint), Route("/metrics", lambda: None)]
+
+        async def __call__(self, scope, receive, send):
+            # What the router does on a match
+            scope["endpoint"] = endpoint if scope["path"].startswith("/api") else self.routes[1].endpoint
+            await send({"type": "http.response.start", "status": 404 if scope["path"].endswith("9") else 200})
+            await send({"type": "http.response.body", "body": b"x" * 50})
+
+    app = App()
+    middleware = RequestMetricsMiddleware(app, requests, skip=("/metrics",), size_histogram=sizes)
+
+    async def call(path):
+        async def send(message):
+            pass
+        await middleware({"type": "http", "method": "GET", "path": path, "app": app}, None, send)
+
+    for path in ("/api/items/1", "/api/items/2", "/api/items/9", "/metrics"):
+        asyncio.run(call(path))
+
+    counts = {labels: sum(cell[:-1]) for labels, cell in registry.snapshot("test_http_seconds").items()}
+    assert counts == {("/api/items/{item_id}", "GET", "200"): 2, ("/api/items/{item_id}", "GET", "404"): 1}
+    assert {labels: cell[:-1] for labels, cell in registry.snapshot("test_http_bytes").items()} == {
+        ("/api/items/{item_id}", "identity"): [0, 3, 0]}
@@ -0,0 +1,55 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payload import PayloadError, decode_binary, decode_payload, encode_binary
+
+ROW = {"device_id": "ESP32_PM25_001", "pm1": 8, "pm25": 12, "pm10": 20, "aqi": 50,
+       "timestamp": 1_700_000_000_123, "wifi_rssi": -67, "ip_address": "192.168.1.40"}
+
+
+def test_binary_round_trip_and_size():
+    encoded = encode_binary(ROW)
+    assert encoded[0] == 0xB5
+    assert decode_payload(encoded) == ROW
+    as_json = json.dumps({
+        "device_id": ROW["device_id"],
+        "readings": {"pm1": 8, "pm25": 12, "pm10": 20},
+        "aqi": {"value": 50, "category": "Good", "health_message": "Air quality is satisfactory"},
+        "metadata": {"timestamp": ROW["timestamp"], "wifi_rssi": -67, "ip": "192.168.1.40", "wifi_attempts": 0},
+    })
+    assert len(encoded) * 4 < len(as_json)
+
+
+def test_json_is_still_accepted_and_topic_fills_device_id():
+    message = {"readings": {"pm1": 1, "pm25": 2, "pm10": 3}, "aqi": {"value": 4},
+               "metadata": {"timestamp": 5, "wifi_rssi": -50, "ip": "10.0.0.1"}}
+    row = decode_payload(json.dumps(message).encode(), "smartpm25/ESP32_PM25_009/data")
+    assert row["device_id"] == "ESP32_PM25_009"
+    assert (row["pm25"], row["timestamp"], row["ip_address"]) == (2, 5, "10.0.0.1")
+
+    anonymous = encode_binary({**ROW, "device_id": ""})
+    assert decode_payload(anonymous, "smartpm25/ESP32_PM25_010/data")["device_id"] == "ESP32_PM25_010"
+
+
+def test_bad_binary_payloads_are_rejected():
+    encoded = encode_binary(ROW)
+    with pytest.raises(PayloadError):
+        decode_binary(encoded[:10])
+    with pytest.raises(PayloadError):
+        decode_binary(encoded[:-3])
+    with pytest.raises(PayloadError):
+        decode_binary(encoded[:1] + bytes([99]) + encoded[2:])
+
+
+def test_reading_without_any_device_id_is_rejected():
+    message = {"readings": {"pm1": 1, "pm25": 2, "pm10": 3}, "aqi": {"value": 4},
+               "metadata": {"timestamp": 5, "wifi_rssi": -50, "ip": "10.0.0.1"}}
+    with pytest.raises(PayloadError):
+        decode_payload(json.dumps(message).encode(), "smartpm25.sensor.data")
+    with pytest.raises(PayloadError):
+        decode_payload(encode_binary({**ROW, "device_id": ""}), "smartpm25.sensor.data")
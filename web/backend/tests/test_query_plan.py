@@ -0,0 +1,86 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Runs the SQL in sql/ against a real Postgres (14+); skipped unless TEST_DATABASE_URL is set.
+# Everything happens in one transaction that is rolled back, so use a scratch database
+# without a readings table of its own.
+DSN = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DSN, reason="TEST_DATABASE_URL not set")
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sql")
+
+
+def sql_file(name: str) -> str:
+    with open(os.path.join(SQL_DIR, name)) as f:
+        return f.read()
+
+
+@pytest.fixture(scope="module")
+def cur():
+    psycopg = pytest.importorskip("psycopg")
+    # Client-side binding, so parameters can go into EXPLAIN EXECUTE
+    with psycopg.connect(DSN, cursor_factory=psycopg.ClientCursor) as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql_file("create_readings_table.sql"))
+            # CONCURRENTLY is not allowed inside the test's transaction
+            cur.execute(sql_file("add_readings_indexes.sql").replace(" concurrently", ""))
+            cur.execute(sql_file("aggregate_readings.sql"))
+            # 20 devices, one reading every 10 s for 10 days
+            cur.execute(
+                "insert into readings (device_id, pm1, pm25, pm10, aqi, timestamp, created_at) "
+                "select 'D' || (i % 20), i % 50, i % 70, i % 90, 0, i, "
+                "timestamptz '2025-03-01' + make_interval(secs => (i / 20) * 10) "
+                "from generate_series(0, 20 * 8640 * 10 - 1) as i"
+            )
+            cur.execute("analyze readings")
+            yield cur
+        conn.rollback()
+
+
+def plan(cur, device_ids, start, end) -> dict:
+    cur.execute("select aggregate_readings_query(array['pm25', 'pm10'], array['avg', 'max'], array[90], %s)",
+                (device_ids is not None,))
+    (query,) = cur.fetchone()
+    cur.execute("deallocate all")
+    cur.execute(f"prepare agg(timestamptz, timestamptz, integer, text[]) as {query}")
+    cur.execute("explain (format json) execute agg(%s, %s, 300, %s)", (start, end, device_ids))
+    (doc,) = cur.fetchone()
+    return (json.loads(doc) if isinstance(doc, str) else doc)[0]["Plan"]
+
+
+def scans(node) -> tuple:
+    """(node types, index names) of every node in the plan."""
+    types, indexes = {node["Node Type"]}, {node["Index Name"]} if "Index Name" in node else set()
+    for child in node.get("Plans", []):
+        child_types, child_indexes = scans(child)
+        types |= child_types
+        indexes |= child_indexes
+    return types, indexes
+
+
+def test_device_filter_scans_device_created_index(cur):
+    types, indexes = scans(plan(cur, ["D3", "D7"], "2025-03-05T00:00:00Z", "2025-03-06T00:00:00Z"))
+    assert "Seq Scan" not in types and indexes == {"readings_device_created_idx"}, (types, indexes)
+
+
+def test_time_range_without_devices_scans_created_index(cur):
+    types, indexes = scans(plan(cur, None, "2025-03-05T00:00:00Z", "2025-03-05T06:00:00Z"))
+    assert "Seq Scan" not in types and indexes == {"readings_created_idx"}, (types, indexes)
+
+
+def test_aggregate_readings_buckets_any_width(cur):
+    # 7-minute buckets from the epoch: 2025-03-01 00:00 falls inside the bucket starting 23:58 the day before
+    cur.execute(
+        "select bucket_time, sample_count, aggregates from aggregate_readings("
+        "'2025-03-01T00:00:00Z', '2025-03-01T00:14:00Z', 420, array['D1'], array['pm25'], array['count', 'max'], array[50])"
+    )
+    rows = cur.fetchall()
+    assert [r[0].isoformat() for r in rows] == [
+        "2025-02-28T23:58:00+00:00", "2025-03-01T00:05:00+00:00", "2025-03-01T00:12:00+00:00"]
+    assert [r[1] for r in rows] == [30, 42, 12]
+    assert set(rows[0][2]["pm25"]) == {"count", "max", "p50"}
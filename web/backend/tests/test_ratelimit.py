@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ratelimit import DeviceRateLimiter, HeldReadingReleaser, envelope
+
+
+def reading(device_id, pm25, n=0):
+    return {"device_id": device_id, "pm25": pm25, "timestamp": n}
+
+
+def test_budget_then_latest_value_wins():
+    limiter = DeviceRateLimiter(rate=1.0, burst=3, mode="latest")
+    flood = [reading("A", 10 + i, i) for i in range(10)]
+    passed = [r for row in flood for r in limiter.offer(row, now=0.0)]
+    assert passed == flood[:3]
+    # Another device is unaffected
+    assert limiter.offer(reading("B", 5), now=0.0) == [reading("B", 5)]
+    # One token later the next reading goes out with the held one coalesced into it
+    assert limiter.offer(reading("A", 99, 10), now=1.0) == [reading("A", 99, 10)]
+    stats = limiter.device_stats()["A"]
+    assert (stats["admitted"], stats["limited"], stats["coalesced"], stats["released"], stats["held"]) == (3, 8, 7, 1, 0)
+
+
+def test_minmax_keeps_the_envelope_and_release_waits_for_budget():
+    limiter = DeviceRateLimiter(rate=0.5, burst=1, mode="minmax")
+    assert limiter.offer(reading("A", 10, 0), now=0.0)
+    for n, pm25 in enumerate([30, 5, 80, 40, 60], start=1):
+        assert limiter.offer(reading("A", pm25, n), now=0.1) == []
+    assert limiter.held() == 2
+    assert limiter.release(now=1.0) == []
+    assert limiter.release(now=2.5) == [reading("A", 5, 2), reading("A", 80, 3)]
+    assert limiter.held() == 0
+    assert envelope([reading("A", None), reading("A", None, 1)]) == [reading("A", None, 1)]
+    assert envelope([reading("A", 7), reading("A", 7, 1)]) == [reading("A", 7)]
+
+
+def test_releaser_stop_flushes_everything_held():
+    limiter = DeviceRateLimiter(rate=0.001, burst=1)
+    ingested = []
+    releaser = HeldReadingReleaser(limiter, ingested.append, interval=60)
+    limiter.offer(reading("A", 1, 0))
+    limiter.offer(reading("A", 2, 1))
+    releaser.start()
+    releaser.stop()
+    assert ingested == [reading("A", 2, 1)]
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        DeviceRateLimiter(mode="average")
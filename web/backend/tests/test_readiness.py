@@ -0,0 +1,20 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from readiness import Readiness
+
+
+def test_readiness_reports_each_component():
+    readiness = Readiness(("store", "mqtt"), required=("store",))
+    assert not readiness.is_ready()
+    readiness.failed("store", ValueError("timeout"))
+    readiness.failed("mqtt", "refused")
+    snapshot = readiness.snapshot()
+    assert snapshot["ready"] is False
+    assert snapshot["components"]["store"]["error"] == "timeout"
+
+    readiness.ready("store")
+    assert readiness.is_ready() and not readiness.is_ready("mqtt")
+    assert readiness.snapshot()["components"]["store"]["attempts"] == 2
@@ -0,0 +1,95 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ringbuffer import DeviceRing, LatestReadings
+
+
+def reading(device_id, second, pm25=10):
+    return {"device_id": device_id, "pm25": pm25,
+            "created_at": f"2025-01-01T00:00:{second:02d}+00:00"}
+
+
+def test_device_ring_wraps_and_keeps_order():
+    ring = DeviceRing(3)
+    for i in range(5):
+        ring.append(i)
+    assert len(ring) == 3
+    assert ring.last() == 4
+    assert ring.latest(3) == [2, 3, 4]
+    assert ring.latest(2) == [3, 4]
+    assert ring.latest(10) == [2, 3, 4]
+
+
+def test_latest_across_devices():
+    buf = LatestReadings(capacity=4)
+    assert buf.latest() is None
+    buf.append(reading("A", 1))
+    buf.append(reading("B", 3))
+    buf.append(reading("A", 2))
+    assert buf.latest()["device_id"] == "B"
+    assert buf.latest({"A"})["created_at"].endswith(":02+00:00")
+    assert buf.latest({"C"}) is None
+    assert {d: r["created_at"][-8:-6] for d, r in buf.last_by_device().items()} == {"A": "02", "B": "03"}
+    assert list(buf.last_by_device({"B"})) == ["B"]
+
+
+def test_latest_batch_merges_devices_chronologically():
+    buf = LatestReadings(capacity=4)
+    buf.load([reading("A", s) for s in (5, 1, 3)] + [reading("B", s) for s in (2, 4)])
+    rows = buf.latest_batch(4)
+    assert [r["created_at"][-8:-6] for r in rows] == ["02", "03", "04", "05"]
+
+
+def test_latest_batch_is_cold_until_warmed_or_full():
+    buf = LatestReadings(capacity=8)
+    buf.append(reading("A", 1))
+    # Not warmed and not enough rows to answer on its own: fall back to the DB
+    assert buf.latest_batch(5) is None
+    assert buf.latest_batch(1) == [reading("A", 1)]
+    buf.load([])
+    assert buf.latest_batch(5) == [reading("A", 1)]
+
+
+def test_load_merges_with_live_readings():
+    buf = LatestReadings(capacity=4)
+    # A live reading arrives while the warm-up query is still running
+    buf.append(reading("A", 10))
+    buf.load([reading("A", s) for s in (0, 2, 1)] + [reading("A", 10)])
+    assert buf.latest()["created_at"].endswith(":10+00:00")
+    assert [r["created_at"][-8:-6] for r in buf.latest_batch(3)] == ["01", "02", "10"]
+    assert buf.stats()["rows"] == 4
+
+
+def test_device_outside_the_warm_up_falls_back_until_loaded():
+    buf = LatestReadings(capacity=8)
+    # The fleet-wide warm-up only reached device A; B has older history in the DB
+    buf.load([reading("A", s) for s in range(5)])
+    assert buf.latest_batch(3) is not None
+    assert buf.latest_batch(3, {"A"}) is not None
+    assert buf.latest_batch(3, {"B"}) is None
+    buf.append(reading("B", 10))
+    assert buf.latest_batch(3, {"A", "B"}) is None
+
+    # Loading B's newest rows: fewer than asked for, so that is all of it
+    buf.load([reading("B", 1)], complete=True, device_ids={"B"})
+    assert [r["created_at"][-8:-6] for r in buf.latest_batch(3, {"B"})] == ["01", "10"]
+    assert buf.latest_batch(3, {"C"}) is None
+
+    # A warm-up that returned every stored row covers devices it never saw
+    buf.load([], complete=True)
+    assert buf.latest_batch(3, {"C"}) == []
+
+
+def test_rows_can_be_capped_per_device():
+    buf = LatestReadings(capacity=8)
+    buf.load([reading("A", s) for s in range(6)] + [reading("B", 9)])
+    assert len(buf.rows()) == 7
+    capped = buf.rows(per_device=2)
+    assert [(r["device_id"], r["created_at"][-8:-6]) for r in capped] == [("A", "04"), ("A", "05"), ("B", "09")]
+    # What an API worker rebuilds from the capped copy answers up to the cap and asks the DB beyond it
+    copy = LatestReadings(capacity=8)
+    copy.replace(capped, warm=True)
+    assert len(copy.latest_batch(2, {"A"})) == 2
+    assert copy.latest_batch(3, {"A"}) is None
@@ -0,0 +1,102 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rollups import RollupFlusher, RollupStore, coarsen, combine, pick_resolution, summarize
+
+T0 = 1_735_689_600  # 2025-01-01T00:00:00Z, aligned to every resolution
+
+
+def reading(device_id, pm25):
+    return {"device_id": device_id, "pm1": pm25 - 1, "pm25": pm25, "pm10": pm25 + 1}
+
+
+def test_add_updates_every_resolution():
+    store = RollupStore()
+    store.add(reading("A", 10), T0 + 5)
+    store.add(reading("A", 30), T0 + 15)
+    ten_second = store.pending(10, T0, T0 + 60)
+    assert [r["count"] for r in ten_second] == [1, 1]
+    minute = store.pending(60, T0, T0 + 60)
+    assert len(minute) == 1
+    assert minute[0]["count"] == 2
+    assert minute[0]["pm25_sum"] == 40
+    assert minute[0]["pm25_min"] == 10
+    assert minute[0]["pm25_max"] == 30
+    assert len(store.pending(3600, T0, T0 + 3600)) == 1
+
+
+def test_drain_and_restore_dirty():
+    store = RollupStore(resolutions=(60,))
+    store.add(reading("A", 10), T0)
+    rows = store.drain_dirty()
+    assert len(rows) == 1
+    assert store.drain_dirty() == []
+    store.add(reading("A", 20), T0 + 1)
+    store.restore_dirty(rows)
+    merged = store.drain_dirty()
+    assert merged[0]["count"] == 2
+    assert merged[0]["pm25_max"] == 20
+
+
+def test_flusher_keeps_deltas_on_failure():
+    store = RollupStore(resolutions=(60,))
+    store.add(reading("A", 10), T0)
+    calls = []
+
+    def failing(rows):
+        calls.append(rows)
+        raise RuntimeError("rpc missing")
+
+    flusher = RollupFlusher(store, failing)
+    flusher.flush()
+    assert flusher.failures == 1
+    assert store.stats()["pending_buckets"] == 1
+
+
+def test_combine_across_devices_into_wider_buckets():
+    store = RollupStore(resolutions=(60,))
+    store.add(reading("A", 10), T0)
+    store.add(reading("B", 20), T0 + 61)
+    store.add(reading("A", 60), T0 + 130)
+    out = combine(store.pending(60, T0, T0 + 300), 120)
+    assert [r["count"] for r in out] == [2, 1]
+    assert out[0]["pm25_avg"] == 15
+    assert out[1]["pm25_max"] == 60
+
+
+def test_summarize_per_device():
+    store = RollupStore(resolutions=(60,))
+    store.add(reading("A", 10), T0)
+    store.add(reading("A", 30), T0 + 70)
+    store.add(reading("B", 5), T0 + 5)
+    rows = store.pending(60, T0, T0 + 120)
+    summary = summarize(rows)
+    assert summary["A"]["count"] == 2
+    assert summary["A"]["pm25_avg"] == 20
+    assert (summary["A"]["pm25_min"], summary["A"]["pm25_max"]) == (10, 30)
+    assert summary["B"]["pm10_max"] == 6
+    assert [r["device_id"] for r in store.pending(60, T0, T0 + 120, {"B"})] == ["B"]
+
+
+def test_pick_resolution_skips_tiers_pruned_before_the_range_start():
+    assert pick_resolution(3600) == 3600
+    assert pick_resolution(86400) == 86400
+    assert pick_resolution(7 * 3600) == 3600
+    retention = {10: 7 * 86400, 60: 90 * 86400, 600: 730 * 86400}
+    assert pick_resolution(1200, 7 * 86400, retention) == 600
+    # 1m buckets are gone after 90 days; an unretained tier is only used when nothing else divides
+    assert pick_resolution(60, 365 * 86400, retention) == 60
+    assert pick_resolution(7) is None
+
+
+def test_coarsen_merges_hours_into_a_day_per_device():
+    store = RollupStore(resolutions=(3600,))
+    store.add(reading("A", 10), T0 + 60)
+    store.add(reading("A", 30), T0 + 5 * 3600)
+    store.add(reading("B", 7), T0 + 23 * 3600)
+    days = coarsen(store.pending(3600, T0, T0 + 86400), 86400)
+    assert [(r["device_id"], r["resolution_s"], r["count"]) for r in days] == [("A", 86400, 2), ("B", 86400, 1)]
+    assert (days[0]["pm25_sum"], days[0]["pm25_min"], days[0]["pm25_max"]) == (40, 10, 30)
+    assert days[0]["bucket_start"].startswith("2025-01-01T00:00:00")
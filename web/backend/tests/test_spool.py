@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest import IngestWriter
+from spool import Spool, SpoolReplayer
+
+
+def row(i):
+    return {"device_id": "ESP32_PM25_001", "pm1": 1, "pm25": i, "pm10": 3, "aqi": 5,
+            "timestamp": 1_700_000_000_000 + i, "wifi_rssi": -50, "ip_address": "127.0.0.1"}
+
+
+def test_spool_persists_across_reopen(tmp_path):
+    path = str(tmp_path / "spool.db")
+    spool = Spool(path)
+    spool.append([row(1), row(2)])
+    spool.close()
+
+    reopened = Spool(path)
+    assert len(reopened) == 2
+    entries = reopened.peek(10)
+    assert [r["pm25"] for _, r in entries] == [1, 2]
+    # Spooled rows carry the time they were received
+    assert all("created_at" in r for _, r in entries)
+    reopened.ack(entries[0][0])
+    assert len(reopened) == 1
+
+
+def test_spool_evicts_oldest_over_cap(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"), max_bytes=1000)
+    for i in range(50):
+        spool.append([row(i)])
+    assert spool.stats()["payload_bytes"] <= 1000
+    assert spool.evicted > 0
+    remaining = [r["pm25"] for _, r in spool.peek(100)]
+    assert remaining[-1] == 49
+    assert remaining == sorted(remaining)
+
+
+def test_failed_batch_is_spooled_and_replayed(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"))
+    healthy = {"up": False}
+    inserted = []
+
+    def insert(rows):
+        if not healthy["up"]:
+            raise RuntimeError("supabase down")
+        inserted.extend(rows)
+
+    replayer = SpoolReplayer(spool, insert, interval=0.05)
+    writer = IngestWriter(insert, max_batch=3, max_age=60, max_attempts=2, base_delay=0.01,
+                          spool=spool, on_success=replayer.notify_healthy)
+    writer.start()
+    for i in range(3):
+        writer.submit(row(i))
+    time.sleep(0.2)
+    assert len(spool) == 3
+    assert writer.stats()["dropped"] == 0
+
+    healthy["up"] = True
+    replayer.start()
+    deadline = time.monotonic() + 3
+    while len(spool) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    replayer.stop()
+    writer.stop()
+    assert len(spool) == 0
+    assert sorted(r["pm25"] for r in inserted) == [0, 1, 2]
+    assert replayer.stats()["replayed"] == 3
+
+
+def test_poison_rows_are_dead_lettered_not_blocking(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"))
+    spool.append([row(i) for i in range(10)])
+    spool.append([{**row(99), "device_id": None}])
+    spool.append([row(i) for i in range(10, 15)])
+    spool.append([{**row(98), "device_id": None}])
+    inserted = []
+
+    def insert(rows):
+        if any(r["device_id"] is None for r in rows):
+            raise ValueError("null value in column device_id violates not-null constraint")
+        inserted.extend(rows)
+
+    replayer = SpoolReplayer(spool, insert, batch_size=100, interval=0.05)
+    replayer.start()
+    deadline = time.monotonic() + 3
+    while len(spool) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    replayer.stop()
+    assert len(spool) == 0
+    assert sorted(r["pm25"] for r in inserted) == list(range(15))
+    assert sorted(r["pm25"] for _, r, _ in spool.dead_letters()) == [98, 99]
+    assert spool.stats()["dead_letters"] == 2
+    assert replayer.stats()["dead_lettered"] == 2
+
+
+def test_outage_during_bisection_keeps_the_rest_spooled(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"))
+    spool.append([row(i) for i in range(8)])
+    spool.append([{**row(99), "device_id": None}])
+    up = {"db": True, "drop_after_insert": True}
+    inserted = []
+
+    def insert(rows):
+        if not up["db"]:
+            raise ConnectionError("supabase unreachable")
+        if any(r["device_id"] is None for r in rows):
+            raise ValueError("null value in column device_id violates not-null constraint")
+        inserted.extend(rows)
+        if up.pop("drop_after_insert", False):
+            # The database goes down right after the first half of the bisection got in
+            up["db"] = False
+
+    def probe():
+        if not up["db"]:
+            raise ConnectionError("supabase unreachable")
+
+    replayer = SpoolReplayer(spool, insert, batch_size=100, interval=0.05, probe_fn=probe)
+    replayer.start()
+    time.sleep(0.3)
+    replayer.stop()
+    # Whatever went in left the spool; nothing was written off while the database was down
+    assert spool.stats()["dead_letters"] == 0
+    assert [r["pm25"] for r in inserted] == [0, 1, 2, 3]
+    assert [r["pm25"] for _, r in spool.peek(100)] == [4, 5, 6, 7, 99]
+
+    up["db"] = True
+    replayer.start()
+    deadline = time.monotonic() + 5
+    while len(spool) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    replayer.stop()
+    assert len(spool) == 0
+    assert sorted(r["pm25"] for r in inserted) == list(range(8))
+    assert [r["pm25"] for _, r, _ in spool.dead_letters()] == [99]
+
+
+def test_outage_backs_off_without_dead_lettering(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"))
+    spool.append([row(i) for i in range(200)])
+    calls = []
+
+    def insert(rows):
+        calls.append(len(rows))
+        raise ConnectionError("supabase unreachable")
+
+    replayer = SpoolReplayer(spool, insert, interval=0.05, max_delay=60)
+    replayer.start()
+    time.sleep(0.3)
+    replayer.stop()
+    assert len(spool) == 200
+    assert spool.stats()["dead_letters"] == 0
+    # One pass probes a bounded number of sub-batches, then backs off
+    assert len(calls) <= replayer.probe_limit + 1
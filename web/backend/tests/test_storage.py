@@ -0,0 +1,179 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rollups import RollupStore, combine, coverage_split
+from storage import _EPOCH_SQL, SQLiteStore, _aggregate_sql
+
+
+def reading(device_id, created_at, pm25):
+    return {"device_id": device_id, "pm1": pm25 - 2, "pm25": pm25, "pm10": pm25 + 5, "aqi": pm25 * 2,
+            "timestamp": 0, "wifi_rssi": -60, "ip_address": "10.0.0.2", "created_at": created_at}
+
+
+def test_partitions_latest_and_keyset_range(tmp_path):
+    store = SQLiteStore(str(tmp_path / "readings.sqlite3"))
+    store.insert([
+        reading("A", "2025-01-31T23:59:59.500000+00:00", 10),
+        reading("A", "2025-02-01T00:00:01Z", 12),
+        reading("B", "2025-02-01T00:00:01Z", 14),
+        reading("INTEGRATION_TEST_001", "2025-02-01T00:00:05Z", 99),
+        reading("B", "2025-02-01T00:00:03+00:00", 16),
+    ])
+    tables = {r[0] for r in store._conn().execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert "readings_2025_01_device_created_idx" in tables
+    assert "readings_2025_02_device_created_idx" in tables
+
+    assert [r["pm25"] for r in store.latest(3)] == [16, 14, 12]
+    assert store.latest(1, include_test=True)[0]["device_id"] == "INTEGRATION_TEST_001"
+    assert list(store.latest(1, "created_at")[0]) == ["created_at"]
+
+    # Pages of two across the month boundary, including two rows sharing created_at
+    rows, last = [], None
+    while True:
+        page = store.range("id, created_at, pm25", "2025-01-31T00:00:00Z", "2025-02-02T00:00:00Z", 2, after=last)
+        rows += page
+        if len(page) < 2:
+            break
+        last = page[-1]
+    assert [r["pm25"] for r in rows] == [10, 12, 14, 16]
+    assert [r["pm25"] for r in store.range("*", "2025-01-01T00:00:00", "2025-03-01T00:00:00", 2, newest_first=True)] == [16, 14]
+    assert [r["pm25"] for r in store.range("pm25", "2025-01-01T00:00:00", "2025-03-01T00:00:00", 10, device_ids={"A"})] == [10, 12]
+    assert [r["pm25"] for r in store.latest(5, device_ids={"B", "INTEGRATION_TEST_001"})] == [99, 16, 14]
+    store.close()
+
+
+def test_aggregate_and_rollups(tmp_path):
+    store = SQLiteStore(str(tmp_path / "readings.sqlite3"))
+    store.insert([
+        reading("A", "2025-03-01T10:00:05Z", 10),
+        reading("B", "2025-03-01T10:00:55Z", 20),
+        reading("A", "2025-03-01T10:01:30Z", 40),
+    ])
+    data = store.aggregate("2025-03-01T10:00:00", "2025-03-01T10:05:00", 60)
+    assert [(d["bucket_time"][11:19], d["count"], d["pm25"]) for d in data] == [
+        ("10:00:00", 2, {"avg": 15.0}), ("10:01:00", 1, {"avg": 40.0})]
+    data = store.aggregate("2025-03-01T10:00:00", "2025-03-01T10:05:00", 60, device_ids={"B"})
+    assert [d["pm25"]["avg"] for d in data] == [20.0]
+
+    # Deltas flushed twice into the same bucket add up
+    mem = RollupStore(resolutions=(60,))
+    mem.add({"device_id": "A", "pm1": 1, "pm25": 5, "pm10": 9}, 1740823200)
+    store.merge_rollups(mem.drain_dirty())
+    mem.add({"device_id": "A", "pm1": 3, "pm25": 7, "pm10": 2}, 1740823210)
+    store.merge_rollups(mem.drain_dirty())
+    (row,) = store.rollup_range(60, "2025-03-01T10:00:00Z", "2025-03-01T10:00:00Z")
+    assert (row["count"], row["pm25_sum"], row["pm25_min"], row["pm10_max"]) == (2, 12, 5, 9)
+
+    assert store.rebuild_rollups(60, "2025-03-01T10:00:30Z", "2025-03-01T10:01:10Z") == 3
+    rebuilt = store.rollup_range(60, "2025-03-01T10:00:00Z", "2025-03-01T10:02:00Z")
+    assert [(r["device_id"], r["count"], r["pm25_sum"]) for r in rebuilt] == [("A", 1, 10), ("B", 1, 20), ("A", 1, 40)]
+    assert len(store.rollup_range(60, "2025-03-01T10:00:00Z", "2025-03-01T10:02:00Z", device_ids={"A"})) == 2
+    store.close()
+
+
+def test_half_covered_range_takes_the_rest_from_raw(tmp_path):
+    store = SQLiteStore(str(tmp_path / "readings.sqlite3"))
+    t0 = 1740823200  # 2025-03-01T10:00:00Z
+    rows = [reading("A", datetime.fromtimestamp(t0 + 60 * i, timezone.utc).isoformat(), 10 + i) for i in range(120)]
+    store.insert(rows)
+    # Rollups started (say, the backend was deployed) 10:40:30, mid-bucket
+    mem = RollupStore(resolutions=(60,))
+    for row in rows[40:]:
+        mem.add(row, datetime.fromisoformat(row["created_at"]).timestamp() + 30)
+    store.merge_rollups(mem.drain_dirty())
+    assert store.rollup_start(60) == "2025-03-01T10:40:00.000000+00:00"
+    assert store.rollup_start(3600) is None
+
+    # Complete from the bucket after the oldest one
+    covered = datetime.fromisoformat(store.rollup_start(60)).timestamp() + 60
+    split = coverage_split(t0, t0 + 7200, 600, covered)
+    assert split == t0 + 3000
+    raw = store.aggregate("2025-03-01T10:00:00Z", "2025-03-01T10:50:00Z", 600)
+    rolled = combine(store.rollup_range(60, "2025-03-01T10:50:00Z", "2025-03-01T11:59:59Z"), 600)
+    assert [d["count"] for d in raw] + [r["count"] for r in rolled] == [10] * 12
+    assert coverage_split(t0, t0 + 7200, 600, None) == t0 + 7200
+    assert coverage_split(t0 + 3600, t0 + 7200, 600, covered) == t0 + 3600
+    store.close()
+
+
+def test_count_and_delete_range_drop_emptied_partitions(tmp_path):
+    store = SQLiteStore(str(tmp_path / "readings.sqlite3"))
+    store.insert([
+        reading("A", "2025-01-15T10:00:00Z", 10),
+        reading("INTEGRATION_TEST_001", "2025-01-20T10:00:00Z", 99),
+        reading("A", "2025-02-01T00:30:00Z", 12),
+        reading("B", "2025-02-01T01:30:00Z", 14),
+    ])
+    assert store.count("2025-01-01T00:00:00Z", "2025-03-01T00:00:00Z") == 3
+    assert store.count("2025-02-01T00:00:00Z", "2025-02-01T01:00:00Z") == 1
+
+    # Test readings are deleted too, and January is left empty so its table goes
+    assert store.delete_range("2025-01-01T00:00:00Z", "2025-02-01T01:00:00Z") == 3
+    tables = {r[0] for r in store._conn().execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert "readings_2025_01" not in tables and "readings_2025_02" in tables
+    assert [r["pm25"] for r in store.latest(5, include_test=True)] == [14]
+
+    mem = RollupStore(resolutions=(60, 3600))
+    mem.add({"device_id": "A", "pm1": 1, "pm25": 5, "pm10": 9}, 1738369800)
+    store.merge_rollups(mem.drain_dirty())
+    assert store.delete_rollups(60, "2025-02-01T00:00:00Z", "2025-02-01T01:00:00Z") == 1
+    assert store.rollup_range(60, "2025-02-01T00:00:00Z", "2025-02-02T00:00:00Z") == []
+    assert len(store.rollup_range(3600, "2025-02-01T00:00:00Z", "2025-02-02T00:00:00Z")) == 1
+    store.close()
+
+
+def test_insert_ignores_rows_already_stored(tmp_path):
+    path = str(tmp_path / "readings.sqlite3")
+    store = SQLiteStore(path)
+    first = reading("A", "2025-03-01T00:00:00Z", 10)
+    store.insert([first, reading("A", "2025-03-01T00:00:10Z", 11)])
+    # A retried batch: the same readings again plus a new one
+    store.insert([first, reading("A", "2025-03-01T00:00:10+00:00", 11), reading("A", "2025-03-01T00:00:20Z", 12)])
+    assert [r["pm25"] for r in store.latest(10)] == [12, 11, 10]
+
+    # A partition from before the unique key existed is cleaned up when it is opened
+    conn = store._conn()
+    conn.execute("DROP INDEX readings_2025_03_dedup_key")
+    conn.execute("INSERT INTO readings_2025_03 SELECT id + 100, device_id, pm1, pm25, pm10, aqi, timestamp, wifi_rssi, "
+                 "ip_address, created_at FROM readings_2025_03")
+    store.close()
+    store = SQLiteStore(path)
+    assert [r["pm25"] for r in store.latest(10)] == [12, 11, 10]
+
+
+def test_aggregate_any_width_several_metrics_and_percentiles(tmp_path):
+    store = SQLiteStore(str(tmp_path / "readings.sqlite3"))
+    # 7-minute buckets do not divide an hour: epoch-aligned, they start at 09:59 and 10:06
+    store.insert([reading("A", f"2025-03-01T10:0{m}:00Z", pm) for m, pm in ((1, 10), (5, 20), (6, 30), (9, 50))]
+                 + [reading("B", "2025-03-01T10:06:30Z", 60)])
+    data = store.aggregate("2025-03-01T10:00:00Z", "2025-03-01T11:00:00Z", 420, device_ids={"A", "B"},
+                           metrics=("pm25", "pm10"), stats=("avg", "min", "max", "count"), percentiles=(50, 90))
+    assert [(d["bucket_time"][11:19], d["count"]) for d in data] == [("09:59:00", 2), ("10:06:00", 3)]
+    assert data[1]["pm25"] == {"avg": 46.67, "min": 30, "max": 60, "count": 3, "p50": 50.0, "p90": 58.0}
+    assert data[1]["pm10"]["max"] == 65
+    assert store.aggregate("2025-03-01T10:00:00Z", "2025-03-01T11:00:00Z", 3600, device_ids={"A"})[0]["count"] == 4
+
+    for bad in ({"metrics": ("aqi",)}, {"stats": ("sum",)}, {"percentiles": (101,)}):
+        with pytest.raises(ValueError):
+            store.aggregate("2025-03-01T10:00:00Z", "2025-03-01T11:00:00Z", 60, **bad)
+    store.close()
+
+
+def test_aggregate_query_plan_uses_partition_indexes(tmp_path):
+    store = SQLiteStore(str(tmp_path / "readings.sqlite3"))
+    store.insert([reading(d, f"2025-03-01T10:{m:02d}:00Z", m) for d in "ABCD" for m in range(60)])
+    store._conn().execute("ANALYZE")
+
+    def plan(device_ids):
+        union, params = store._union("2025-03-01T10:00:00Z", "2025-03-01T10:10:00Z", f"{_EPOCH_SQL} AS epoch, pm25", device_ids)
+        sql = _aggregate_sql(union, ("pm25",), ("avg",))
+        return " | ".join(r[-1] for r in store._conn().execute("EXPLAIN QUERY PLAN " + sql, {**params, "start": "", "end": "", "w": 60}))
+
+    assert "USING INDEX readings_2025_03_device_created_idx (device_id=? AND created_at>? AND created_at<?)" in plan({"A"})
+    assert "USING INDEX readings_2025_03_created_idx (created_at>? AND created_at<?)" in plan(None)
+    store.close()
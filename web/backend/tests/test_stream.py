@@ -0,0 +1,49 @@
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stream import ReadingBroadcaster
+
+
+def test_publish_from_thread_reaches_filtered_subscribers():
+    async def scenario():
+        broadcaster = ReadingBroadcaster()
+        broadcaster.bind_loop(asyncio.get_running_loop())
+        everything = broadcaster.subscribe()
+        only_b = broadcaster.subscribe({"B"})
+
+        def mqtt_thread():
+            broadcaster.publish({"device_id": "A", "pm25": 1})
+            broadcaster.publish({"device_id": "B", "pm25": 2})
+
+        t = threading.Thread(target=mqtt_thread)
+        t.start()
+        t.join()
+        first = await asyncio.wait_for(everything.queue.get(), 1)
+        second = await asyncio.wait_for(everything.queue.get(), 1)
+        filtered = await asyncio.wait_for(only_b.queue.get(), 1)
+        assert [first["device_id"], second["device_id"]] == ["A", "B"]
+        assert filtered["device_id"] == "B"
+        assert only_b.queue.empty()
+
+    asyncio.run(scenario())
+
+
+def test_slow_subscriber_keeps_newest_readings():
+    async def scenario():
+        broadcaster = ReadingBroadcaster(queue_size=3)
+        broadcaster.bind_loop(asyncio.get_running_loop())
+        sub = broadcaster.subscribe()
+        for i in range(10):
+            broadcaster.publish({"device_id": "A", "pm25": i})
+        await asyncio.sleep(0.05)
+        received = [sub.queue.get_nowait()["pm25"] for _ in range(sub.queue.qsize())]
+        assert received == [7, 8, 9]
+        assert broadcaster.stats()["dropped"] == 7
+        broadcaster.unsubscribe(sub)
+        assert broadcaster.stats()["subscribers"] == 0
+
+    asyncio.run(scenario())